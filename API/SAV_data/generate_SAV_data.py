@@ -10,6 +10,11 @@ Description:
             - Values for the Qscore plot
             - Values for the 'summary' table
         - A SAV data file (CSV), containing the per Lane / Tile / Cycle data.
+          Or, with --format npy / npz, the same data as float32 columns (one .npy per column or a single .npz)
+          described by a SAV_data.json header, to be memory-mapped by the consumers.
+    With --chunked, the SAV data is streamed lane by lane, the memory being bounded by a single lane of the imaging table.
+    Several run folders (paths, glob patterns or a whole storage root) can be exported at once in batch mode,
+    across a process pool, the up to date runs being skipped.
     
     _Script based on the Illumina InterOP python library
     __Documentation : 
@@ -24,33 +29,51 @@ Date(s):
 Credits:
     Steeve Fourneaux
 """
+import os
+import sys
+import glob
 import json
+import time
+import shutil
+import zipfile
 import argparse
+import tempfile
 import collections
-import numpy as np
-import pandas as pd
+import concurrent.futures
 
-from interop import py_interop_run_metrics, py_interop_run, py_interop_summary, py_interop_table, py_interop_plot
+if __package__ in (None, ''):
+    # Run as a script (python API/SAV_data/generate_SAV_data.py): the API package is imported from the repository root
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from API.status.lib.lazy import lazy_import
+from API.status.lib.interop import load_imaging_metrics, qscore_histogram, bar_plot_arrays, format_qscore_bars, \
+    imaging_table_columns, imaging_table_data
+from API.status.lib.runfolders import RUNFOLDER_REGEX
+from API.status.lib.cache import run_fingerprint
+
+# Imported on their first use (see lazy.py): e.g --help or the up to date runs of a batch do not load them
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+py_interop_run_metrics = lazy_import('interop.py_interop_run_metrics')
+py_interop_summary = lazy_import('interop.py_interop_summary')
+py_interop_table = lazy_import('interop.py_interop_table')
+py_interop_metrics = lazy_import('interop.py_interop_metrics')
+
+# Metric sets copied lane by lane for the chunked export. The per-tile metric sets only: their records are keyed by tile.
+LANE_METRIC_SETS = ('corrected_intensity', 'error', 'extended_tile', 'extraction', 'image', 'q', 'q_collapsed', 'tile', 'index')
 
 
 ## -------------- SAV METRICS FOR SPARTA -------------- ##
 ## ---------------------------------------------------- ##
-def run_summary(run_folder, run_metrics, valid_to_load):
+def run_summary(run_metrics):
     """Gets the summary of a run
 
     Args:
-        run_folder (str): path of the run folder to analyse
         run_metrics (class): run_metrics class instance. Holding the binary interOP data
-        valid_to_load (uchar_vector): array indicating which InterOp files (== metrics) to load
 
     Returns:
         dict: per-read & total summary data. The collected metrics are listed in the 'columns' variable
     """
-    
-    # Defines some class instances
-    py_interop_run_metrics.list_summary_metrics_to_load(valid_to_load)
-    run_metrics.read(run_folder, valid_to_load)
-
     summary = py_interop_summary.run_summary()
     py_interop_summary.summarize_run_metrics(run_metrics, summary)
 
@@ -90,106 +113,366 @@ def run_summary(run_folder, run_metrics, valid_to_load):
     return result
 
 
-def get_qscore_data(run_folder, run_metrics, valid_to_load, is_nextseq=False):
+def get_qscore_data(run_metrics, is_nextseq=False):
     """Gets the QScore plot data (Number of cluster vs qscore)
 
     Args:
-        run_folder (str): path of the run folder to analyse
-        run_metrics (class): run_metrics class instance. Holding the binary interOP data.
-        valid_to_load (uchar_vector): array indicating which InterOp files (== metrics) to load
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data, Q metrics included.
         is_nextseq (bool, optional): whether the current sequencer is a NextSeq. Defaults to False.
 
     Returns:
         dict: qscore plot data
     """
-    # Defines some class instances
-    valid_to_load[py_interop_run.Q]=1
-    run_metrics.read(run_folder, valid_to_load)
-
-    # Collects the qscore data
-    # No boundary is defined because it generates a weird display
-    bar_data = py_interop_plot.bar_plot_data()
-    options = py_interop_plot.filter_options(run_metrics.run_info().flowcell().naming_method())
+    bar_data = qscore_histogram(run_metrics)
+    x, y, width = bar_plot_arrays(bar_data)
 
-    py_interop_plot.plot_qscore_histogram(run_metrics, options, bar_data)
-    
-    values = {}
-    widths = {}
-    for i in range(bar_data.size()):
-        for j in range(bar_data.at(i).size()):
-            x = bar_data.at(i).at(j).x()
-            y = bar_data.at(i).at(j).y()
-            width = bar_data.at(i).at(j).width()
-            values[int(x)] = y
-            widths[int(x)] = width
-    
-    if not is_nextseq:
-        for x_lbl in range(int(bar_data.xyaxes().x().max())):
-            if x_lbl + 1 not in values.keys():
-                values[x_lbl + 1] = 0
-
-    # Builds the results
-    ordered_values = collections.OrderedDict(sorted(values.items()))
-    ordered_widths = collections.OrderedDict(sorted(widths.items()))
-
-    result = {
-        'x_labels' : list(ordered_values.keys()),
-        'data': list(ordered_values.values()),
-        'widths': list(ordered_widths.values()),
+    result = format_qscore_bars(x, y, width, bar_data.xyaxes().x().max(), not is_nextseq)
+    result.update({
         'title': bar_data.title(),
         'x_title': bar_data.xyaxes().x().label(),
         'y_title': bar_data.xyaxes().y().label(),
         'y_min': bar_data.xyaxes().y().min(),
         'y_max': bar_data.xyaxes().y().max()
-    }
+    })
     return result
 
 
-def sav_metrics(run_folder, run_metrics, valid_to_load):
+def sav_dataframe(data, headers):
+    """Converts the header list and data ndarray into a Pandas table, on top of the float32 ndarray (no copy).
+
+    Args:
+        data (numpy.ndarray): imaging table data
+        headers (list): column headers
+
+    Returns:
+        pandas.DataFrame: SAV datatable
+    """
+    # index the table with the 3 first columns : lane / tile / cycle
+    df = pd.DataFrame(data, columns=headers, copy=False)
+    df.index = pd.MultiIndex.from_arrays([data[:, col] for col in range(3)], names=headers[:3])
+
+    return df
+
+
+def sav_metrics(run_metrics):
     """Gets the 'by cycle' and 'by lane' SAV data
 
     Args:
-        run_folder (str): path of the run folder to analyse
-        run_metrics (class): run_metrics class instance. Holding the binary interOP data.
-        valid_to_load (uchar_vector): array indicating which InterOp files (== metrics) to load
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data, imaging metrics included.
 
     Returns:
         pandas.DataFrame: SAV datatable
     """
+    columns, headers = imaging_table_columns(run_metrics)
+    return sav_dataframe(imaging_table_data(run_metrics, columns), headers)
 
-    # Load the interop files
-    py_interop_run_metrics.list_summary_metrics_to_load(valid_to_load, False)
-    run_metrics.read(run_folder, valid_to_load)
 
-    # The column headers for the imaging table can be created as follows:
-    columns = py_interop_table.imaging_column_vector()
-    py_interop_table.create_imaging_table_columns(run_metrics, columns)
+def lane_run_metrics(run_metrics, lane):
+    """Copies the metrics of a single lane into a new run_metrics instance, sharing the run info & parameters.
+    The metric sets keep the headers (version, channels, Q bins...) of the original ones.
 
-    # Convert the columns object to a list of strings.
-    headers = []
-    for i in range(columns.size()):
-        column = columns[i]
-        if column.has_children():
-            headers.extend([column.name()+"("+subname+")" for subname in column.subcolumns()])
-        else:
-            headers.append(column.name())
+    Args:
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data
+        lane (int): lane number
 
-    # The data from the imaging table populates a numpy ndarray
-    column_count = py_interop_table.count_table_columns(columns)
+    Returns:
+        class: run_metrics class instance, holding the lane data only
+    """
+    lane_metrics = py_interop_run_metrics.run_metrics(run_metrics.run_info(), run_metrics.run_parameters())
+    tiles = run_metrics.tile_metric_set().metrics_for_lane(lane)
+
+    for name in LANE_METRIC_SETS:
+        metric_set = getattr(run_metrics, name + '_metric_set')()
+        if metric_set.empty():
+            continue
+
+        lane_set = getattr(py_interop_metrics, 'base_' + name + '_metrics')(metric_set, metric_set.version())
+        for i in range(tiles.size()):
+            lane_set.append_tiles(metric_set, tiles[i])
+        getattr(lane_metrics, 'set_' + name + '_metric_set')(lane_set)
+
+    return lane_metrics
+
+
+def iter_sav_chunks(run_metrics):
+    """Iterates over the SAV data lane by lane, so that a single lane of the imaging table is held in memory at once.
+    The columns are those of the whole run, for every lane to share the same layout.
+
+    Args:
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data, imaging metrics included.
+
+    Yields:
+        pandas.DataFrame: SAV datatable of a lane
+    """
+    columns, headers = imaging_table_columns(run_metrics)
+    for lane in run_metrics.tile_metric_set().lanes():
+        yield sav_dataframe(imaging_table_data(lane_run_metrics(run_metrics, lane), columns), headers)
+
+
+def column_keys(headers):
+    """Gets the file / archive keys of the SAV columns.
+    The column names (e.g. 'Density(k/mm2)') are not safe as file names: the columns are stored by index
+
+    Args:
+        headers (list): column headers
+
+    Returns:
+        list: a key per column
+    """
+    return ['%03d' % col for col in range(len(headers))]
+
+
+def write_sav_header(output_dir, output_format, data_path, headers, index, rows):
+    """Writes the SAV_data.json header, describing the SAV data columns
+
+    Args:
+        output_dir (str): path of the output directory
+        output_format (str): 'npy' or 'npz'
+        data_path (str): path of the columns, relative to the output directory
+        headers (list): column headers
+        index (list): headers of the index columns
+        rows (int): number of rows
+    """
+    header = {
+        'format': output_format,
+        'path': data_path,
+        'dtype': 'float32',
+        'rows': rows,
+        'index': index,
+        'columns': [{'name': name, 'key': key} for name, key in zip(headers, column_keys(headers))]
+    }
+    with open(output_dir + 'SAV_data.json', 'w') as f:
+        f.write(json.dumps(header, indent=4))
+
+
+def write_sav_columns(sav_df, output_dir, output_format):
+    """Writes the SAV data as float32 columns, with a JSON header describing them.
+        - npy : one SAV_data/<index>.npy file per column, each one can be memory-mapped (numpy.load(mmap_mode='r'))
+        - npz : a single uncompressed SAV_data.npz archive, one <index> entry per column
+
+    Args:
+        sav_df (pandas.DataFrame): SAV datatable
+        output_dir (str): path of the output directory
+        output_format (str): 'npy' or 'npz'
+    """
+    keys = column_keys(sav_df.columns)
+    columns = {key: sav_df.iloc[:, col].to_numpy(dtype=np.float32) for col, key in enumerate(keys)}
+
+    if output_format == 'npy':
+        data_path = 'SAV_data'
+        os.makedirs(output_dir + data_path, exist_ok=True)
+        for key, values in columns.items():
+            np.save(os.path.join(output_dir + data_path, key + '.npy'), values)
+    else:
+        data_path = 'SAV_data.npz'
+        np.savez(output_dir + data_path, **columns)
+
+    write_sav_header(output_dir, output_format, data_path, list(sav_df.columns), list(sav_df.index.names), len(sav_df))
+
+
+def write_sav_chunks(run_metrics, output_dir, output_format):
+    """Streams the SAV data lane by lane to the output files: same outputs as the default export,
+    with a peak memory bounded by the imaging table of a single lane.
+        - csv : rows appended to SAV_data.csv
+        - npy / npz : rows written into memory-mapped .npy columns, sized from the run row count.
+                      The npz archive is then made of these .npy files (stored, as numpy.savez() does).
+
+    Args:
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data, imaging metrics included.
+        output_dir (str): path of the output directory
+        output_format (str): 'csv', 'npy' or 'npz'
+    """
+    if output_format == 'csv':
+        with open(output_dir + 'SAV_data.csv', 'w') as f:
+            for i, chunk in enumerate(iter_sav_chunks(run_metrics)):
+                chunk.to_csv(f, index=False, header=(i == 0))
+        return
+
+    columns, headers = imaging_table_columns(run_metrics)
     row_offsets = py_interop_table.map_id_offset()
     py_interop_table.count_table_rows(run_metrics, row_offsets)
+    rows = row_offsets.size()
+    del row_offsets
+
+    keys = column_keys(headers)
+    data_path = 'SAV_data' if output_format == 'npy' else 'SAV_data.npz'
+    columns_dir = output_dir + 'SAV_data' if output_format == 'npy' else tempfile.mkdtemp(dir=output_dir)
+    os.makedirs(columns_dir, exist_ok=True)
+
+    try:
+        files = [np.lib.format.open_memmap(os.path.join(columns_dir, key + '.npy'), mode='w+', dtype=np.float32, shape=(rows,))
+                 for key in keys]
+        start = 0
+        for chunk in iter_sav_chunks(run_metrics):
+            data = chunk.to_numpy()
+            for col, column_file in enumerate(files):
+                column_file[start:start + len(data)] = data[:, col]
+            start += len(data)
+        for column_file in files:
+            column_file.flush()
+        del files
+
+        if output_format == 'npz':
+            with zipfile.ZipFile(output_dir + data_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+                for key in keys:
+                    archive.write(os.path.join(columns_dir, key + '.npy'), key + '.npy')
+    finally:
+        if output_format == 'npz':
+            shutil.rmtree(columns_dir, ignore_errors=True)
+
+    write_sav_header(output_dir, output_format, data_path, headers, headers[:3], rows)
+
+
+def export_run(input_dir, output_dir, output_format='csv', chunked=False):
+    """Parses the InterOP files of a run folder and writes its Run summary & SAV data files
 
-    data = np.zeros((row_offsets.size(), column_count), dtype=np.float32)
-    py_interop_table.populate_imaging_table_data(run_metrics, columns, row_offsets, data.ravel())
+    Args:
+        input_dir (str): path of the run folder
+        output_dir (str): path of the output directory, ending with a '/'
+        output_format (str, optional): format of the SAV data file: 'csv', 'npy' or 'npz'. Defaults to 'csv'.
+        chunked (bool, optional): whether the SAV data is streamed lane by lane (see write_sav_chunks()). Defaults to False.
 
-    # Convert the header list and data ndarray into a Pandas table.
-    # index the table with the 3 first columns : lane / read / tile
-    d = []
-    for col, label in enumerate(headers):
-        d.append( (label, pd.Series([val for val in data[:, col]], index=[tuple(r) for r in data[:, :3]])))
-    df = pd.DataFrame.from_dict(dict(d))
-    
-    return df
+    Returns:
+        float: elapsed time, in seconds
+    """
+    start = time.perf_counter()
+
+    # Load the interop files once: imaging table metrics on top of the summary & Q metrics
+    run_metrics = load_imaging_metrics(input_dir)
+
+    # Compute the results
+    summary_result = {}
+    summary_result['qscore'] = get_qscore_data(run_metrics)
+    summary_result['summary'] = run_summary(run_metrics)
+
+    # Write the SAV file to a csv file, or as binary columns
+    if chunked:
+        write_sav_chunks(run_metrics, output_dir, output_format)
+    elif output_format == 'csv':
+        sav_metrics(run_metrics).to_csv(output_dir + 'SAV_data.csv', index=False)
+    else:
+        write_sav_columns(sav_metrics(run_metrics), output_dir, output_format)
+
+    # Write the run summary file to a json file
+    with open(output_dir + 'Run_summary.json', 'w') as f:
+        f.write(json.dumps(summary_result, indent=4))
+
+    return time.perf_counter() - start
+
+
+## -------------------- BATCH MODE -------------------- ##
+## ---------------------------------------------------- ##
+def find_runfolders(inputs, root=None):
+    """Lists the run folders to export, from paths / glob patterns and from a storage root.
+    Under the storage root, any directory holding a RunInfo.xml and named after the Illumina run folder format is a run.
+
+    Args:
+        inputs (list): paths or glob patterns of run folders
+        root (str, optional): path of a storage root, searched recursively. Defaults to None.
+
+    Returns:
+        list: sorted paths of the run folders, without duplicates
+    """
+    run_dirs = set()
+    for pattern in inputs:
+        run_dirs.update(path for path in glob.glob(pattern) if os.path.isdir(path))
+
+    if root:
+        for current_dir, dirs, files in os.walk(root):
+            if 'RunInfo.xml' in files and RUNFOLDER_REGEX.match(current_dir):
+                run_dirs.add(current_dir)
+                # Do not walk through the run folder content
+                dirs[:] = []
+
+    return sorted(os.path.normpath(run_dir) for run_dir in run_dirs)
+
+
+def is_up_to_date(run_dir, output_dir, output_format):
+    """Checks whether the outputs of a run are newer than all of its InterOP inputs
+
+    Args:
+        run_dir (str): path of the run folder
+        output_dir (str): path of the output directory of the run, ending with a '/'
+        output_format (str): format of the SAV data file
+
+    Returns:
+        bool: True if the run does not need to be exported again
+    """
+    outputs = ['Run_summary.json', 'SAV_data.csv' if output_format == 'csv' else 'SAV_data.json']
+    try:
+        output_mtime = min(os.stat(output_dir + filename).st_mtime_ns for filename in outputs)
+    except FileNotFoundError:
+        return False
+
+    input_mtime = max([mtime for path, mtime, size in run_fingerprint(run_dir) if mtime is not None], default=None)
+    return input_mtime is not None and output_mtime > input_mtime
+
+
+def _export_job(run_dir, output_dir, output_format, chunked):
+    """Process pool job: exports a run, reporting the failure instead of raising it
+
+    Returns:
+        tuple: (run folder, elapsed time in seconds, error message or None)
+    """
+    start = time.perf_counter()
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        return run_dir, export_run(run_dir, output_dir, output_format, chunked), None
+    except Exception as e:
+        return run_dir, time.perf_counter() - start, '%s: %s' % (type(e).__name__, e)
+
+
+def export_runs(run_dirs, output_root, output_format='csv', jobs=1, force=False, chunked=False):
+    """Exports many run folders across a process pool, each one in its own <output_root>/<run folder name>/ directory.
+    The runs whose outputs are newer than their InterOP files are skipped, unless -force-.
+
+    Args:
+        run_dirs (list): paths of the run folders
+        output_root (str): path of the output root directory
+        output_format (str, optional): format of the SAV data files. Defaults to 'csv'.
+        jobs (int, optional): number of processes. Defaults to 1.
+        force (bool, optional): whether the up to date runs are exported again. Defaults to False.
+        chunked (bool, optional): whether the SAV data is streamed lane by lane. Defaults to False.
+
+    Returns:
+        list: (run folder, status, elapsed time in seconds, error message or None) for each run
+    """
+    report = []
+    todo = []
+    for run_dir in run_dirs:
+        output_dir = os.path.join(output_root, os.path.basename(run_dir), '')
+        if not force and is_up_to_date(run_dir, output_dir, output_format):
+            report.append((run_dir, 'skipped', 0.0, None))
+        else:
+            todo.append((run_dir, output_dir, output_format, chunked))
+
+    if jobs > 1 and len(todo) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_export_job, *zip(*todo)))
+    else:
+        results = [_export_job(*job) for job in todo]
+
+    report += [(run_dir, 'failed' if error else 'done', elapsed, error) for run_dir, elapsed, error in results]
+    return sorted(report)
+
+
+def print_report(report, elapsed):
+    """Prints the per-run timing and the failures of a batch export
+
+    Args:
+        report (list): result of export_runs()
+        elapsed (float): total elapsed time, in seconds
+    """
+    for run_dir, status, run_elapsed, error in report:
+        print('%-8s %8.2fs  %s' % (status, run_elapsed, run_dir))
+
+    counts = collections.Counter(status for run_dir, status, run_elapsed, error in report)
+    print('\n%d run(s): %d done, %d skipped, %d failed, in %.2fs' % (
+        len(report), counts['done'], counts['skipped'], counts['failed'], elapsed))
+
+    for run_dir, status, run_elapsed, error in report:
+        if error:
+            print('FAILED %s\n    %s' % (run_dir, error))
 
 
 def main():
@@ -198,35 +481,41 @@ def main():
 
     Produce 2 results designed from the SAV summary tab:
         - Run summary data, written within a json file
-        - SAV data as a csv file for further use in the quality pipeline
+        - SAV data as a csv file (or float32 columns, see write_sav_columns()) for further use in the quality pipeline
+
+    A single --input run folder is written straight into the --output dir.
+    Several inputs, a glob pattern or a --root storage are exported in batch (see export_runs()).
     """
     # Arguments
     parser = argparse.ArgumentParser(description='InterOP API - SAV Analysis')
-    parser.add_argument('-i', '--input', help='Path of the runfolder to be analysed', required=True)
+    parser.add_argument('-i', '--input', help='Path(s) or glob pattern(s) of the runfolder(s) to be analysed', nargs='+', default=[])
+    parser.add_argument('-r', '--root', help='Path of a storage root: every runfolder found below is analysed (batch mode)')
     parser.add_argument('-o', '--output', help='Path of the output dierctory. The output files will be written in that dir.', required=True)
+    parser.add_argument('-f', '--format', help='Format of the SAV data file. Defaults to csv.', choices=('csv', 'npy', 'npz'), default='csv')
+    parser.add_argument('-c', '--chunked', help='Stream the SAV data lane by lane, to bound the memory used by large flowcells', action='store_true')
+    parser.add_argument('-j', '--jobs', help='Number of processes of the batch mode. Defaults to 1.', type=int, default=1)
+    parser.add_argument('--force', help='Batch mode: also analyse the runs whose outputs are up to date', action='store_true')
 
     # Initiate some variables based on the arguments
     args = parser.parse_args()
-    input_dir = args.input
     output_dir = args.output
+    output_format = args.format
 
-    # Defines some class instances
-    run_metrics = py_interop_run_metrics.run_metrics()
-    valid_to_load = py_interop_run.uchar_vector(py_interop_run.MetricCount, 0)
+    if not args.input and not args.root:
+        parser.error('one of the arguments -i/--input -r/--root is required')
 
-    # Compute the results
-    sav_df = sav_metrics(input_dir, run_metrics, valid_to_load)
+    is_batch = args.root or len(args.input) > 1 or glob.has_magic(args.input[0])
+    if not is_batch:
+        export_run(args.input[0], output_dir, output_format, args.chunked)
+        return
 
-    summary_result = {}
-    summary_result['qscore'] = get_qscore_data(input_dir, run_metrics, valid_to_load)
-    summary_result['summary'] = run_summary(input_dir, run_metrics, valid_to_load)
-    
-    # Write the SAV file to a csv file
-    sav_df.to_csv(output_dir + 'SAV_data.csv', index=False)
+    start = time.perf_counter()
+    run_dirs = find_runfolders(args.input, args.root)
+    report = export_runs(run_dirs, output_dir, output_format, max(args.jobs, 1), args.force, args.chunked)
+    print_report(report, time.perf_counter() - start)
 
-    # Write the run summary file to a json file
-    with open(output_dir + 'Run_summary.json', 'w') as f:
-        f.write(json.dumps(summary_result, indent=4))
+    if any(error for run_dir, status, elapsed, error in report):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
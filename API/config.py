@@ -0,0 +1,77 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Settings of the API, overridable with environment variables (e.g. in bin/gunicorn_start)
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+
+
+# Main storage path in the local acquisition server. Should contain 1 dir per sequencer
+STORE_ROOT = os.environ.get('INTEROP_STORE_ROOT', '/PATH/TO/MAIN/STORAGE')
+# The different sequencer name. Allows to find their root directory
+SEQ_LIST = os.environ.get('INTEROP_SEQ_LIST', 'MiSeq,NextSeq,NovaSeq').split(',')
+# Number of sequencer. Set the number of sequencer root directory to retrieve
+SEQ_NB = int(os.environ.get('INTEROP_SEQ_NB', 4))
+
+# Compact Q score plot series (NextSeq & NovaSeq): 'pointStart' offset instead of the None padding
+COMPACT_PLOT = os.environ.get('INTEROP_COMPACT_PLOT', '0').lower() in ('1', 'true', 'yes')
+
+# Json file persisting the index of the run folders between restarts. Empty keeps it in memory only
+RUN_INDEX_FILE = os.environ.get('INTEROP_RUN_INDEX', '')
+
+# Interval (seconds) of the background refresh of the /interop/ snapshot
+# 0 disables the refresher: the status is computed within each request
+REFRESH_INTERVAL = float(os.environ.get('INTEROP_REFRESH_INTERVAL', 0))
+# Interval (seconds) of the background refresh feeding /interop/stream, when REFRESH_INTERVAL is 0
+STREAM_INTERVAL = float(os.environ.get('INTEROP_STREAM_INTERVAL', 10))
+# Delay (seconds) between 2 keep-alive comments of an idle stream
+STREAM_KEEPALIVE = float(os.environ.get('INTEROP_STREAM_KEEPALIVE', 15))
+
+# Number of sequencers parsed concurrently. 1 parses them one after another
+WORKERS = int(os.environ.get('INTEROP_WORKERS', 1))
+# Kind of pool parsing the sequencers: 'thread' or 'process'
+EXECUTOR = os.environ.get('INTEROP_EXECUTOR', 'thread')
+# Per-sequencer timeout (seconds) when parsed concurrently. 0 waits for every run
+SEQ_TIMEOUT = float(os.environ.get('INTEROP_SEQ_TIMEOUT', 0))
+# Per-sequencer deadline (seconds) of /interop/, read by the asyncio path (see status/deadlines.py):
+# a sequencer missing it is served its last known result, marked stale. 0 reads every sequencer synchronously
+SEQ_DEADLINE = float(os.environ.get('INTEROP_SEQ_DEADLINE', 0))
+
+# Directory of the memory-mapped imaging tables serving /interop/run/<run>/tiles. Empty disables the endpoint
+SAV_STORE_DIR = os.environ.get('INTEROP_SAV_STORE', '')
+
+# SQLite archive of the completed runs, serving /interop/history. Empty disables it
+ARCHIVE_FILE = os.environ.get('INTEROP_ARCHIVE', '')
+
+# SQLite store of the run results shared by the gunicorn workers, each run being parsed by 1 worker at a time.
+# Empty keeps the results per worker
+SHARED_CACHE_FILE = os.environ.get('INTEROP_SHARED_CACHE', '')
+# Delay (seconds) after which the run parsed by a worker which did not release it (e.g killed) can be parsed by another
+LEASE_TIMEOUT = float(os.environ.get('INTEROP_LEASE_TIMEOUT', 120))
+
+# Profiling of the slow /interop/ requests, see API/profiling.py
+# Profiles every request when enabled, otherwise only those sending the X-Interop-Profile header with the secret
+PROFILE_ENABLED = os.environ.get('INTEROP_PROFILE', '0').lower() in ('1', 'true', 'yes')
+# Shared secret of the X-Interop-Profile header. Empty disables the header
+PROFILE_SECRET = os.environ.get('INTEROP_PROFILE_SECRET', '')
+# Duration (seconds) above which the profile of a request is written
+PROFILE_THRESHOLD = float(os.environ.get('INTEROP_PROFILE_THRESHOLD', 2))
+# Directory of the written profiles
+PROFILE_DIR = os.environ.get('INTEROP_PROFILE_DIR', 'logs')
+
+# Counts the bytes of the InterOP files read by the InterOP library (interop_read_bytes_total), at the cost of
+# a directory scan per metric & run parsing. Always counted when profiling is enabled
+COUNT_INTEROP_BYTES = os.environ.get('INTEROP_COUNT_BYTES', '0').lower() in ('1', 'true', 'yes')
+
+# Heavy modules (numpy, the InterOP bindings) imported when the app is loaded rather than by the first request,
+# e.g by the gunicorn master with --preload, the workers sharing them. 0 to import them on their first use only
+PRELOAD_MODULES = os.environ.get('INTEROP_PRELOAD', '1').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,153 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Opt-in profiling of the slow requests.
+      A profiled request running longer than a threshold dumps its cProfile to the logs directory,
+      tagged with the run folders it served. Disabled, the hook costs a couple of attribute lookups per request.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import io
+import os
+import re
+import hmac
+import time
+import pstats
+import logging
+import cProfile
+import functools
+import contextlib
+import threading
+from datetime import datetime
+
+from flask import request, g
+
+from API import config
+
+logger = logging.getLogger(__name__)
+
+# Header enabling the profiling of a request, holding the shared secret (INTEROP_PROFILE_SECRET)
+PROFILE_HEADER = 'X-Interop-Profile'
+# Number of functions listed in the text report of a profile
+REPORT_LINES = 40
+# Maximum length of the run folders tag in the profile file names
+MAX_TAG_LENGTH = 120
+
+# cProfile traces a single thread: 1 profiled request at a time per worker, the others run as usual
+_profile_lock = threading.Lock()
+
+
+def is_requested():
+    """Checks whether the current request should be profiled: profiling enabled for all the requests
+    (INTEROP_PROFILE) or a PROFILE_HEADER matching the shared secret
+
+    Returns:
+        bool: True to profile the request
+    """
+    if config.PROFILE_ENABLED:
+        return True
+    secret = config.PROFILE_SECRET
+    if not secret:
+        return False
+    header = request.headers.get(PROFILE_HEADER)
+    return header is not None and hmac.compare_digest(header.encode(), secret.encode())
+
+
+def tag_runs(run_names):
+    """Records the run folders served by the current request, to tag its profile
+
+    Args:
+        run_names (iterable): names of the run folders
+    """
+    g.profile_runs = [name for name in run_names if name]
+
+
+def _runs_tag(run_names):
+    """Builds a file name safe tag from the run folder names"""
+    tag = re.sub(r'[^\w.+-]', '_', '+'.join(run_names)) or 'no-run'
+    return tag[:MAX_TAG_LENGTH]
+
+
+def dump_profile(profile, endpoint, duration, run_names, directory=None):
+    """Writes a profile to -directory-: the raw stats (.prof, to be opened with pstats or snakeviz)
+    and a text report of the most expensive functions (.txt)
+
+    Args:
+        profile (cProfile.Profile): stopped profile
+        endpoint (str): name of the profiled endpoint
+        duration (float): duration of the request, in seconds
+        run_names (list): run folders served by the request
+        directory (str, optional): output directory. Defaults to config.PROFILE_DIR.
+
+    Returns:
+        str: path of the .prof file
+    """
+    directory = directory or config.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = 'profile_%s_%s_%.0fms_pid%d_%s' % (datetime.now().strftime('%Y%m%d-%H%M%S'), endpoint, duration * 1000,
+                                           os.getpid(), _runs_tag(run_names))
+    path = os.path.join(directory, name + '.prof')
+    profile.dump_stats(path)
+
+    report = io.StringIO()
+    report.write('Endpoint: %s\nURL: %s\nDuration: %.3f s\nRun folders: %s\n\n'
+                 % (endpoint, request.full_path, duration, ', '.join(run_names) or '-'))
+    pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(REPORT_LINES)
+    with open(os.path.join(directory, name + '.txt'), 'w') as f:
+        f.write(report.getvalue())
+
+    return path
+
+
+@contextlib.contextmanager
+def profile_request():
+    """Profiles the current request when requested (see is_requested()), one request at a time per process.
+    The profile is written by dump_profile() when the request lasts longer than config.PROFILE_THRESHOLD seconds.
+    """
+    if not is_requested() or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+
+    try:
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            duration = time.perf_counter() - start
+            if duration >= config.PROFILE_THRESHOLD:
+                try:
+                    path = dump_profile(profile, request.endpoint, duration, g.get('profile_runs', []))
+                    logger.warning('Slow request %s (%.3f s), profile written to %s', request.full_path, duration, path)
+                except OSError:
+                    logger.exception('Failed to write the profile of %s', request.full_path)
+    finally:
+        _profile_lock.release()
+
+
+def profiled(view):
+    """Decorates a view to profile its slow requests, see profile_request().
+    The view tags its run folders with tag_runs().
+    Only the request thread is traced: the sequencers parsed by a pool (INTEROP_WORKERS > 1) show as waits.
+
+    Args:
+        view (function): Flask view
+
+    Returns:
+        function: the decorated view
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with profile_request():
+            return view(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,109 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      JSON responses of the API: fast serialization, conditional GET (ETag / Last-Modified) & gzip compression.
+      orjson is used when installed, the standard json module otherwise.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import json
+import gzip
+import hashlib
+
+from flask import current_app, request
+
+from API.status.lib.lazy import lazy_import
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+np = lazy_import('numpy')
+
+# Bodies smaller than this (bytes) are not worth compressing
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+
+
+def dumps(data):
+    """Serializes the API results, i.e nested dicts & lists of numbers and strings (e.g the q30_plot series),
+    or numpy arrays (e.g the imaging table columns).
+    Keys are not sorted and no whitespace is added, unlike the Flask default encoder.
+
+    Args:
+        data (dict): result to serialize
+
+    Returns:
+        bytes: JSON document
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS, default=float)
+    return json.dumps(data, separators=(',', ':'), check_circular=False, default=_json_default).encode('utf-8')
+
+
+def _json_default(value):
+    """Converts the numpy values for the standard json encoder: arrays as lists, NaN as null (as orjson does)"""
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f':
+            return np.where(np.isnan(value), None, value.astype(object)).tolist()
+        return value.tolist()
+    return float(value)
+
+
+def compute_etag(body):
+    """Gets the entity tag of a body
+
+    Args:
+        body (bytes): response body
+
+    Returns:
+        str: hash of the body
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def json_response(data, etag=None, last_modified=None, headers=None, status=200):
+    """Builds the JSON response of a result.
+    Answers 304 when the If-None-Match / If-Modified-Since headers of the request match,
+    and compresses the body when the client accepts gzip.
+
+    The ETag is weak: the body may differ by volatile fields (e.g the age of a snapshot) for the same -etag-.
+
+    Args:
+        data (dict): result to send
+        etag (str, optional): entity tag of the result. Defaults to None, computed from the body.
+        last_modified (float, optional): timestamp of the last change of the result. Defaults to None.
+        headers (dict, optional): extra headers. Defaults to None.
+        status (int, optional): HTTP status code. Defaults to 200, the only one answered conditionally.
+
+    Returns:
+        flask.Response: the response
+    """
+    body = dumps(data)
+
+    response = current_app.response_class(body, status=status, mimetype='application/json', headers=headers)
+    if status != 200:
+        return response
+
+    response.set_etag(etag or compute_etag(body), weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.vary.add('Accept-Encoding')
+
+    response.make_conditional(request)
+    if response.status_code != 200:
+        return response
+
+    if 'gzip' in request.accept_encodings and len(body) >= GZIP_MIN_SIZE:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        response.content_encoding = 'gzip'
+
+    return response
@@ -12,17 +12,46 @@ Date(s):
 Credits:
     Steeve Fourneaux
 """
-from flask import Flask
+import time
+from datetime import datetime
+
+from flask import Flask, Response, request, stream_with_context, g
 from flask_cors import CORS
 
-from API.status.main import get_latest_run_status
+from API import config
+from API.status.main import get_latest_run_status, get_sequencer_status, get_runfolder_status, get_runfolder_tiles, \
+    get_run_history, render_metrics
+from API.status.lib.instrumentation import instrumentation
+from API.status.deadlines import get_latest_run_status_deadline
+from API.status.refresher import get_snapshot, event_log
+from API.status.events import format_event
+from API.responses import json_response, dumps
+from API.profiling import profiled, tag_runs
 
 # Init the app
 app = Flask(__name__)
-cors = CORS(app, resources={r"/interop/": {"origins": "*"}})
+cors = CORS(app, resources={r"/interop/*": {"origins": "*"}})
+
+
+@app.before_request
+def start_timer():
+    """Starts the request timer, see record_duration()"""
+    g.start_time = time.perf_counter()
+
+
+@app.after_request
+def record_duration(response):
+    """Records the duration of the request, per endpoint (time to the first byte for the streams)"""
+    start = g.get('start_time')
+    if start is not None:
+        instrumentation.observe('interop_request_duration_seconds', time.perf_counter() - start,
+                                endpoint=request.endpoint or 'unknown')
+    return response
+
 
 # Routes
 @app.route("/interop/", methods=['GET'])
+@profiled
 def real_time_data():
     """Gets the real-time data of the sequencers
     
@@ -37,14 +66,185 @@ def real_time_data():
               - NovaSeq1
               - NovaSeq2
 
+    The parameters are held by API/config.py.
+    When the background refresher is enabled (INTEROP_REFRESH_INTERVAL), the latest
+    precomputed snapshot is returned, each sequencer holding its 'generated_at' & 'age'.
+    Otherwise, with a per-sequencer deadline (INTEROP_SEQ_DEADLINE), the sequencers are read by a thread pool:
+    a sequencer missing the deadline is served its last known result, marked 'stale' (see status/deadlines.py).
+    Supports conditional GET (ETag / If-None-Match) and gzip compression.
+    The slow requests can be profiled, see API/profiling.py.
+
     Returns:
         [dict]: Real-time result per sequencer
     """
-    # TODO should use a config file to hold these parameters
-    store_root = '/PATH/TO/MAIN/STORAGE'
-    seq_list = ['MiSeq', 'NextSeq', 'NovaSeq']   # The different sequencer name. Allows to find their root directory
-    seq_nb = 4                                   # number of sequencer. Set the number of sequencer root directory to retrieve
+    store_root = config.STORE_ROOT
+    seq_list = config.SEQ_LIST    # The different sequencer name. Allows to find their root directory
+    seq_nb = config.SEQ_NB        # number of sequencer. Set the number of sequencer root directory to retrieve
+
+    # Returns the precomputed snapshot
+    if config.REFRESH_INTERVAL:
+        snapshot = get_snapshot(store_root, seq_list, seq_nb, config.REFRESH_INTERVAL)
+        result = {
+            seq: {**data, 'generated_at': snapshot['generated_at'], 'age': round(snapshot['age'], 1)}
+            for seq, data in snapshot['data'].items()
+        }
+        tag_runs(data.get('run_name') for data in result.values())
+        return json_response(result, etag=snapshot['etag'], last_modified=snapshot['modified_at'],
+                             headers={'Age': str(int(snapshot['age']))})
 
     # Returns main quality metrics of the last run for each sequencer
-    result = get_latest_run_status(store_root, seq_list, seq_nb)
-    return result
+    if config.SEQ_DEADLINE:
+        result = get_latest_run_status_deadline(store_root, seq_list, seq_nb, config.SEQ_DEADLINE)
+    else:
+        result = get_latest_run_status(store_root, seq_list, seq_nb)
+    tag_runs(data.get('run_name') for data in result.values())
+    return json_response(result)
+
+
+
+@app.route("/interop/<sequencer>", methods=['GET'])
+def sequencer_data(sequencer):
+    """Gets the real-time data of a single sequencer, e.g /interop/MiSeq1 or /interop/NovaSeq1_A
+    Only the directories of that sequencer & its latest run are read.
+
+    Returns:
+        [dict]: Real-time result of the sequencer
+    """
+    result = get_sequencer_status(config.STORE_ROOT, config.SEQ_LIST, config.SEQ_NB, sequencer)
+    if result is None:
+        return json_response({'error': 'No run found for the sequencer %s' % sequencer}, status=404)
+    return json_response(result)
+
+
+@app.route("/interop/run/<run_folder_name>", methods=['GET'])
+def run_data(run_folder_name):
+    """Gets the data of a run folder, e.g /interop/run/220101_NB551_0001_AHXXXXXX
+    The run does not need to be the latest of its sequencer.
+
+    Returns:
+        [dict]: Result of the run, with its sequencer name
+    """
+    result = get_runfolder_status(config.STORE_ROOT, config.SEQ_LIST, config.SEQ_NB, run_folder_name)
+    if result is None:
+        return json_response({'error': 'Run folder %s not found' % run_folder_name}, status=404)
+    return json_response(result)
+
+
+@app.route("/interop/history", methods=['GET'])
+def run_history():
+    """Lists the completed runs frozen in the archive (INTEROP_ARCHIVE), the most recently completed first,
+    e.g /interop/history?sequencer=NovaSeq1_A&start=2022-01-01&end=2022-03-31&limit=20&offset=0
+    The full result of an archived run is served by /interop/run/<run_folder_name>.
+
+    Query parameters, all optional: sequencer, start & end (completion days, YYYY-MM-DD, included),
+    limit (default 100, max 1000) & offset.
+
+    Returns:
+        [dict]: total number of matching runs & the main metrics of the selected runs
+    """
+    if not config.ARCHIVE_FILE:
+        return json_response({'error': 'The run archive is disabled (INTEROP_ARCHIVE)'}, status=404)
+
+    try:
+        for bound in ('start', 'end'):
+            if request.args.get(bound):
+                datetime.strptime(request.args[bound], '%Y-%m-%d')
+        limit = min(max(int(request.args.get('limit') or 100), 0), 1000)
+        offset = max(int(request.args.get('offset') or 0), 0)
+    except ValueError as e:
+        return json_response({'error': 'Invalid query parameter: %s' % e}, status=400)
+
+    result = get_run_history(request.args.get('sequencer') or None, request.args.get('start') or None,
+                             request.args.get('end') or None, limit, offset)
+    return json_response(result)
+
+
+@app.route("/interop/run/<run_folder_name>/tiles", methods=['GET'])
+def run_tiles_data(run_folder_name):
+    """Gets the per lane / tile / cycle data (SAV imaging table) of a run folder,
+    e.g /interop/run/220101_NB551_0001_AHXXXXXX/tiles?lane=1&tile_min=1101&tile_max=1114&cycle_min=1&cycle_max=25&columns=%25>= Q30
+
+    Query parameters, all optional: lane, read, tile_min, tile_max, cycle_min, cycle_max (numbers, bounds included)
+    & columns (comma separated names). The lane, tile & cycle columns are always returned.
+    Served from the memory-mapped imaging table store (INTEROP_SAV_STORE), without reading InterOP per query.
+
+    Returns:
+        [dict]: run name, all the column names, number of rows & the selected data per column (NaN as null)
+    """
+    if not config.SAV_STORE_DIR:
+        return json_response({'error': 'The imaging table store is disabled (INTEROP_SAV_STORE)'}, status=404)
+
+    try:
+        filters = {
+            'lane': int(request.args['lane']) if request.args.get('lane') else None,
+            'read': int(request.args['read']) if request.args.get('read') else None,
+            'tiles': tuple(int(request.args[bound]) if request.args.get(bound) else None for bound in ('tile_min', 'tile_max')),
+            'cycles': tuple(int(request.args[bound]) if request.args.get(bound) else None for bound in ('cycle_min', 'cycle_max')),
+            'columns': [name.strip() for name in request.args['columns'].split(',')] if request.args.get('columns') else None
+        }
+    except ValueError as e:
+        return json_response({'error': 'Invalid query parameter: %s' % e}, status=400)
+
+    stored = get_runfolder_tiles(config.STORE_ROOT, config.SEQ_LIST, config.SEQ_NB, run_folder_name)
+    if stored is None:
+        return json_response({'error': 'Run folder %s not found' % run_folder_name}, status=404)
+
+    unknown = [name for name in filters['columns'] or [] if name not in stored.headers]
+    if unknown:
+        return json_response({'error': 'Unknown column(s): %s' % ', '.join(unknown), 'columns': stored.headers}, status=400)
+
+    data = stored.query(**filters)
+    return json_response({
+        'run_name': run_folder_name,
+        'columns': stored.headers,
+        'rows': len(data[stored.headers[0]]) if stored.headers else 0,
+        'data': data
+    })
+
+
+@app.route("/interop/stream", methods=['GET'])
+def stream_status():
+    """Streams the per-sequencer status changes as Server-Sent Events.
+
+    An event is pushed for a sequencer only when its status, last cycle or summary metrics change.
+    All the clients are fed by the background refresher, which parses the runs once per interval.
+    A client reconnecting with a Last-Event-ID header (or a last_event_id parameter) catches up
+    from that event, otherwise it first receives the current state of every sequencer.
+
+    Returns:
+        [Response]: text/event-stream response
+    """
+    interval = config.REFRESH_INTERVAL or config.STREAM_INTERVAL
+    token = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    # Starts the refresher, which publishes the status changes
+    get_snapshot(config.STORE_ROOT, config.SEQ_LIST, config.SEQ_NB, interval)
+
+    def events():
+        last = event_log.parse_token(token)
+        while True:
+            new_events = event_log.wait_events(last, timeout=config.STREAM_KEEPALIVE) if last is not None else None
+            # Resync the client with the state of every sequencer
+            if new_events is None:
+                new_events = event_log.current()
+
+            last, new_events = new_events
+            if not new_events:
+                yield b': keep-alive\n\n'
+
+            for event_id, seq, result in new_events:
+                yield format_event(event_id, seq, result, dumps)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics_data():
+    """Exposes the instrumentation in the Prometheus text exposition format: latency histograms per stage
+    & per sequencer, requests latency per endpoint, bytes of InterOP read & run cache hit ratio.
+    The values are those of the worker process answering the scrape.
+
+    Returns:
+        [Response]: text/plain response
+    """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,227 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Asyncio path of the /interop/ endpoint, with a deadline per sequencer (INTEROP_SEQ_DEADLINE).
+      The storage listing & each sequencer root dir are read by a thread pool. A sequencer missing the deadline
+      (e.g slow or hung NFS mount) is served its last known result, marked 'stale', so that the response time is
+      bounded by the deadline rather than by the slowest mount. A job still blocked after its deadline is not
+      submitted again by the next requests: they wait for the same job.
+      The /interop/ view stays synchronous, running the asyncio path in an event loop of its own only when the
+      deadline is enabled.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+from .. import config
+from .main import run_index, shared_cache, get_run_status, get_archived_status, handle_timed_out_run
+from .lib.executor import get_executor
+from .lib.runfolders import sequencer_name
+from .lib.instrumentation import instrumentation, stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Latest result of each sequencer: its root dir, the result & the time it was computed at
+_last_results = {}
+_last_results_lock = threading.Lock()
+
+# Jobs of the pool per key (storage listing or root dir), so that a blocked job is not submitted twice
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def read_rootdir(rootdir):
+    """Gets the status of the latest runs of a sequencer root dir, run by the pool.
+    The results are kept as the last known ones, even when completed after the deadline.
+
+    Args:
+        rootdir (str): path of the root directory of a sequencer
+
+    Returns:
+        dict: real time quality metrics per sequencer name
+    """
+    statuses = {}
+    for seq, last_run_dir in run_index.rootdir_latest_runs(rootdir).items():
+        statuses[seq] = get_run_status(seq, last_run_dir)
+
+    now = time.time()
+    with _last_results_lock:
+        for seq, result in statuses.items():
+            _last_results[seq] = {'rootdir': rootdir, 'result': result, 'computed_at': now}
+    return statuses
+
+
+def submit_once(executor, key, function, *args):
+    """Submits a job to the pool, unless the job of the same key is still running
+
+    Args:
+        executor (concurrent.futures.Executor): thread pool
+        key (str or tuple): job key, e.g the root dir
+        function (function): job
+        *args: arguments of the job
+
+    Returns:
+        concurrent.futures.Future: future of the job
+    """
+    def forget(future):
+        with _inflight_lock:
+            if _inflight.get(key) is future:
+                del _inflight[key]
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = _inflight[key] = executor.submit(function, *args)
+
+    future.add_done_callback(forget)
+    return future
+
+
+def watch(loop, future):
+    """Gets an asyncio future resolved with a pool future once done.
+    Unlike asyncio.wrap_future(), the pool future is not cancelled with it, as other requests may wait for the job,
+    and a job completed after the loop closed (the response being already sent) is ignored.
+
+    Args:
+        loop (asyncio.AbstractEventLoop): event loop of the request
+        future (concurrent.futures.Future): future of the job
+
+    Returns:
+        asyncio.Future: future holding the done pool future
+    """
+    waiter = loop.create_future()
+
+    def resolve(done):
+        if not waiter.done():
+            waiter.set_result(done)
+
+    def notify(done):
+        try:
+            loop.call_soon_threadsafe(resolve, done)
+        except RuntimeError:
+            # Loop closed: the request was answered without this job
+            pass
+
+    future.add_done_callback(notify)
+    return waiter
+
+
+def mark_stale(entry):
+    """Marks a last known result as stale, with the time it was computed at
+
+    Args:
+        entry (dict): last known result, see read_rootdir()
+
+    Returns:
+        dict: copy of the result, with 'stale', 'generated_at' & 'age'
+    """
+    return {**entry['result'], 'stale': True,
+            'generated_at': datetime.fromtimestamp(entry['computed_at']).isoformat(timespec='seconds'),
+            'age': round(max(0.0, time.time() - entry['computed_at']), 1)}
+
+
+def stale_status(rootdir, deadline):
+    """Gets the results of the sequencers of a root dir which missed the deadline, without reading the storage:
+    the last result of this process, else the latest result shared by another worker or archived, for the
+    latest runs known by the run index. A timeout when none is found.
+
+    Args:
+        rootdir (str): path of the root directory of a sequencer
+        deadline (float): per-sequencer deadline, in seconds
+
+    Returns:
+        dict: stale quality metrics per sequencer name
+    """
+    with _last_results_lock:
+        statuses = {seq: mark_stale(entry) for seq, entry in _last_results.items() if entry['rootdir'] == rootdir}
+
+    for seq, last_run_dir in run_index.indexed_latest_runs().get(rootdir, {}).items():
+        if seq in statuses:
+            continue
+        result = get_archived_status(last_run_dir)
+        if result is None and shared_cache.enabled:
+            result = shared_cache.previous(last_run_dir)
+        if result is not None:
+            statuses[seq] = {**result, 'stale': True}
+
+    for seq in statuses or [sequencer_name(rootdir)]:
+        instrumentation.inc('interop_deadline_missed_total', sequencer=seq)
+    return statuses or {sequencer_name(rootdir): handle_timed_out_run(deadline)}
+
+
+async def get_latest_run_status_async(store_root, seq_list, seq_nb, deadline=None, workers=None):
+    """Asyncio version of main.get_latest_run_status(): the storage listing & the root dirs of the sequencers
+    are read by a thread pool, every sequencer sharing the same -deadline-, counted from the request.
+    The sequencers missing it are served their last known result, marked 'stale' (see stale_status()).
+
+    Args:
+        store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+        deadline (float, optional): per-sequencer deadline, in seconds. Defaults to config.SEQ_DEADLINE.
+        workers (int, optional): number of threads of the pool. Defaults to config.WORKERS,
+                                 at least 1 per sequencer root dir & 1 for the listing.
+
+    Returns:
+        dict: Per-sequencer real time quality metrics
+    """
+    deadline = config.SEQ_DEADLINE if deadline is None else deadline
+    workers = max(config.WORKERS if workers is None else workers, seq_nb + 1)
+    executor = get_executor('thread', workers)
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+
+    # List the sequencer root dirs
+    listing = submit_once(executor, ('rootdirs', store_root), run_index.rootdirs, store_root, seq_list, seq_nb)
+    with stage_timer('run_index'):
+        done, _ = await asyncio.wait([watch(loop, listing)], timeout=deadline)
+    if not done:
+        logger.warning('The storage %s was not listed within %ss, serving the last known results', store_root, deadline)
+        with _last_results_lock:
+            rootdirs = [entry['rootdir'] for entry in _last_results.values()]
+        # In the order of the index, as for a listed storage
+        rootdirs = dict.fromkeys(list(run_index.indexed_latest_runs()) + rootdirs)
+        return {seq: result for rootdir in rootdirs for seq, result in stale_status(rootdir, deadline).items()}
+    rootdirs = listing.result()
+
+    # Read each root dir until the deadline
+    waiters = {rootdir: watch(loop, submit_once(executor, rootdir, read_rootdir, rootdir)) for rootdir in rootdirs}
+    if waiters:
+        await asyncio.wait(waiters.values(), timeout=max(0, end - loop.time()))
+
+    result = {}
+    for rootdir, waiter in waiters.items():
+        if waiter.done():
+            result.update(waiter.result().result())
+        else:
+            logger.warning('%s was not read within %ss, serving its last known results', rootdir, deadline)
+            result.update(stale_status(rootdir, deadline))
+    return result
+
+
+def get_latest_run_status_deadline(store_root, seq_list, seq_nb, deadline=None, workers=None):
+    """Runs get_latest_run_status_async() from a synchronous view, in an event loop of its own
+
+    Args:
+        store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+        deadline (float, optional): per-sequencer deadline, in seconds. Defaults to config.SEQ_DEADLINE.
+        workers (int, optional): number of threads of the pool. Defaults to config.WORKERS.
+
+    Returns:
+        dict: Per-sequencer real time quality metrics
+    """
+    return asyncio.run(get_latest_run_status_async(store_root, seq_list, seq_nb, deadline, workers))
@@ -0,0 +1,154 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Log of the per-sequencer status changes, streamed to the clients as Server-Sent Events
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import time
+import weakref
+import threading
+import collections
+
+# Fields of a sequencer result whose change is pushed to the clients
+WATCHED_FIELDS = ('run_name', 'status', 'last_cycle', 'total_cycles', 'completion_dt',
+                  'p_gt_q30', 'total_yield', 'percent_aligned', 'cluster_density', 'cluster_pf_percent')
+
+
+class EventLog:
+    """Bounded log of the per-sequencer status changes.
+
+    An event is published for a sequencer only when one of its WATCHED_FIELDS changed.
+    Each event has an id '<epoch>-<number>': a client reconnecting with the id of the last event it received
+    catches up from there. The epoch identifies the log (worker process), an id from another log,
+    or older than the retained events, leads to a full resync.
+    A log created before a fork (e.g by the gunicorn master with --preload) starts over in the child process,
+    with its own epoch.
+    """
+
+    def __init__(self, max_events=1000):
+        """
+        Args:
+            max_events (int, optional): number of events retained for the reconnecting clients. Defaults to 1000.
+        """
+        self.max_events = max_events
+        self._reset()
+
+        if hasattr(os, 'register_at_fork'):
+            # Weak reference, so that the hook does not keep the log alive
+            log = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: log() is not None and log()._reset())
+
+    def _reset(self):
+        """Starts an empty log, with the epoch of the current process"""
+        self.epoch = '%x%x' % (int(time.time()), os.getpid())
+        self._events = collections.deque(maxlen=self.max_events)
+        self._last_id = 0
+        self._states = {}
+        self._results = {}
+        self._condition = threading.Condition()
+
+    def _event_id(self, number):
+        return '%s-%d' % (self.epoch, number)
+
+    def publish(self, data):
+        """Publishes an event for each sequencer whose watched fields changed
+
+        Args:
+            data (dict): per-sequencer real time quality metrics
+
+        Returns:
+            int: number of published events
+        """
+        with self._condition:
+            published = 0
+            for seq, result in data.items():
+                state = tuple(result.get(field) for field in WATCHED_FIELDS)
+                if self._states.get(seq) == state:
+                    continue
+
+                self._states[seq] = state
+                self._results[seq] = result
+                self._last_id += 1
+                self._events.append((self._last_id, seq, result))
+                published += 1
+
+            if published:
+                self._condition.notify_all()
+            return published
+
+    def parse_token(self, token):
+        """Gets the event number of a resume token
+
+        Args:
+            token (str): id of the last event received by the client
+
+        Returns:
+            int: the event number, None when the token does not belong to this log or is too old
+        """
+        if not token:
+            return None
+
+        epoch, _, number = token.rpartition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+
+        number = int(number)
+        with self._condition:
+            oldest = self._events[0][0] if self._events else self._last_id + 1
+            if number > self._last_id or number < oldest - 1:
+                return None
+        return number
+
+    def wait_events(self, after, timeout):
+        """Waits for the events published after the event number -after-
+
+        Args:
+            after (int): number of the last event sent to the client
+            timeout (float): maximum waiting time, in seconds
+
+        Returns:
+            tuple(int, list): last event number & (event id, sequencer, result) of the new events, empty on timeout.
+                              None when some events were dropped from the log meanwhile, the client has to resync.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._last_id > after, timeout=timeout)
+            if self._events and self._events[0][0] > after + 1:
+                return None
+
+            events = [(self._event_id(number), seq, result) for number, seq, result in self._events if number > after]
+            return self._last_id, events
+
+    def current(self):
+        """Gets an event per sequencer, to resync a client with the latest published state
+
+        Returns:
+            tuple(int, list): current event number & (event id, sequencer, result) of each sequencer
+        """
+        with self._condition:
+            event_id = self._event_id(self._last_id)
+            return self._last_id, [(event_id, seq, result) for seq, result in self._results.items()]
+
+
+def format_event(event_id, seq, result, dumps):
+    """Formats a status change as a Server-Sent Event
+
+    Args:
+        event_id (str): id of the event, used as resume token
+        seq (str): sequencer name
+        result (dict): real time quality metrics of the sequencer
+        dumps (callable): JSON serializer
+
+    Returns:
+        bytes: the event
+    """
+    data = dumps({'sequencer': seq, **result})
+    return b'id: %s\nevent: status\ndata: %s\n\n' % (event_id.encode(), data)
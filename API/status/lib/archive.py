@@ -0,0 +1,210 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Persistent archive (SQLite) of the completed runs results.
+      Once a run is completed its metrics do not change anymore: its result is frozen in the archive,
+      then served from there without reading the InterOP files again, even after the run left the storage.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import json
+import time
+import logging
+import sqlite3
+from datetime import datetime
+
+from .runindex import parse_runfolder_name
+
+logger = logging.getLogger(__name__)
+
+# Status of a completed run, see runfiles.check_completion_files()
+COMPLETED_STATUS = 'Completed on'
+# Format of the completion date, see runfiles.check_completion_files()
+COMPLETION_DT_FORMAT = '%Y-%m-%d   %H:%M'
+
+# Fields of the archived results listed by history()
+HISTORY_FIELDS = ('run_name', 'flowcell_id', 'exp_name', 'inst_name', 'total_cycles', 'completion_dt',
+                  'p_gt_q30', 'total_yield', 'percent_aligned', 'cluster_density', 'cluster_pf_percent')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_dir TEXT PRIMARY KEY,
+    run_name TEXT NOT NULL,
+    sequencer TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    completed_at TEXT NOT NULL,
+    archived_at REAL NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_run_name ON runs (run_name);
+CREATE INDEX IF NOT EXISTS runs_sequencer_completed_at ON runs (sequencer, completed_at);
+CREATE INDEX IF NOT EXISTS runs_completed_at ON runs (completed_at);
+"""
+
+
+def is_completed(result):
+    """Checks whether a run result is final, i.e the run is completed
+
+    Args:
+        result (dict): quality metrics of the run
+
+    Returns:
+        bool: True if the result can be archived
+    """
+    return result.get('status') == COMPLETED_STATUS and bool(result.get('completion_dt'))
+
+
+def _iso_run_date(run_dir):
+    """Gets the date of a run from its folder name (YYMMDD), as YYYY-MM-DD. Empty when not matching."""
+    date = parse_runfolder_name(run_dir)['date']
+    return '20%s-%s-%s' % (date[:2], date[2:4], date[4:]) if date else ''
+
+
+def _iso_completion_dt(completion_dt):
+    """Converts the completion date of a result to YYYY-MM-DDTHH:MM, to be sorted & compared"""
+    try:
+        return datetime.strptime(completion_dt, COMPLETION_DT_FORMAT).isoformat(timespec='minutes')
+    except ValueError:
+        return completion_dt
+
+
+class RunArchive:
+    """SQLite archive of the completed runs, 1 row per run folder holding its final result as json.
+    A connection is opened per call, so that the archive can be shared by threads & worker processes.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): path of the SQLite database. Empty disables the archive.
+        """
+        self.path = path
+        self._ready = False
+
+    @property
+    def enabled(self):
+        """bool: whether an archive file is configured"""
+        return bool(self.path)
+
+    def _connect(self):
+        """Opens a connection, creating the schema on the first call"""
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        if not self._ready:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Readers do not block the writer of another worker
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self._ready = True
+        return connection
+
+    def _query(self, sql, params=()):
+        """Runs a query, the connection being closed afterwards
+
+        Returns:
+            list: the rows, as sqlite3.Row
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    def get(self, run_dir):
+        """Gets the archived result of a run folder
+
+        Args:
+            run_dir (str): path of the run folder
+
+        Returns:
+            dict: the final result of the run, None if not archived
+        """
+        rows = self._query('SELECT result FROM runs WHERE run_dir = ?', (run_dir,))
+        return json.loads(rows[0]['result']) if rows else None
+
+    def find(self, run_name):
+        """Finds an archived run by its folder name, e.g a run no longer in the storage
+
+        Args:
+            run_name (str): name of the run folder
+
+        Returns:
+            tuple(str, dict): sequencer name & final result of the run, None if not archived
+        """
+        rows = self._query('SELECT sequencer, result FROM runs WHERE run_name = ? ORDER BY archived_at DESC LIMIT 1', (run_name,))
+        return (rows[0]['sequencer'], json.loads(rows[0]['result'])) if rows else None
+
+    def add(self, seq, run_dir, result):
+        """Archives the final result of a completed run. An already archived run is kept as is.
+
+        Args:
+            seq (str): sequencer name
+            run_dir (str): path of the run folder
+            result (dict): final quality metrics of the run
+
+        Returns:
+            bool: True if the run was archived by this call
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                archived = connection.execute(
+                    'INSERT OR IGNORE INTO runs (run_dir, run_name, sequencer, run_date, completed_at, archived_at, result) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (run_dir, os.path.basename(os.path.normpath(run_dir)), seq, _iso_run_date(run_dir),
+                     _iso_completion_dt(result['completion_dt']), time.time(), json.dumps(result))).rowcount > 0
+        finally:
+            connection.close()
+
+        if archived:
+            logger.info('Archived the completed run %s', run_dir)
+        return archived
+
+    def history(self, sequencer=None, start=None, end=None, limit=100, offset=0):
+        """Lists the archived runs, the most recently completed first
+
+        Args:
+            sequencer (str, optional): sequencer name, e.g NovaSeq1_A. Defaults to None (all sequencers).
+            start (str, optional): first completion day, YYYY-MM-DD. Defaults to None.
+            end (str, optional): last completion day (included), YYYY-MM-DD. Defaults to None.
+            limit (int, optional): maximum number of runs. Defaults to 100.
+            offset (int, optional): number of runs to skip. Defaults to 0.
+
+        Returns:
+            tuple(int, list): total number of matching runs & the main metrics of the selected runs
+        """
+        where = []
+        params = []
+        if sequencer:
+            where.append('sequencer = ?')
+            params.append(sequencer)
+        if start:
+            where.append('completed_at >= ?')
+            params.append(start)
+        if end:
+            # Any time of the last day
+            where.append('completed_at <= ?')
+            params.append(end + 'T99:99')
+        clause = ' WHERE ' + ' AND '.join(where) if where else ''
+
+        total = self._query('SELECT count(*) AS total FROM runs' + clause, params)[0]['total']
+        rows = self._query('SELECT sequencer, run_date, completed_at, result FROM runs' + clause +
+                           ' ORDER BY completed_at DESC, run_name DESC LIMIT ? OFFSET ?', params + [limit, offset])
+
+        runs = []
+        for row in rows:
+            result = json.loads(row['result'])
+            runs.append({'sequencer': row['sequencer'], 'run_date': row['run_date'], 'completed_at': row['completed_at'],
+                         **{field: result.get(field) for field in HISTORY_FIELDS}})
+        return total, runs
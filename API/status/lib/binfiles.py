@@ -0,0 +1,164 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Lightweight readers of the InterOP binary files, for the cheap checks that do not need the InterOP library
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+
+from .lazy import lazy_import
+from .instrumentation import count_read_bytes
+
+np = lazy_import('numpy')
+
+# ExtractionMetricsOut.bin layouts, per format version:
+# header size (bytes) & offset of the cycle (uint16) in a record
+# v2 : header = version, record size / record = lane (u16), tile (u16), cycle (u16), fwhm (4 x f32), intensity (4 x u16), datetime (u64)
+# v3 : header = version, record size, channel count / record = lane (u16), tile (u32), cycle (u16), fwhm (n x f32), intensity (n x u16)
+EXTRACTION_LAYOUTS = {
+    2: {'header_size': 2, 'cycle_offset': 4},
+    3: {'header_size': 3, 'cycle_offset': 6},
+}
+
+# Number of records read from the end of the file. Covers the tiles still being extracted for the previous cycle
+TAIL_RECORDS = 4096
+
+
+def read_extraction_max_cycle(filename, tail_records=TAIL_RECORDS):
+    """Gets the last extracted cycle by reading only the last records of an ExtractionMetricsOut.bin file.
+    The records are appended cycle after cycle, so the max cycle lies in the tail of the file.
+
+    Args:
+        filename (str): path of the ExtractionMetricsOut.bin file
+        tail_records (int, optional): number of records read from the end of the file. Defaults to TAIL_RECORDS.
+
+    Returns:
+        int: the max cycle, 0 if no record was written yet. None when the file is missing or its format version is unknown.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            header = f.read(2)
+            if len(header) < 2 or header[0] not in EXTRACTION_LAYOUTS or not header[1]:
+                return None
+
+            layout = EXTRACTION_LAYOUTS[header[0]]
+            record_size = header[1]
+
+            # A record being written is ignored
+            size = os.fstat(f.fileno()).st_size
+            record_count = max(0, (size - layout['header_size']) // record_size)
+            if not record_count:
+                return 0
+
+            tail_count = min(record_count, tail_records)
+            f.seek(layout['header_size'] + (record_count - tail_count) * record_size)
+            tail = f.read(tail_count * record_size)
+    except FileNotFoundError:
+        return None
+
+    count_read_bytes('tail', len(header) + len(tail))
+
+    records = np.frombuffer(tail, dtype=np.dtype({'names': ['cycle'],
+                                                   'formats': ['<u2'],
+                                                   'offsets': [layout['cycle_offset']],
+                                                   'itemsize': record_size}),
+                            count=len(tail) // record_size)
+    return int(records['cycle'].max())
+
+
+## RECORD LAYOUTS
+# numpy dtypes of the records, per metric & format version. The tile is a uint32 in the NovaSeq formats.
+def _cycle_record_dtype(tile_format, *fields):
+    """Builds the dtype of a per-cycle record : lane, tile, cycle & the metric fields"""
+    return np.dtype([('lane', '<u2'), ('tile', tile_format), ('cycle', '<u2')] + list(fields))
+
+
+def _q_header(f, version):
+    """Reads the header of a QMetricsOut.bin file, after the version & record size bytes.
+    v6 stores the bins as 3 arrays (lower bounds, upper bounds, values), v7 as (lower, upper, value) triplets.
+
+    Returns:
+        tuple: header size & bins as (lower, upper, value) tuples. No bins when the qscores are not binned.
+    """
+    has_bins = f.read(1)
+    if not has_bins:
+        return None
+    if not has_bins[0]:
+        return 3, []
+
+    count = f.read(1)
+    if not count:
+        return None
+
+    values = f.read(3 * count[0])
+    if len(values) < 3 * count[0]:
+        return None
+
+    if version == 6:
+        bins = list(zip(values[:count[0]], values[count[0]:2 * count[0]], values[2 * count[0]:]))
+    else:
+        bins = [tuple(values[i:i + 3]) for i in range(0, len(values), 3)]
+    return 4 + len(values), bins
+
+
+def read_layout(f, metric):
+    """Reads the header of an InterOP binary file and gets the layout of its records.
+    Handles the formats written by the MiSeq, NextSeq & NovaSeq RTA versions.
+
+    Args:
+        f (file): binary file, at its start
+        metric (str): 'Q', 'Error', 'Tile' or 'Extraction'
+
+    Returns:
+        dict: header size, record dtype & bins (Q only). None when the format is unknown or the header is incomplete.
+    """
+    header = f.read(2)
+    if len(header) < 2:
+        return None
+    version, record_size = header[0], header[1]
+    layout = None
+
+    if metric == 'Q' and version in (4, 6, 7):
+        header_size, bins = (2, []) if version == 4 else (_q_header(f, version) or (None, None))
+        if header_size is None:
+            return None
+        tile_format = '<u4' if version == 7 else '<u2'
+        layout = {'header_size': header_size, 'bins': bins,
+                  'dtype': _cycle_record_dtype(tile_format, ('hist', '<u4', (len(bins) or 50,)))}
+
+    elif metric == 'Error' and version in (3, 4):
+        fields = [('error_rate', '<f4')] + ([('mismatch', '<u4', (5,))] if version == 3 else [])
+        layout = {'header_size': 2, 'dtype': _cycle_record_dtype('<u2' if version == 3 else '<u4', *fields)}
+
+    elif metric == 'Extraction' and version in EXTRACTION_LAYOUTS:
+        layout = {'header_size': EXTRACTION_LAYOUTS[version]['header_size'],
+                  'dtype': np.dtype({'names': ['cycle'], 'formats': ['<u2'],
+                                     'offsets': [EXTRACTION_LAYOUTS[version]['cycle_offset']],
+                                     'itemsize': record_size})}
+
+    elif metric == 'Tile' and version == 2:
+        layout = {'header_size': 2,
+                  'dtype': np.dtype([('lane', '<u2'), ('tile', '<u2'), ('code', '<u2'), ('value', '<f4')])}
+
+    elif metric == 'Tile' and version == 3:
+        # The 8 bytes of a record hold either the cluster counts ('t') or the read & % aligned ('r')
+        area = f.read(4)
+        if len(area) < 4:
+            return None
+        layout = {'header_size': 6, 'area': float(np.frombuffer(area, dtype='<f4')[0]),
+                  'dtype': np.dtype({'names': ['lane', 'tile', 'code', 'value1', 'value2', 'read'],
+                                     'formats': ['<u2', '<u4', 'u1', '<f4', '<f4', '<u4'],
+                                     'offsets': [0, 2, 6, 7, 11, 7],
+                                     'itemsize': 15})}
+
+    if layout is None or layout['dtype'].itemsize != record_size:
+        return None
+    return layout
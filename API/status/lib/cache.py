@@ -0,0 +1,122 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      In-memory cache of the per-run results, validated by a fingerprint of the run files
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import glob
+import threading
+import collections
+
+from .runfiles import COMPLETION_FILES
+
+
+def run_fingerprint(run_dir):
+    """Gets a cheap fingerprint of a run folder, made of the mtime & size of the files the run status is built from:
+    the InterOP binaries, the RunInfo.xml, the RunParameters.xml and the completion files.
+    A missing file is part of the fingerprint too, so that its creation invalidates the result.
+
+    Args:
+        run_dir (str): path of the run folder
+
+    Returns:
+        tuple: (path, mtime, size) for each watched file
+    """
+    # The InterOP dir itself is watched for the per-cycle sub-directories (e.g. NovaSeq C1.1/)
+    paths = [run_dir + '/InterOp', run_dir + '/RunInfo.xml']
+    paths += sorted(glob.glob(run_dir + '/InterOp/*.bin'))
+    paths += sorted(glob.glob(run_dir + '/*unParameters.xml'))
+    paths += [run_dir + '/' + filename for filename in COMPLETION_FILES]
+
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            fingerprint.append((path, None, None))
+
+    return tuple(fingerprint)
+
+
+class RunCache:
+    """Bounded LRU cache of the per-run results, keyed by run folder.
+    An entry is only served if the run fingerprint did not change since it was computed.
+    """
+
+    def __init__(self, max_size=64):
+        """
+        Args:
+            max_size (int, optional): maximum number of run folders kept. Defaults to 64.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, run_dir, fingerprint):
+        """Gets the cached result of a run folder
+
+        Args:
+            run_dir (str): path of the run folder
+            fingerprint (tuple): current fingerprint of the run folder
+
+        Returns:
+            dict: a copy of the cached result, None if missing or outdated
+        """
+        with self._lock:
+            entry = self._entries.get(run_dir)
+            if entry is None or entry[0] != fingerprint:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(run_dir)
+            self.hits += 1
+            return dict(entry[1])
+
+    def set(self, run_dir, fingerprint, result):
+        """Stores the result of a run folder, evicting the least recently used entries
+
+        Args:
+            run_dir (str): path of the run folder
+            fingerprint (tuple): fingerprint of the run folder the result was computed from
+            result (dict): per-run result
+        """
+        with self._lock:
+            self._entries[run_dir] = (fingerprint, dict(result))
+            self._entries.move_to_end(run_dir)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drops every entry and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Gets the cache counters
+
+        Returns:
+            dict: size, hits, misses & hit ratio of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,48 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Pools running the per-sequencer parsing concurrently
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Pools are kept alive between the requests, one per kind & size, per process
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(kind, workers):
+    """Gets a pool to run the per-sequencer parsing.
+    The pools are created once per process, so that a forked gunicorn worker does not reuse the pool of its parent.
+
+    Args:
+        kind (str): 'thread' or 'process'
+        workers (int): number of workers of the pool
+
+    Returns:
+        concurrent.futures.Executor: the pool
+    """
+    if kind not in ('thread', 'process'):
+        raise ValueError("Unknown executor kind '%s', expected 'thread' or 'process'" % kind)
+
+    key = (kind, workers, os.getpid())
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            if kind == 'process':
+                executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='interop-seq')
+            _executors[key] = executor
+
+    return executor
@@ -13,7 +13,9 @@ Date(s):
 Credits:
     Steeve Fourneaux
 """
-import numpy as np
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
 
 
 def convert_number_format(num):
@@ -35,13 +37,15 @@ def convert_number_format(num):
     return '%.1f%s' % (num, ['', 'K', 'M', 'G', 'T', 'P'][level])
 
 
-def format_q30_plot_data(data, seq): #is_nextseq
+def format_q30_plot_data(data, seq, compact=False): #is_nextseq
     """
     Formats the Q30 plot data specifically for the Sparta front-end
     
     Args:
-        data (): [description]
+        data (dict): qscore plot data, see get_qscore_data()
         seq (str): sequencer name
+        compact (bool, optional): whether the area series (NextSeq & NovaSeq) start at their 'pointStart'
+                                  instead of being shifted by None values. Defaults to False.
 
     Returns:
         [dict]: formatted data to display the real time Qscore bar-chart 
@@ -100,33 +104,54 @@ def format_q30_plot_data(data, seq): #is_nextseq
 
     else:
         chart_type = 'area'
-        width_idx = 0
-        current_width = int(data['widths'][width_idx])
+        plot_data['data']['charts']['series']['data'] = build_area_series(data, seq, compact)
+
+    plot_data['options'] = {'value': {'scale': 'interop', 'chart': chart_type}}
+    return plot_data
+
+
+def build_area_series(data, seq, compact=False):
+    """
+    Builds the area series of the NextSeq & NovaSeq Q score plot: one serie per non-empty Q score bin,
+    spreading the bin value over its width.
+    The bins, widths & colors are selected with numpy, the series are built by list repetition.
 
-        for idx, point in enumerate(data['data']):
-            if int(point) == 0: continue
-            status = 'id' if width_idx == 0 else 'linkedTo'
+    Default Highcharts shape : the serie is shifted by as many None values as its position.
+    Compact shape : the serie starts at its 'pointStart', without the None padding.
 
-            d = []
+    Args:
+        data (dict): qscore plot data, see get_qscore_data()
+        seq (str): sequencer name
+        compact (bool, optional): whether to use the compact shape. Defaults to False.
+
+    Returns:
+        [list]: area series
+    """
+    points = np.asarray(data['data'], dtype=np.float64)
+    widths = np.asarray(data['widths'], dtype=np.float64).astype(int)
+
+    # Non-empty bins, each one taking the next width (the last width is kept when there are more bins than widths)
+    positions = np.flatnonzero(np.trunc(points) != 0)
+    serie_widths = widths[np.minimum(np.arange(len(positions)), len(widths) - 1)]
+    low_positions = positions < 29
+
+    series = []
+    for serie_idx, (position, point, width, is_low) in enumerate(zip(positions.tolist(), points[positions].tolist(),
+                                                                    serie_widths.tolist(), low_positions.tolist())):
+        status = 'id' if serie_idx == 0 else 'linkedTo'
+        hex_color = ('#f2fbff', '#4db0e8') if is_low else ('#faffff', '#95edeb')
+        color = {'linearGradient': {'x1': 0, 'y1': 1, 'x2': 0, 'y2': 0},
+                 'stops': [[0, hex_color[0]], [1, hex_color[1]]]
+                 }
+
+        serie = {status: seq + '-series', 'name': data['x_title']}
+        if compact:
+            serie['pointStart'] = position
+            serie['data'] = [point] * width
+        else:
             # Fill with None values to shift the start of the displayed serie
-            previous_width = idx
-            for i in range(previous_width):
-                d.append(None)
-
-            # Fill with the serie values
-            for i in range(current_width):
-                d.append(point)
-            
-            width_idx += 1
-            if width_idx < len(data['widths']):
-                current_width = int(data['widths'][width_idx])
-
-            hex_color = ('#f2fbff', '#4db0e8') if previous_width < 29 else ('#faffff', '#95edeb')
-            color = {'linearGradient': {'x1': 0, 'y1': 1, 'x2': 0, 'y2': 0},
-                    'stops': [[0, hex_color[0]], [1, hex_color[1]]]
-                    } 
-            serie = {status: seq + '-series', 'name': data['x_title'], 'data': d, 'marker': {'enabled': False}, 'color': color}
-            plot_data['data']['charts']['series']['data'].append(serie)
+            serie['data'] = [None] * position + [point] * width
+        serie.update({'marker': {'enabled': False}, 'color': color})
+        series.append(serie)
 
-    plot_data['options'] = {'value': {'scale': 'interop', 'chart': chart_type}}
-    return plot_data
\ No newline at end of file
+    return series
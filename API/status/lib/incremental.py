@@ -0,0 +1,221 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Incremental accumulation of the InterOP metrics of the live runs.
+      The InterOP files only grow while a run is in progress: only the records appended since the previous poll are parsed.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import threading
+import collections
+
+from .lazy import lazy_import
+from .binfiles import read_layout
+from .instrumentation import count_read_bytes
+
+np = lazy_import('numpy')
+
+# Number of live runs followed at the same time
+MAX_ACCUMULATORS = 16
+
+_accumulators = collections.OrderedDict()
+_accumulators_lock = threading.Lock()
+
+
+class MetricFile:
+    """Growing InterOP binary file, read from the byte offset consumed by the previous read"""
+
+    def __init__(self, filename, metric):
+        """
+        Args:
+            filename (str): path of the InterOP binary file
+            metric (str): 'Q' or 'Extraction', see binfiles.read_layout()
+        """
+        self.filename = filename
+        self.metric = metric
+        self.layout = None
+        self.header = b''
+        self.offset = 0
+        self.supported = True
+
+    def read_new_records(self):
+        """Reads the records appended since the previous read.
+        The file is read again from its start when it was rewritten (shorter file or different header).
+
+        Returns:
+            tuple(ndarray, bool): new records & whether the previous records are outdated
+        """
+        try:
+            f = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return None, self.offset > 0
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            reset = False
+
+            if self.layout is not None and (size < self.offset or f.read(len(self.header)) != self.header):
+                self.layout = None
+                reset = True
+
+            if self.layout is None:
+                f.seek(0)
+                self.layout = read_layout(f, self.metric)
+                if self.layout is None:
+                    # Unknown format, or header still being written
+                    self.supported = size < 2
+                    return None, reset
+
+                self.supported = True
+                self.offset = self.layout['header_size']
+                f.seek(0)
+                self.header = f.read(self.offset)
+
+            # A record being written is left for the next read
+            record_size = self.layout['dtype'].itemsize
+            count = (size - self.offset) // record_size
+            f.seek(self.offset)
+            data = f.read(count * record_size)
+            self.offset += len(data)
+
+        count_read_bytes('incremental', len(data))
+
+        return np.frombuffer(data, dtype=self.layout['dtype']), reset
+
+
+class RunAccumulator:
+    """Running aggregates of the Q & Extraction metrics of a live run:
+    per-cycle Q-score histogram (%>=Q30, yield & Q-score plot) and last extracted cycle.
+    """
+
+    def __init__(self, run_dir):
+        """
+        Args:
+            run_dir (str): path of the run folder
+        """
+        self.run_dir = run_dir
+        self.q_file = MetricFile(run_dir + '/InterOp/QMetricsOut.bin', 'Q')
+        self.extraction_file = MetricFile(run_dir + '/InterOp/ExtractionMetricsOut.bin', 'Extraction')
+        self.q_hist = np.zeros((0, 0), dtype=np.float64)   # cluster counts, per cycle (row) & per Q bin (column)
+        self.last_cycle = 0
+        self.lock = threading.Lock()
+
+    @property
+    def bins(self):
+        """list: (lower, upper, value) of each Q bin. Empty when the qscores are not binned"""
+        return self.q_file.layout['bins'] if self.q_file.layout else []
+
+    def update(self):
+        """Parses the records appended to the InterOP files since the previous update
+
+        Returns:
+            bool: whether the aggregates are usable. False when the Q scores are not binned or a format is unknown.
+        """
+        records, reset = self.q_file.read_new_records()
+        if reset:
+            self.q_hist = np.zeros((0, 0), dtype=np.float64)
+        if records is not None and records.size:
+            hist = records['hist']
+            max_cycle = int(records['cycle'].max())
+            if self.q_hist.shape[0] <= max_cycle or self.q_hist.shape[1] != hist.shape[1]:
+                grown = np.zeros((max(max_cycle + 1, self.q_hist.shape[0]), hist.shape[1]), dtype=np.float64)
+                grown[:self.q_hist.shape[0], :self.q_hist.shape[1]] = self.q_hist
+                self.q_hist = grown
+            np.add.at(self.q_hist, records['cycle'], hist)
+
+        records, reset = self.extraction_file.read_new_records()
+        if reset:
+            self.last_cycle = 0
+        if records is not None and records.size:
+            self.last_cycle = max(self.last_cycle, int(records['cycle'].max()))
+
+        return self.q_file.supported and self.extraction_file.supported and bool(self.bins)
+
+    def _useable_hist(self, excluded_cycles):
+        """Sums the Q histogram over the cycles, except the -excluded_cycles-"""
+        hist = self.q_hist.copy()
+        excluded = [cycle for cycle in excluded_cycles if cycle < hist.shape[0]]
+        hist[excluded] = 0
+        return hist.sum(axis=0)
+
+    def percent_gt_q30(self, excluded_cycles=()):
+        """Gets the percentage of bases with a Q score >= 30
+
+        Args:
+            excluded_cycles (iterable, optional): cycles left out, e.g. the last cycle of each read like InterOP does
+
+        Returns:
+            float: %>=Q30, NaN when no Q metric was read
+        """
+        hist = self._useable_hist(excluded_cycles)
+        total = hist.sum()
+        if not total:
+            return np.nan
+        gt_q30 = np.array([upper >= 30 for lower, upper, value in self.bins])
+        return float(hist[gt_q30].sum() / total * 100)
+
+    def yield_g(self, excluded_cycles=()):
+        """Gets the yield, i.e the number of bases counted in the Q histogram
+
+        Args:
+            excluded_cycles (iterable, optional): cycles left out, e.g. the last cycle of each read like InterOP does
+
+        Returns:
+            float: yield in gigabases
+        """
+        return float(self._useable_hist(excluded_cycles).sum() / 1e9)
+
+    def qscore_bars(self):
+        """Gets the Q-score histogram bars, as InterOP plot_qscore_histogram() does for binned Q scores:
+        one bar per non-empty bin, starting at the bin lower bound, in million of clusters.
+
+        Returns:
+            tuple(list, list, list): x, y & width of the bars
+        """
+        hist = self.q_hist.sum(axis=0) / 1e6 if self.q_hist.size else np.zeros(len(self.bins))
+        bins = np.array(self.bins, dtype=np.float64).reshape(-1, 3)
+        non_empty = hist > 0
+        return (bins[non_empty, 0].tolist(),
+                hist[non_empty].tolist(),
+                (bins[:, 1] - bins[:, 0] + 1)[non_empty].tolist())
+
+
+def get_accumulator(run_dir):
+    """Gets the accumulator of a live run, created on the first call.
+    The least recently used accumulators are dropped beyond MAX_ACCUMULATORS.
+
+    Args:
+        run_dir (str): path of the run folder
+
+    Returns:
+        RunAccumulator: the accumulator of the run
+    """
+    with _accumulators_lock:
+        accumulator = _accumulators.get(run_dir)
+        if accumulator is None:
+            accumulator = RunAccumulator(run_dir)
+            _accumulators[run_dir] = accumulator
+        _accumulators.move_to_end(run_dir)
+
+        while len(_accumulators) > MAX_ACCUMULATORS:
+            _accumulators.popitem(last=False)
+
+    return accumulator
+
+
+def drop_accumulator(run_dir):
+    """Forgets the accumulator of a run, e.g. once it is completed
+
+    Args:
+        run_dir (str): path of the run folder
+    """
+    with _accumulators_lock:
+        _accumulators.pop(run_dir, None)
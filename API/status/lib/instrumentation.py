@@ -0,0 +1,188 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      In-process instrumentation: latency histograms per stage & per sequencer, counters
+      (e.g bytes of InterOP read), rendered in the Prometheus text exposition format.
+      The metrics are held by each worker process.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import time
+import bisect
+import threading
+import contextlib
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Name -> (type, help) of the collected metrics
+METRICS = {
+    'interop_stage_duration_seconds': ('histogram', 'Duration of the run status stages, per stage & sequencer'),
+    'interop_request_duration_seconds': ('histogram', 'Duration of the API requests, per endpoint'),
+    'interop_read_bytes_total': ('counter', 'Bytes of InterOP files read, per reader ('
+                                            'the interop reader only with INTEROP_COUNT_BYTES or INTEROP_PROFILE)'),
+    'interop_runs_parsed_total': ('counter', 'Run folders parsed, per sequencer'),
+    'interop_shared_cache_total': ('counter', 'Run results looked up in the shared cache, per outcome (shared, parsed, previous, waited)'),
+    'interop_deadline_missed_total': ('counter', 'Sequencers served a stale result after missing their deadline, per sequencer'),
+}
+
+
+def _format_labels(labels):
+    """Formats the labels of a sample, e.g {stage="summary",sequencer="MiSeq1"}"""
+    if not labels:
+        return ''
+    escaped = ('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    """Formats a sample value, integers without decimals"""
+    return '%d' % value if float(value).is_integer() else repr(float(value))
+
+
+class Instrumentation:
+    """Registry of the histograms & counters of the worker process"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Args:
+            buckets (tuple, optional): upper bounds of the histogram buckets, in seconds. Defaults to LATENCY_BUCKETS.
+        """
+        self.buckets = tuple(buckets)
+        # Sizing the files read by the InterOP library costs a directory scan per metric: off by default
+        self.count_interop_files = False
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        """Records a value in a histogram
+
+        Args:
+            name (str): histogram name, see METRICS
+            value (float): observed value
+            **labels: labels of the value
+        """
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            if index < len(self.buckets):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def inc(self, name, value=1, **labels):
+        """Increments a counter
+
+        Args:
+            name (str): counter name, see METRICS
+            value (float, optional): increment. Defaults to 1.
+            **labels: labels of the counter
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timed(self, name, **labels):
+        """Records the duration of a block in a histogram, even when it raises
+
+        Args:
+            name (str): histogram name, see METRICS
+            **labels: labels of the duration
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def clear(self):
+        """Drops all the recorded values"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self, samples=()):
+        """Renders the metrics in the Prometheus text exposition format
+
+        Args:
+            samples (iterable, optional): extra (name, type, help, labels dict, value) samples, collected at scrape time
+                                          (e.g the cache counters). Defaults to ().
+
+        Returns:
+            str: exposition text
+        """
+        with self._lock:
+            histograms = {key: {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+                          for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            values = histograms if kind == 'histogram' else counters
+            keys = sorted(key for key in values if key[0] == name)
+            if not keys:
+                continue
+
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for key in keys:
+                labels = key[1]
+                if kind == 'counter':
+                    lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(values[key])))
+                    continue
+
+                cumulated = 0
+                for bound, count in zip(self.buckets, values[key]['buckets']):
+                    cumulated += count
+                    lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', repr(bound)),)), cumulated))
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', '+Inf'),)), values[key]['count']))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels), repr(values[key]['sum'])))
+                lines.append('%s_count%s %d' % (name, _format_labels(labels), values[key]['count']))
+
+        described = set()
+        for name, kind, description, labels, value in samples:
+            if name not in described:
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s %s' % (name, kind))
+                described.add(name)
+            lines.append('%s%s %s' % (name, _format_labels(tuple(sorted(labels.items()))), _format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+# Instrumentation of the worker process
+instrumentation = Instrumentation()
+
+
+def stage_timer(stage, seq=''):
+    """Times a stage of the run status, see Instrumentation.timed()
+
+    Args:
+        stage (str): stage name, e.g 'summary'
+        seq (str, optional): sequencer name. Defaults to ''.
+    """
+    return instrumentation.timed('interop_stage_duration_seconds', stage=stage, sequencer=seq)
+
+
+def count_read_bytes(reader, size):
+    """Counts bytes of InterOP files read
+
+    Args:
+        reader (str): reading method, e.g 'interop' for the InterOP library, 'incremental' for the accumulators
+        size (int): number of bytes
+    """
+    if size:
+        instrumentation.inc('interop_read_bytes_total', size, reader=reader)
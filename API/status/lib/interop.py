@@ -12,25 +12,131 @@ Date(s):
 Credits:
     Steeve Fourneaux
 """
-import collections
-import numpy as np
+import os
+import glob
 from datetime import datetime
 
-from interop import py_interop_run_metrics, py_interop_run, py_interop_summary, py_interop_plot
-
+from .lazy import lazy_import
 from .format import convert_number_format, format_q30_plot_data
+from .binfiles import read_extraction_max_cycle
+from .instrumentation import instrumentation, stage_timer, count_read_bytes
 
+# Imported on their first use, see lazy.py
+np = lazy_import('numpy')
+py_interop_run_metrics = lazy_import('interop.py_interop_run_metrics')
+py_interop_run = lazy_import('interop.py_interop_run')
+py_interop_summary = lazy_import('interop.py_interop_summary')
+py_interop_plot = lazy_import('interop.py_interop_plot')
+py_interop_table = lazy_import('interop.py_interop_table')
 
-def run_info(data_folder, result):
-    """Picks some metadata about the sequencing run
+
+def load_run_metrics(data_folder, valid_to_load=None):
+    """Reads the InterOP files of a run folder in a single pass.
+    Loads the union of the metrics needed by the status methods
+    (Extraction for the last cycle, the summary set and Q for the qscore plot),
+    so that the same binaries are not read several times per request.
+
+    Args:
+        data_folder (str): path of the run folder
+        valid_to_load (uchar_vector, optional): extra metric selection to merge with the status metrics.
+
+    Returns:
+        run_metrics: run_metrics class instance. Holding the binary interOP data.
+    """
+    if valid_to_load is None:
+        valid_to_load = py_interop_run.uchar_vector(py_interop_run.MetricCount, 0)
+
+    # Union of the metric sets used by metrics(), summary() & get_qscore_data()
+    py_interop_run_metrics.list_summary_metrics_to_load(valid_to_load)
+    valid_to_load[py_interop_run.Extraction] = 1
+    valid_to_load[py_interop_run.Q] = 1
+
+    run_metrics = py_interop_run_metrics.run_metrics()
+    run_metrics.read(data_folder, valid_to_load)
+    count_interop_bytes(data_folder, valid_to_load)
+    return run_metrics
+
+
+def load_imaging_metrics(data_folder):
+    """Reads the InterOP files of a run folder needed by the imaging table (SAV data), on top of the status metrics
 
     Args:
         data_folder (str): path of the run folder
+
+    Returns:
+        run_metrics: run_metrics class instance. Holding the binary interOP data.
+    """
+    valid_to_load = py_interop_run.uchar_vector(py_interop_run.MetricCount, 0)
+    py_interop_run_metrics.list_summary_metrics_to_load(valid_to_load, False)
+    return load_run_metrics(data_folder, valid_to_load)
+
+
+def load_live_run_metrics(data_folder):
+    """Reads the InterOP files of a live run which are not accumulated incrementally, i.e the tile metrics.
+    The Q & Extraction metrics are followed by an incremental.RunAccumulator.
+
+    Args:
+        data_folder (str): path of the run folder
+
+    Returns:
+        run_metrics: run_metrics class instance. Holding the binary interOP data.
+    """
+    valid_to_load = py_interop_run.uchar_vector(py_interop_run.MetricCount, 0)
+    valid_to_load[py_interop_run.Tile] = 1
+    valid_to_load[py_interop_run.ExtendedTile] = 1
+
+    run_metrics = py_interop_run_metrics.run_metrics()
+    run_metrics.read(data_folder, valid_to_load)
+    count_interop_bytes(data_folder, valid_to_load)
+    return run_metrics
+
+
+def count_interop_bytes(data_folder, valid_to_load):
+    """Counts the bytes read by run_metrics.read(), when enabled (see Instrumentation.count_interop_files)
+
+    Args:
+        data_folder (str): path of the run folder
+        valid_to_load (uchar_vector): metric selection
+    """
+    if instrumentation.count_interop_files:
+        count_read_bytes('interop', interop_files_size(data_folder, valid_to_load))
+
+
+def interop_files_size(data_folder, valid_to_load):
+    """Gets the size of the InterOP files of the selected metrics, i.e the bytes read by run_metrics.read().
+    The per-cycle files (e.g NovaSeq InterOp/C1.1/) are included.
+
+    Args:
+        data_folder (str): path of the run folder
+        valid_to_load (uchar_vector): metric selection
+
+    Returns:
+        int: size in bytes
+    """
+    size = 0
+    for group in range(py_interop_run.MetricCount):
+        if not valid_to_load[group]:
+            continue
+
+        name = py_interop_run.to_string_metric_group(group)
+        for pattern in ('/InterOp/%sMetrics*.bin', '/InterOp/*/%sMetrics*.bin'):
+            for path in glob.glob(data_folder + pattern % name):
+                try:
+                    size += os.path.getsize(path)
+                except OSError:
+                    pass
+    return size
+
+
+def run_info(run_metrics, result):
+    """Picks some metadata about the sequencing run
+
+    Args:
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data.
         result (dict): global SAV result dict
     """
-    # Defines some class instances
-    run_info = py_interop_run.info()
-    run_info.read(data_folder)
+    # Gets the run info parsed along with the interOP files
+    run_info = run_metrics.run_info()
 
     # Gets the results
     total_cycles = run_info.total_cycles()
@@ -48,46 +154,64 @@ def run_info(data_folder, result):
 
 
 ## EXTRACTION METRICS
-def metrics(data_folder, result):
-    """Gets the last cycle of the current sequencing run
+def read_last_cycle(data_folder):
+    """Gets the last cycle of the current sequencing run, without loading the whole InterOP data.
+    Only the tail of the ExtractionMetricsOut.bin file is read. Falls back on the InterOP library
+    when the file format is unknown, or when the metrics are split in per-cycle files.
 
     Args:
         data_folder (str): path of the run folder
-        result (dict): global SAV result dict
 
     Returns:
-        [dict]: gathered results for the current method
+        int: the last extracted cycle
     """
-    # Defines some class instances
+    max_cycle = read_extraction_max_cycle(data_folder + '/InterOp/ExtractionMetricsOut.bin')
+    if max_cycle is not None:
+        return max_cycle
+
     run_metrics = py_interop_run_metrics.run_metrics()
     valid_to_load = py_interop_run.uchar_vector(py_interop_run.MetricCount, 0)
     valid_to_load[py_interop_run.Extraction]=1
     run_metrics.read(data_folder, valid_to_load)
+    count_interop_bytes(data_folder, valid_to_load)
+    return run_metrics.extraction_metric_set().max_cycle()
+
+
+def metrics(run_metrics, result, accumulator=None):
+    """Gets the last cycle of the current sequencing run
+
+    Args:
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data.
+        result (dict): global SAV result dict
+        accumulator (RunAccumulator, optional): incremental metrics of a live run. Defaults to None.
 
+    Returns:
+        [dict]: gathered results for the current method
+    """
     # Gets the last cycle
-    extraction_metrics = run_metrics.extraction_metric_set()
-    last_cycle = extraction_metrics.max_cycle()
+    if accumulator is not None:
+        last_cycle = accumulator.last_cycle
+    else:
+        extraction_metrics = run_metrics.extraction_metric_set()
+        last_cycle = extraction_metrics.max_cycle()
     result['last_cycle'] = last_cycle
     return result
 
 
-def summary(data_folder, result, seq):
-    """Collects the data to build a SAV-like summary table
+def summary(run_metrics, result, seq, accumulator=None, compact_plot=False):
+    """Collects the data to build a SAV-like summary table.
+    For a live run, the Q score based metrics come from the incremental -accumulator-.
 
     Args:
-        data_folder (str): path of the run folder
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data.
         result (dict): global SAV result dict
-        is_nextseq (bool, optional): wether the current sequencer is a nextseq. Defaults to False.
+        seq (str): sequencer name
+        accumulator (RunAccumulator, optional): incremental metrics of a live run. Defaults to None.
+        compact_plot (bool, optional): whether to use the compact shape of the Q score plot series. Defaults to False.
 
     Returns:
         [dict]: gathered results for the current method
     """
-    # Defines some class instances
-    run_metrics = py_interop_run_metrics.run_metrics()
-    valid_to_load = py_interop_run.uchar_vector(py_interop_run.MetricCount, 0) # Metric selection
-    py_interop_run_metrics.list_summary_metrics_to_load(valid_to_load)
-    run_metrics.read(data_folder, valid_to_load) # Use metric selection to load data
-
     summary = py_interop_summary.run_summary()
     py_interop_summary.summarize_run_metrics(run_metrics, summary)
 
@@ -117,17 +241,28 @@ def summary(data_folder, result, seq):
             cluster.append(summary.at(read_id).at(lane_id).cluster_count().mean())
             cluster_pf.append(summary.at(read_id).at(lane_id).cluster_count_pf().mean())
 
-    plot_data = get_qscore_data(data_folder, run_metrics, valid_to_load, seq) #is_nextseq
+    with stage_timer('get_qscore_data', seq):
+        if accumulator is not None:
+            plot_data = get_live_qscore_data(accumulator, run_metrics.run_info(), seq)
+        else:
+            plot_data = get_qscore_data(run_metrics, seq) #is_nextseq
     
     # prevents from getting empty data when run is intialiazing
     if not plot_data['widths']:
         result['status'] = 'Initializing'
         return result
     
-    result['q30_plot'] = format_q30_plot_data(plot_data, seq) #is_nextseq
+    with stage_timer('format_q30_plot_data', seq):
+        result['q30_plot'] = format_q30_plot_data(plot_data, seq, compact_plot) #is_nextseq
     
-    gt30 = convert_number_format(summary.total_summary().percent_gt_q30())
-    tot_yield = convert_number_format(summary.total_summary().yield_g())
+    if accumulator is not None:
+        # InterOP leaves the last cycle of each read out of the totals
+        last_cycles = [read['last_cycle'] for read in result['reads']]
+        gt30 = convert_number_format(accumulator.percent_gt_q30(last_cycles))
+        tot_yield = convert_number_format(accumulator.yield_g(last_cycles))
+    else:
+        gt30 = convert_number_format(summary.total_summary().percent_gt_q30())
+        tot_yield = convert_number_format(summary.total_summary().yield_g())
     perc_alig = convert_number_format(summary.total_summary().percent_aligned())
     clus_dens = convert_number_format(np.mean(density))
     clus_pf_perc = convert_number_format(np.mean(cluster_pf) / np.mean(cluster) * 100)
@@ -141,58 +276,166 @@ def summary(data_folder, result, seq):
     return result
 
 
-def get_qscore_data(data_folder, run_metrics, valid_to_load, seq):
+def get_qscore_data(run_metrics, seq):
     """Gets the QScore plot data (Number of cluster vs qscore)
 
     Args:
-        run_folder (str): path of the run folder to analyse
-        run_metrics (class): run_metrics class instance. Holding the binary interOP data.
-        valid_to_load (uchar_vector): array indicating which InterOp files (== metrics) to load
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data, Q metrics included.
         seq (str): sequencer name
 
     Returns:
         dict: qscore plot data
     """
+    bar_data = qscore_histogram(run_metrics)
+    x, y, width = bar_plot_arrays(bar_data)
+
+    result = format_qscore_bars(x, y, width, bar_data.xyaxes().x().max(), 'miseq' not in seq.lower())
+    result.update({
+        'title': bar_data.title(),
+        'x_title': bar_data.xyaxes().x().label(),
+        'y_title': bar_data.xyaxes().y().label(),
+        'y_min': bar_data.xyaxes().y().min(),
+        'y_max': bar_data.xyaxes().y().max()
+    })
+    return result
+
+
+def get_live_qscore_data(accumulator, run_info, seq):
+    """Gets the QScore plot data of a live run from its incremental metrics.
+    Same result as get_qscore_data(), without loading the whole Q metrics.
+
+    Args:
+        accumulator (RunAccumulator): incremental metrics of the live run, with binned Q scores
+        run_info (class): run info class instance
+        seq (str): sequencer name
+
+    Returns:
+        dict: qscore plot data
+    """
+    x, y, width = (np.asarray(values, dtype=np.float64) for values in accumulator.qscore_bars())
+
+    # Same axes as InterOP plot_qscore_histogram(): a 10% margin over the bars
+    x_max = float((x + width).max()) * 1.1 if x.size else 0.0
+    result = format_qscore_bars(x, y, width, x_max, 'miseq' not in seq.lower())
+    result.update({
+        'title': run_info.flowcell_id() + ' All Lanes',
+        'x_title': 'Q Score',
+        'y_title': 'Total (million)',
+        'y_min': 0.0,
+        'y_max': float(y.max()) * 1.1 if y.size else 0.0
+    })
+    return result
 
-    # Defines some class instances
-    valid_to_load[py_interop_run.Q]=1
-    run_metrics.read(data_folder, valid_to_load)
 
-    # Collects the qscore data
+def qscore_histogram(run_metrics):
+    """Computes the InterOP QScore histogram of a run, all lanes together.
+
+    Args:
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data, Q metrics included.
+
+    Returns:
+        class: bar_plot_data class instance
+    """
     # No boundary is defined because it generates a weird display
     bar_data = py_interop_plot.bar_plot_data()
     options = py_interop_plot.filter_options(run_metrics.run_info().flowcell().naming_method())
 
     py_interop_plot.plot_qscore_histogram(run_metrics, options, bar_data)
-    
-    values = {}
-    widths = {}
-    for i in range(bar_data.size()):
-        for j in range(bar_data.at(i).size()):
-            x = bar_data.at(i).at(j).x()
-            y = bar_data.at(i).at(j).y()
-            width = bar_data.at(i).at(j).width()
-            values[int(x)] = y
-            widths[int(x)] = width
-    
-    if 'miseq' not in seq.lower():
-        for x_lbl in range(int(bar_data.xyaxes().x().max())):
-            if x_lbl + 1 not in values.keys():
-                values[x_lbl + 1] = 0
-
-    # Builds the results
-    ordered_values = collections.OrderedDict(sorted(values.items()))
-    ordered_widths = collections.OrderedDict(sorted(widths.items()))
-
-    result = {
-        'x_labels' : list(ordered_values.keys()),
-        'data': list(ordered_values.values()),
-        'widths': list(ordered_widths.values()),
-        'title': bar_data.title(),
-        'x_title': bar_data.xyaxes().x().label(),
-        'y_title': bar_data.xyaxes().y().label(),
-        'y_min': bar_data.xyaxes().y().min(),
-        'y_max': bar_data.xyaxes().y().max()
+    return bar_data
+
+
+def bar_plot_arrays(bar_data):
+    """Extracts the bars of an InterOP bar plot into numpy arrays, all series concatenated.
+    Each bar point is fetched once from the SWIG wrapper, straight into preallocated arrays.
+
+    Args:
+        bar_data (class): bar_plot_data class instance
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray): x, y & width of the bars
+    """
+    points = [serie.at(j) for serie in (bar_data.at(i) for i in range(bar_data.size())) for j in range(serie.size())]
+
+    values = np.empty((3, len(points)), dtype=np.float64)
+    for j, point in enumerate(points):
+        values[:, j] = point.x(), point.y(), point.width()
+    return values[0], values[1], values[2]
+
+
+def format_qscore_bars(x, y, width, x_max, fill_missing=True):
+    """Orders the bars of the QScore histogram by Q score.
+    A Q score found twice keeps its last bar.
+
+    Args:
+        x (numpy.ndarray): Q score of each bar
+        y (numpy.ndarray): number of clusters of each bar
+        width (numpy.ndarray): width of each bar
+        x_max (float): maximum of the x axis
+        fill_missing (bool, optional): whether the missing Q scores are filled with 0, up to -x_max-. Defaults to True.
+
+    Returns:
+        dict: x labels, data & widths of the qscore plot
+    """
+    x = np.asarray(x, dtype=np.float64).astype(np.int64)
+    order = np.argsort(x, kind='stable')
+    x, y, width = x[order], np.asarray(y, dtype=np.float64)[order], np.asarray(width, dtype=np.float64)[order]
+
+    last = np.ones(x.size, dtype=bool)
+    last[:-1] = x[1:] != x[:-1]
+    x, y, width = x[last], y[last], width[last]
+
+    x_labels = np.union1d(x, np.arange(1, int(x_max) + 1)) if fill_missing else x
+
+    # The filled Q scores stay plain 0 integers, as in the former output
+    data = np.zeros(x_labels.size, dtype=object)
+    data[np.searchsorted(x_labels, x)] = y.tolist()
+
+    return {
+        'x_labels' : x_labels.tolist(),
+        'data': data.tolist(),
+        'widths': width.tolist()
     }
-    return result
 
+
+def imaging_table_columns(run_metrics):
+    """Gets the columns of the imaging table
+
+    Args:
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data, imaging metrics included.
+
+    Returns:
+        tuple(class, list): imaging_column_vector class instance & the column headers
+    """
+    # The column headers for the imaging table can be created as follows:
+    columns = py_interop_table.imaging_column_vector()
+    py_interop_table.create_imaging_table_columns(run_metrics, columns)
+
+    # Convert the columns object to a list of strings.
+    headers = []
+    for i in range(columns.size()):
+        column = columns[i]
+        if column.has_children():
+            headers.extend([column.name()+"("+subname+")" for subname in column.subcolumns()])
+        else:
+            headers.append(column.name())
+
+    return columns, headers
+
+
+def imaging_table_data(run_metrics, columns):
+    """Populates the imaging table of a run in a float32 ndarray, 1 row per lane / tile / cycle
+
+    Args:
+        run_metrics (class): run_metrics class instance. Holding the binary interOP data, imaging metrics included.
+        columns (class): imaging_column_vector class instance
+
+    Returns:
+        numpy.ndarray: imaging table data
+    """
+    column_count = py_interop_table.count_table_columns(columns)
+    row_offsets = py_interop_table.map_id_offset()
+    py_interop_table.count_table_rows(run_metrics, row_offsets)
+
+    data = np.zeros((row_offsets.size(), column_count), dtype=np.float32)
+    py_interop_table.populate_imaging_table_data(run_metrics, columns, row_offsets, data.ravel())
+    return data
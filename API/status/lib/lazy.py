@@ -0,0 +1,59 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Lazy imports of the heavy modules (numpy, pandas, the InterOP SWIG bindings):
+      a module is imported on the first access to one of its attributes, so that the code paths
+      which do not use it (e.g listing the run folders, a CLI --help) do not pay for its import.
+      The API preloads them (see API/wsgi.py), to be shared by the gunicorn workers with --preload.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import sys
+import types
+import importlib
+
+
+class LazyModule(types.ModuleType):
+    """Placeholder of a module, importing it on the first access to one of its attributes"""
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def load(self):
+        """Imports the module, then copies its attributes so that the next lookups are plain ones
+
+        Returns:
+            module: the imported module
+        """
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return module
+
+
+def lazy_import(name):
+    """Gets a module, imported on its first use unless already imported
+
+    Args:
+        name (str): absolute module name, e.g 'numpy' or 'interop.py_interop_run'
+
+    Returns:
+        module: the module, or a LazyModule placeholder
+    """
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def preload(names):
+    """Imports modules right away, e.g in the gunicorn master before the workers are forked
+
+    Args:
+        names (iterable): absolute module names
+    """
+    for name in names:
+        importlib.import_module(name)
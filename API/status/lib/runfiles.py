@@ -17,6 +17,9 @@ import glob
 import xml.etree.ElementTree as ET
 from datetime import datetime
 
+# Files written by the sequencer at the end of a run, see check_completion_files()
+COMPLETION_FILES = ('CopyComplete.txt', 'RTAComplete.txt')
+
 
 def run_parameters(data_folder, result, seq):
     """
@@ -15,6 +15,21 @@ Credits:
 import re
 import os
 
+# regex matching the run folder name format
+RUNFOLDER_REGEX = re.compile('.*\d{6}_[\w\d]+_\d{4}_[\w\d]+')
+
+
+def sequencer_name(seq_dir):
+    """Gets the sequencer name from its root directory path
+
+    Args:
+        seq_dir (str): path of the root directory for a sequencer. e.g /PATH/TO/MAIN/STORAGE/MiSeq
+
+    Returns:
+        str: the sequencer name
+    """
+    return seq_dir.split('/')[3]
+
 
 def get_latest_runfolder(run_dirs):
     """Get the most recent run folder for a given sequencer
@@ -44,8 +59,7 @@ def get_sequencer_rootdir(root, seq_list, seq_nb):
     # seq_nb = 
     seq_rootdirs = []
 
-    # regex matching the run folder name format
-    regex = re.compile('.*\d{6}_[\w\d]+_\d{4}_[\w\d]+')
+    regex = RUNFOLDER_REGEX
 
     for seq_dir in [f.path for f in os.scandir(root) if f.is_dir()]:
         if any([x in seq_dir for x in seq_list]):
@@ -76,7 +90,7 @@ def get_sequencer_latest_run(rootdirs):
         run_dirs = [run_folder.path for run_folder in os.scandir(seq_dir) if os.path.isdir(run_folder)]
         # Chose to not display the sequencers with no runfolder
         if run_dirs:
-            seq = seq_dir.split('/')[3]
+            seq = sequencer_name(seq_dir)
 
             # Novaseq has 2 sequencers onboard
             if 'novaseq' in seq.lower():
@@ -0,0 +1,361 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Persistent index of the sequencer root directories & their run folders
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import re
+import json
+import logging
+import threading
+
+from .runfolders import RUNFOLDER_REGEX, sequencer_name
+
+logger = logging.getLogger(__name__)
+
+# Illumina run folder name: date_instrument_number_[side]flowcell
+RUNFOLDER_NAME_REGEX = re.compile(r'^(\d{6})_([\w\d]+)_(\d{4})_([\w\d-]+)$')
+
+
+def parse_runfolder_name(run_dir):
+    """Parses the Illumina run folder name format
+
+    Args:
+        run_dir (str): path of the run folder
+
+    Returns:
+        dict: date (YYMMDD), instrument, run number, flowcell side (NovaSeq A/B) & flowcell id. Empty values when not matching.
+    """
+    name = os.path.basename(run_dir)
+    match = RUNFOLDER_NAME_REGEX.match(name)
+    if not match:
+        return {'name': name, 'date': '', 'instrument': '', 'run_number': 0, 'side': '', 'flowcell_id': ''}
+
+    date, instrument, run_number, flowcell = match.groups()
+    side = flowcell[0] if flowcell[0] in ('A', 'B') else ''
+    return {'name': name, 'date': date, 'instrument': instrument, 'run_number': int(run_number),
+            'side': side, 'flowcell_id': flowcell[1:] if side else flowcell}
+
+
+def _mtime(path):
+    """Gets the mtime of a path, None if it does not exist anymore"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class RunIndex:
+    """Index of the sequencer root directories & of the run folders they hold.
+
+    A directory is only listed again when its mtime changed, i.e. when an entry was added or removed:
+    an unchanged storage costs a stat() per directory instead of a full traversal.
+    The latest run of each sequencer is kept up to date, and the index can be saved to a json file
+    so that restarted workers do not have to scan the storage again.
+    """
+
+    def __init__(self, path=''):
+        """
+        Args:
+            path (str, optional): json file persisting the index. Defaults to '', in memory only.
+        """
+        self.path = path
+        self._store = {}
+        self._rootdirs = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Loads the index saved on disk, if any"""
+        if not self.path or not os.path.isfile(self.path):
+            return
+
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            self._store = saved['store']
+            self._rootdirs = saved['rootdirs']
+        except (OSError, ValueError, KeyError):
+            logger.warning('Ignoring the unreadable run index %s', self.path)
+
+    def _save(self):
+        """Saves the index on disk. The file is replaced atomically as several workers may share it"""
+        if not self.path:
+            return
+
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'store': self._store, 'rootdirs': self._rootdirs}, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            logger.warning('Could not save the run index %s', self.path)
+
+    @staticmethod
+    def _find_rootdir(seq_dir):
+        """Walks a sequencer directory to find the directory holding its run folders
+
+        Args:
+            seq_dir (str): path of the sequencer directory
+
+        Returns:
+            str: the root dir, None when no run folder was found
+        """
+        for root, dirs, files in os.walk(seq_dir):
+            if RUNFOLDER_REGEX.match(root):
+                return '/'.join(root.split('/')[:-1])
+        return None
+
+    def _refresh_store(self, store_root, seq_list, sequencer=None):
+        """Updates the sequencer directories & their root dir.
+        The storage is only listed again when its mtime changed, a sequencer directory is only walked
+        again when its mtime changed or when no root dir was found in it yet.
+
+        Args:
+            store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+            seq_list (list): the different sequencer names
+            sequencer (str, optional): only updates the directory of this sequencer. Defaults to None, all of them.
+
+        Returns:
+            bool: whether the index changed
+        """
+        changed = False
+        mtime = _mtime(store_root)
+        if self._store.get('root') != store_root or self._store.get('mtime') != mtime:
+            seq_dirs = [f.path for f in os.scandir(store_root) if f.is_dir()]
+            known = self._store.get('seq_dirs', {}) if self._store.get('root') == store_root else {}
+            self._store = {'root': store_root, 'mtime': mtime,
+                           'seq_dirs': {seq_dir: known.get(seq_dir, {}) for seq_dir in seq_dirs}}
+            changed = True
+
+        for seq_dir, entry in self._store['seq_dirs'].items():
+            if not any([x in seq_dir for x in seq_list]):
+                continue
+            if sequencer is not None and sequencer_name(seq_dir) != sequencer:
+                continue
+
+            mtime = _mtime(seq_dir)
+            if entry.get('rootdir') and entry.get('mtime') == mtime:
+                continue
+
+            entry['mtime'] = mtime
+            entry['rootdir'] = self._find_rootdir(seq_dir)
+            changed = True
+
+        return changed
+
+    def _refresh_rootdir(self, rootdir):
+        """Updates the run folders of a root dir, only when its mtime changed
+
+        Returns:
+            bool: whether the index changed
+        """
+        mtime = _mtime(rootdir)
+        entry = self._rootdirs.get(rootdir)
+        if entry is not None and entry['mtime'] == mtime:
+            return False
+
+        runs = self._scan_rootdir(rootdir)
+        self._rootdirs[rootdir] = {'mtime': mtime, 'runs': runs, 'latest': self._latest_runs(rootdir, runs)}
+        return True
+
+    @staticmethod
+    def _scan_rootdir(rootdir):
+        """Lists the run folders of a root dir
+
+        Returns:
+            dict: parsed name & mtime of each run folder
+        """
+        runs = {}
+        for run_folder in os.scandir(rootdir):
+            if not os.path.isdir(run_folder):
+                continue
+            runs[run_folder.path] = {**parse_runfolder_name(run_folder.path),
+                                     'mtime': os.path.getmtime(run_folder.path)}
+        return runs
+
+    @staticmethod
+    def _latest_runs(rootdir, runs):
+        """Gets the most recent run folder of a root dir. NovaSeq has 2 sequencers onboard, one per side.
+
+        Returns:
+            dict: latest run folder per sequencer name
+        """
+        # Chose to not display the sequencers with no runfolder
+        if not runs:
+            return {}
+
+        seq = sequencer_name(rootdir)
+        if 'novaseq' not in seq.lower():
+            return {seq: max(runs, key=lambda run: runs[run]['mtime'])}
+
+        latest = {}
+        for side in ('A', 'B'):
+            side_runs = [run for run in runs if run.split('_')[-1].startswith(side)]
+            if side_runs:
+                latest[seq + '_' + side] = max(side_runs, key=lambda run: runs[run]['mtime'])
+        return latest
+
+    def rootdirs(self, store_root, seq_list, seq_nb):
+        """Gets the main runfolder storage path of each sequencer, see runfolders.get_sequencer_rootdir()
+
+        Args:
+            store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+            seq_list (list): the different sequencer names
+            seq_nb (int): number of sequencer root directories to retrieve
+
+        Returns:
+            list: a rootdir path for each sequencer
+        """
+        with self._lock:
+            if self._refresh_store(store_root, seq_list):
+                self._save()
+            return self._select_rootdirs(seq_list, seq_nb)
+
+    def _select_rootdirs(self, seq_list, seq_nb):
+        """Gets the known root dirs of the sequencers of -seq_list-, at most -seq_nb-"""
+        seq_rootdirs = []
+        for seq_dir, entry in self._store['seq_dirs'].items():
+            if len(seq_rootdirs) >= seq_nb:
+                break
+            rootdir = entry.get('rootdir')
+            if rootdir and rootdir not in seq_rootdirs and any([x in seq_dir for x in seq_list]):
+                seq_rootdirs.append(rootdir)
+        return seq_rootdirs
+
+    def latest_runs(self, store_root, seq_list, seq_nb):
+        """Gets the latest runfolder of each sequencer, see runfolders.get_sequencer_latest_run()
+
+        Args:
+            store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+            seq_list (list): the different sequencer names
+            seq_nb (int): number of sequencer root directories to retrieve
+
+        Returns:
+            dict: the last run of each sequencer, even the completed ones
+        """
+        with self._lock:
+            changed = self._refresh_store(store_root, seq_list)
+
+            latest_runs = {}
+            for rootdir in self._select_rootdirs(seq_list, seq_nb):
+                changed = self._refresh_rootdir(rootdir) or changed
+                latest_runs.update(self._rootdirs[rootdir]['latest'])
+
+            if changed:
+                self._save()
+            return latest_runs
+
+    def runs(self, rootdir):
+        """Gets the indexed run folders of a root dir
+
+        Args:
+            rootdir (str): path of the root directory of a sequencer
+
+        Returns:
+            dict: parsed name & mtime of each run folder
+        """
+        with self._lock:
+            if self._refresh_rootdir(rootdir):
+                self._save()
+            return dict(self._rootdirs[rootdir]['runs'])
+
+    def rootdir_latest_runs(self, rootdir):
+        """Gets the latest runfolder of each sequencer of a root dir.
+        The root dir is read without holding the index lock: a slow or hung mount only blocks its own sequencers.
+
+        Args:
+            rootdir (str): path of the root directory of a sequencer
+
+        Returns:
+            dict: latest run folder per sequencer name (2 for a NovaSeq, one per side)
+        """
+        mtime = _mtime(rootdir)
+        with self._lock:
+            entry = self._rootdirs.get(rootdir)
+            if entry is not None and entry['mtime'] == mtime:
+                return dict(entry['latest'])
+
+        runs = self._scan_rootdir(rootdir)
+        with self._lock:
+            self._rootdirs[rootdir] = {'mtime': mtime, 'runs': runs, 'latest': self._latest_runs(rootdir, runs)}
+            self._save()
+            return dict(self._rootdirs[rootdir]['latest'])
+
+    def indexed_latest_runs(self):
+        """Gets the latest runfolders known by the index, without reading the storage.
+        The index lock is not taken, as it may be held by a listing blocked on a hung mount:
+        the root dir entries are replaced, never updated in place.
+
+        Returns:
+            dict: latest run folder per sequencer name, per root dir
+        """
+        return {rootdir: dict(entry['latest']) for rootdir, entry in self._rootdirs.copy().items()}
+
+    def latest_run(self, store_root, seq_list, seq_nb, sequencer):
+        """Gets the latest runfolder of a single sequencer, only the directories of that sequencer are checked
+
+        Args:
+            store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+            seq_list (list): the different sequencer names
+            seq_nb (int): number of sequencer root directories to retrieve
+            sequencer (str): sequencer name, with the flowcell side for the NovaSeq (e.g NovaSeq1_A)
+
+        Returns:
+            str: path of the latest run folder, None if the sequencer or its runs were not found
+        """
+        name = sequencer[:-2] if sequencer[-2:] in ('_A', '_B') else sequencer
+
+        with self._lock:
+            changed = self._refresh_store(store_root, seq_list, name)
+
+            latest_run = None
+            for rootdir in self._select_rootdirs(seq_list, seq_nb):
+                if sequencer_name(rootdir) == name:
+                    changed = self._refresh_rootdir(rootdir) or changed
+                    latest_run = self._rootdirs[rootdir]['latest'].get(sequencer)
+                    break
+
+            if changed:
+                self._save()
+            return latest_run
+
+    def find_run(self, store_root, seq_list, seq_nb, run_name):
+        """Finds a run folder by its name, in the root dirs of the sequencers
+
+        Args:
+            store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+            seq_list (list): the different sequencer names
+            seq_nb (int): number of sequencer root directories to retrieve
+            run_name (str): name of the run folder
+
+        Returns:
+            tuple(str, str): sequencer name (with the flowcell side for the NovaSeq) & path of the run folder.
+                             None if not found.
+        """
+        with self._lock:
+            changed = self._refresh_store(store_root, seq_list)
+
+            found = None
+            for rootdir in self._select_rootdirs(seq_list, seq_nb):
+                changed = self._refresh_rootdir(rootdir) or changed
+                run_dir = rootdir + '/' + run_name
+                if run_dir in self._rootdirs[rootdir]['runs']:
+                    seq = sequencer_name(rootdir)
+                    if 'novaseq' in seq.lower():
+                        seq += '_' + run_dir.split('_')[-1][:1]
+                    found = (seq, run_dir)
+                    break
+
+            if changed:
+                self._save()
+            return found
@@ -0,0 +1,336 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      On-disk columnar store of the imaging tables (per lane / tile / cycle SAV data).
+      Each run is stored as 1 float32 .npy file per column, sorted by lane / tile / cycle,
+      memory-mapped to answer the tile & cycle queries by slicing.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import json
+import fcntl
+import shutil
+import logging
+import tempfile
+import threading
+import collections
+
+from .lazy import lazy_import
+from .interop import load_imaging_metrics, imaging_table_columns, imaging_table_data
+from .cache import run_fingerprint
+
+np = lazy_import('numpy')
+
+logger = logging.getLogger(__name__)
+
+# Columns the queries filter on, as named by the InterOP imaging table
+LANE_COLUMN = 'Lane'
+TILE_COLUMN = 'Tile'
+CYCLE_COLUMN = 'Cycle'
+READ_COLUMN = 'Read'
+
+HEADER_FILE = 'header.json'
+
+
+def _fingerprint_key(fingerprint):
+    """Converts a run fingerprint to its JSON form, to be compared with the stored one"""
+    return [list(entry) for entry in fingerprint]
+
+
+def _between(values, minimum, maximum):
+    """Gets the mask of the values within [minimum, maximum], a None bound being ignored"""
+    mask = np.ones(len(values), dtype=bool)
+    if minimum is not None:
+        mask &= values >= minimum
+    if maximum is not None:
+        mask &= values <= maximum
+    return mask
+
+
+class StoredRun:
+    """Imaging table of a run, memory-mapped from the store"""
+
+    def __init__(self, path, header):
+        """
+        Args:
+            path (str): directory of the run in the store
+            header (dict): content of its header.json
+        """
+        self.header = header
+        self.headers = [column['name'] for column in header['columns']]
+        self.columns = {column['name']: np.load(os.path.join(path, column['key'] + '.npy'), mmap_mode='r')
+                        for column in header['columns']}
+
+    def _range(self, column, start, stop, minimum=None, maximum=None):
+        """Narrows a [start:stop] row range with the min / max of a column sorted within that range"""
+        values = self.columns[column][start:stop]
+        if minimum is not None:
+            start += int(np.searchsorted(values, minimum, side='left'))
+            values = self.columns[column][start:stop]
+        if maximum is not None:
+            stop = start + int(np.searchsorted(values, maximum, side='right'))
+        return start, stop
+
+    def query(self, lane=None, read=None, tiles=(None, None), cycles=(None, None), columns=None):
+        """Selects the rows of the imaging table.
+        The rows being sorted by lane / tile / cycle, the lane & tile filters are binary searches,
+        only the read & cycle filters are evaluated on the selected rows.
+
+        Args:
+            lane (int, optional): lane number. Defaults to None (all lanes).
+            read (int, optional): read number. Defaults to None (all reads).
+            tiles (tuple, optional): min & max tile numbers, both included. Defaults to (None, None).
+            cycles (tuple, optional): min & max cycles, both included. Defaults to (None, None).
+            columns (list, optional): columns to return, on top of lane / tile / cycle. Defaults to None (all columns).
+
+        Returns:
+            dict: column name -> numpy.ndarray of the selected values
+        """
+        start, stop = 0, self.header['rows']
+        tile_range = tiles[0] is not None or tiles[1] is not None
+        if lane is not None:
+            start, stop = self._range(LANE_COLUMN, start, stop, lane, lane)
+
+        if tile_range and lane is not None:
+            start, stop = self._range(TILE_COLUMN, start, stop, *tiles)
+
+        mask = np.ones(stop - start, dtype=bool)
+        if tile_range and lane is None:
+            # Tiles are only sorted within a lane
+            mask &= _between(self.columns[TILE_COLUMN][start:stop], *tiles)
+        if cycles[0] is not None or cycles[1] is not None:
+            mask &= _between(self.columns[CYCLE_COLUMN][start:stop], *cycles)
+        if read is not None and READ_COLUMN in self.columns:
+            mask &= self.columns[READ_COLUMN][start:stop] == read
+
+        names = self.headers if not columns else [LANE_COLUMN, TILE_COLUMN, CYCLE_COLUMN] + \
+            [name for name in columns if name not in (LANE_COLUMN, TILE_COLUMN, CYCLE_COLUMN)]
+        selected = None if mask.all() else np.flatnonzero(mask)
+        return {name: np.array(self.columns[name][start:stop] if selected is None else self.columns[name][start:stop][selected])
+                for name in names}
+
+
+class SavStore:
+    """Columnar store of the imaging tables, 1 directory per run folder under -root-.
+
+    A stored run holds the fingerprint of the run files it was built from (see cache.run_fingerprint()):
+    it is only built again when the run changed, e.g. a new cycle of a live run.
+    Several workers share the store: each build is written to a new version directory, then published by
+    replacing the symlink of the run atomically, and a run is built by a single process at a time (lock file).
+    """
+
+    def __init__(self, root, max_open=8):
+        """
+        Args:
+            root (str): path of the store directory. Empty disables the store.
+            max_open (int, optional): number of runs kept memory-mapped. Defaults to 8.
+        """
+        self.root = root
+        self.max_open = max_open
+        self._runs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """bool: whether a store directory is configured"""
+        return bool(self.root)
+
+    def _run_path(self, run_dir):
+        """Gets the path of a run in the store: a symlink to the directory of its latest version"""
+        return os.path.join(self.root, os.path.basename(os.path.normpath(run_dir)))
+
+    def _lock_file(self, run_dir, blocking=True):
+        """Takes the build lock of a run, shared by the processes & threads (flock of a lock file per run)
+
+        Args:
+            run_dir (str): path of the run folder
+            blocking (bool, optional): waits for the lock when held. Defaults to True.
+
+        Returns:
+            file: the locked file, to be closed to release the lock. None when not blocking and held by another build
+        """
+        os.makedirs(self.root, exist_ok=True)
+        f = open(self._run_path(run_dir) + '.lock', 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    def _read_header(self, path):
+        """Reads the header of a stored run, None if missing or unreadable"""
+        try:
+            with open(os.path.join(path, HEADER_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def build(self, run_dir, fingerprint=None):
+        """Builds the stored imaging table of a run folder, sorted by lane / tile / cycle
+
+        Args:
+            run_dir (str): path of the run folder
+            fingerprint (tuple, optional): fingerprint of the run folder, taken before reading it. Defaults to None.
+
+        Returns:
+            dict: header of the stored run
+        """
+        if fingerprint is None:
+            fingerprint = run_fingerprint(run_dir)
+
+        run_metrics = load_imaging_metrics(run_dir)
+        columns, headers = imaging_table_columns(run_metrics)
+        data = imaging_table_data(run_metrics, columns)
+        del run_metrics
+
+        order = np.lexsort((data[:, headers.index(CYCLE_COLUMN)],
+                            data[:, headers.index(TILE_COLUMN)],
+                            data[:, headers.index(LANE_COLUMN)]))
+
+        os.makedirs(self.root, exist_ok=True)
+        path = self._run_path(run_dir)
+        version_path = tempfile.mkdtemp(dir=self.root, prefix='.%s.' % os.path.basename(path))
+        header = {
+            'run_dir': run_dir,
+            'fingerprint': _fingerprint_key(fingerprint),
+            'rows': len(data),
+            'dtype': 'float32',
+            'columns': [{'name': name, 'key': '%03d' % col} for col, name in enumerate(headers)]
+        }
+        try:
+            for col, column in enumerate(header['columns']):
+                np.save(os.path.join(version_path, column['key'] + '.npy'), np.ascontiguousarray(data[order, col]))
+            with open(os.path.join(version_path, HEADER_FILE), 'w') as f:
+                json.dump(header, f)
+            previous = self._publish(path, version_path)
+        except OSError:
+            shutil.rmtree(version_path, ignore_errors=True)
+            raise
+
+        # The opened memory maps of the previous version stay valid until closed
+        if previous is not None:
+            shutil.rmtree(previous, ignore_errors=True)
+        return header
+
+    def _publish(self, path, version_path):
+        """Points the symlink of a run to a new version directory, atomically (os.replace of a new symlink)
+
+        Args:
+            path (str): path of the run in the store
+            version_path (str): directory of the new version, in the store
+
+        Returns:
+            str: directory of the replaced version, None if none
+        """
+        previous = None
+        if os.path.islink(path):
+            previous = os.path.realpath(path)
+        elif os.path.isdir(path):
+            # Run stored as a plain directory: moved aside to be replaced by the symlink
+            previous = tempfile.mkdtemp(dir=self.root, prefix='.%s.' % os.path.basename(path))
+            os.rename(path, os.path.join(previous, 'run'))
+
+        link_path = '%s.%d.link' % (version_path, threading.get_ident())
+        os.symlink(os.path.basename(version_path), link_path)
+        try:
+            os.replace(link_path, path)
+        except OSError:
+            os.remove(link_path)
+            raise
+        return previous
+
+    def _open(self, run_dir, key):
+        """Opens the stored version of a run, if built from the -key- fingerprint.
+        The symlink is resolved once: the header & the columns are read from the same version.
+
+        Returns:
+            StoredRun: memory-mapped imaging table, None if missing, outdated or replaced while being opened
+        """
+        version_path = os.path.realpath(self._run_path(run_dir))
+        header = self._read_header(version_path)
+        if header is None or header['fingerprint'] != key:
+            return None
+        try:
+            return StoredRun(version_path, header)
+        except FileNotFoundError:
+            # Version removed by the build of another worker
+            return None
+
+    def _build_once(self, run_dir, fingerprint, blocking=True):
+        """Builds a run unless another process is building it or built it meanwhile
+
+        Args:
+            run_dir (str): path of the run folder
+            fingerprint (tuple): current fingerprint of the run folder
+            blocking (bool, optional): waits for the build of another process, else returns. Defaults to True.
+
+        Returns:
+            StoredRun: memory-mapped imaging table of the run, None when not blocking and built by another process
+        """
+        key = _fingerprint_key(fingerprint)
+        lock = self._lock_file(run_dir, blocking)
+        if lock is None:
+            return None
+
+        with lock:
+            stored = self._open(run_dir, key)
+            if stored is None:
+                logger.info('Building the imaging table store of %s', run_dir)
+                self.build(run_dir, fingerprint)
+                stored = self._open(run_dir, key)
+        return stored
+
+    def get(self, run_dir, blocking=True):
+        """Gets the stored imaging table of a run folder, built or built again when the run changed
+
+        Args:
+            run_dir (str): path of the run folder
+            blocking (bool, optional): waits for the run being built by another process. Defaults to True.
+
+        Returns:
+            StoredRun: memory-mapped imaging table of the run, None when not blocking and built by another process
+        """
+        fingerprint = run_fingerprint(run_dir)
+        key = _fingerprint_key(fingerprint)
+
+        with self._lock:
+            stored = self._runs.get(run_dir)
+            if stored is not None and stored.header['fingerprint'] == key:
+                self._runs.move_to_end(run_dir)
+                return stored
+
+        stored = self._open(run_dir, key) or self._build_once(run_dir, fingerprint, blocking)
+        if stored is None:
+            return None
+
+        with self._lock:
+            self._runs[run_dir] = stored
+            self._runs.move_to_end(run_dir)
+            while len(self._runs) > self.max_open:
+                self._runs.popitem(last=False)
+        return stored
+
+    def update(self, run_dirs):
+        """Keeps the stored imaging tables of some run folders up to date, e.g. the latest runs.
+        A run being built by another process (e.g the refresher of another worker) or failing to build is skipped.
+
+        Args:
+            run_dirs (list): paths of the run folders
+        """
+        for run_dir in run_dirs:
+            # Initializing run
+            if not os.path.exists(os.path.join(run_dir, 'RunInfo.xml')):
+                continue
+            try:
+                self.get(run_dir, blocking=False)
+            except Exception:
+                logger.exception('Failed to update the imaging table store of %s', run_dir)
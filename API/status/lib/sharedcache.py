@@ -0,0 +1,201 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Per-run results shared by the worker processes (SQLite), with a lease per run folder:
+      a run is parsed by a single process at a time, the others serving its previous result or waiting for it.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import json
+import time
+import socket
+import hashlib
+import logging
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    run_dir TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    computed_at REAL NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    run_dir TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def fingerprint_key(fingerprint):
+    """Hashes a run fingerprint (see cache.run_fingerprint()) to be stored & compared"""
+    return hashlib.sha1(repr(fingerprint).encode()).hexdigest()
+
+
+def lease_owner():
+    """Identifies the current thread across the hosts & worker processes sharing the store"""
+    return '%s:%d:%d' % (socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+class SharedRunCache:
+    """SQLite store of the latest result of each run folder, shared by the worker processes.
+    A result is served only for the run fingerprint it was computed from, the previous one is kept
+    until replaced. A connection is opened per call, as for the run archive.
+    """
+
+    def __init__(self, path, lease_timeout=120, poll_interval=0.1):
+        """
+        Args:
+            path (str): path of the SQLite database. Empty disables the store.
+            lease_timeout (float, optional): seconds after which the lease of a process which did not release it
+                                             (e.g killed while parsing) can be taken over. Defaults to 120.
+            poll_interval (float, optional): seconds between 2 checks of a process waiting for a result. Defaults to 0.1.
+        """
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+        self._ready = False
+
+    @property
+    def enabled(self):
+        """bool: whether a store file is configured"""
+        return bool(self.path)
+
+    def _connect(self):
+        """Opens a connection, creating the schema on the first call"""
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        if not self._ready:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Readers do not block the writer of another worker
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self._ready = True
+        return connection
+
+    def _fetch(self, sql, params=()):
+        """Runs a read query, the connection being closed afterwards
+
+        Returns:
+            tuple: the first row, None if empty
+        """
+        connection = self._connect()
+        try:
+            return connection.execute(sql, params).fetchone()
+        finally:
+            connection.close()
+
+    def get(self, run_dir, fingerprint):
+        """Gets the result of a run folder computed from its current files
+
+        Args:
+            run_dir (str): path of the run folder
+            fingerprint (tuple): current fingerprint of the run folder
+
+        Returns:
+            dict: the result, None if missing or outdated
+        """
+        row = self._fetch('SELECT result FROM results WHERE run_dir = ? AND fingerprint = ?',
+                          (run_dir, fingerprint_key(fingerprint)))
+        return json.loads(row[0]) if row else None
+
+    def previous(self, run_dir):
+        """Gets the latest result of a run folder, whatever the files it was computed from
+
+        Args:
+            run_dir (str): path of the run folder
+
+        Returns:
+            dict: the result, None if the run was never parsed
+        """
+        row = self._fetch('SELECT result FROM results WHERE run_dir = ?', (run_dir,))
+        return json.loads(row[0]) if row else None
+
+    def set(self, run_dir, fingerprint, result):
+        """Stores the result of a run folder, replacing the previous one
+
+        Args:
+            run_dir (str): path of the run folder
+            fingerprint (tuple): fingerprint of the run folder the result was computed from
+            result (dict): per-run result
+        """
+        connection = self._connect()
+        try:
+            connection.execute('INSERT OR REPLACE INTO results (run_dir, fingerprint, computed_at, result) VALUES (?, ?, ?, ?)',
+                               (run_dir, fingerprint_key(fingerprint), time.time(), json.dumps(result)))
+        finally:
+            connection.close()
+
+    def acquire(self, run_dir):
+        """Takes the lease of a run folder, unless another process holds it and did not time out
+
+        Args:
+            run_dir (str): path of the run folder
+
+        Returns:
+            bool: True if the current thread holds the lease
+        """
+        now = time.time()
+        connection = self._connect()
+        try:
+            # Locks the database for writing: the check & the update are atomic across the processes
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT owner, expires_at FROM leases WHERE run_dir = ?', (run_dir,)).fetchone()
+            if row is not None and row[1] > now and row[0] != lease_owner():
+                connection.execute('ROLLBACK')
+                return False
+
+            if row is not None and row[1] <= now:
+                logger.warning('Taking over the expired lease of %s from %s', run_dir, row[0])
+            connection.execute('INSERT OR REPLACE INTO leases (run_dir, owner, expires_at) VALUES (?, ?, ?)',
+                               (run_dir, lease_owner(), now + self.lease_timeout))
+            connection.execute('COMMIT')
+            return True
+        finally:
+            connection.close()
+
+    def release(self, run_dir):
+        """Releases the lease of a run folder held by the current thread
+
+        Args:
+            run_dir (str): path of the run folder
+        """
+        connection = self._connect()
+        try:
+            connection.execute('DELETE FROM leases WHERE run_dir = ? AND owner = ?', (run_dir, lease_owner()))
+        finally:
+            connection.close()
+
+    def wait(self, run_dir, fingerprint):
+        """Waits for the process holding the lease of a run folder to store its result
+
+        Args:
+            run_dir (str): path of the run folder
+            fingerprint (tuple): current fingerprint of the run folder
+
+        Returns:
+            dict: the result, None when the lease was released (or expired) without a result for -fingerprint-
+        """
+        key = fingerprint_key(fingerprint)
+        while True:
+            row = self._fetch('SELECT result FROM results WHERE run_dir = ? AND fingerprint = ?', (run_dir, key))
+            if row is not None:
+                return json.loads(row[0])
+
+            lease = self._fetch('SELECT expires_at FROM leases WHERE run_dir = ?', (run_dir,))
+            if lease is None or lease[0] <= time.time():
+                return None
+            time.sleep(self.poll_interval)
@@ -13,10 +13,43 @@ Credits:
     Steeve Fourneaux
 """
 import os
+import time
+import threading
+from concurrent import futures
 
-from .lib.interop import run_info, metrics, summary
-from .lib.runfolders import get_sequencer_rootdir, get_sequencer_latest_run
+from .. import config
+from .lib.interop import load_run_metrics, load_live_run_metrics, read_last_cycle, run_info, metrics, summary
+from .lib.incremental import get_accumulator, drop_accumulator
+from .lib.runindex import RunIndex
 from .lib.runfiles import run_parameters, check_completion_files
+from .lib.cache import RunCache, run_fingerprint
+from .lib.executor import get_executor
+from .lib.savstore import SavStore
+from .lib.archive import RunArchive, is_completed
+from .lib.sharedcache import SharedRunCache
+from .lib.instrumentation import instrumentation, stage_timer
+
+# Size of the files read by the InterOP library, only when asked for or profiling
+instrumentation.count_interop_files = config.COUNT_INTEROP_BYTES or config.PROFILE_ENABLED
+
+# Per-run results, only parsed again when the run files change
+run_cache = RunCache()
+
+# Sequencer root dirs & run folders, only listed again when their content changes
+run_index = RunIndex(config.RUN_INDEX_FILE)
+
+# Imaging tables (per lane / tile / cycle data) of the runs, kept up to date for the latest runs
+sav_store = SavStore(config.SAV_STORE_DIR)
+
+# Final results of the completed runs, never parsed again
+run_archive = RunArchive(config.ARCHIVE_FILE)
+
+# Results shared by the worker processes, each run being parsed by a single worker at a time
+shared_cache = SharedRunCache(config.SHARED_CACHE_FILE, config.LEASE_TIMEOUT)
+
+# Runs being parsed by a pool, so that a run still parsing after a timeout is not submitted twice
+_inflight = {}
+_inflight_lock = threading.Lock()
 
 
 def handle_initializing_run(result):
@@ -73,63 +106,443 @@ def handle_initializing_run(result):
             }
 
 
-def get_latest_run_status(store_root, seq_list, seq_nb):
+def collect_run_metrics(seq, last_run_dir, result, is_live):
+    """Collects the run quality data.
+    The InterOP files of a live run are read incrementally: only the Q & Extraction records appended
+    since the previous poll are parsed. Otherwise, or when the formats are not supported, the InterOP files are read once.
+
+    Args:
+        seq (str): sequencer name
+        last_run_dir (str): path to the latest run directory for the current sequencer
+        result (dict): global SAV result dict
+        is_live (bool): whether the run is still in progress
+
+    Returns:
+        [dict]: result holding the last cycle
+    """
+    if is_live:
+        accumulator = get_accumulator(last_run_dir)
+        with accumulator.lock:
+            with stage_timer('accumulator_update', seq):
+                updated = accumulator.update()
+            if updated:
+                with stage_timer('load_run_metrics', seq):
+                    run_metrics = load_live_run_metrics(last_run_dir)
+                with stage_timer('run_info', seq):
+                    run_info(run_metrics, result)
+                with stage_timer('metrics', seq):
+                    last_cycle = metrics(run_metrics, result, accumulator)
+                with stage_timer('summary', seq):
+                    summary(run_metrics, result, seq, accumulator, config.COMPACT_PLOT)
+                return last_cycle
+    else:
+        drop_accumulator(last_run_dir)
+
+    with stage_timer('load_run_metrics', seq):
+        run_metrics = load_run_metrics(last_run_dir)
+    with stage_timer('run_info', seq):
+        run_info(run_metrics, result)
+    with stage_timer('metrics', seq):
+        last_cycle = metrics(run_metrics, result)
+    with stage_timer('summary', seq):
+        summary(run_metrics, result, seq, compact_plot=config.COMPACT_PLOT) #is_nextseq=seq=='NextSeq'
+    return last_cycle
+
+
+def parse_run_status(seq, last_run_dir):
+    """Parses a run folder to get its main quality metrics & status
+
+    Args:
+        seq (str): sequencer name
+        last_run_dir (str): path to the latest run directory for the current sequencer
+
+    Returns:
+        dict: real time quality metrics of the run
+    """
+    # Collect the results & status
+    result = {}
+    result['status'] = 'Idle'
+    status = 'Idle'
+    completion_date = ''
+
+    # ... Handles the run initialization
+    if not os.path.isfile(last_run_dir + '/RunInfo.xml'):
+        return handle_initializing_run(result)
+
+    # ... No need to load the InterOP data until the first cycle is extracted
+    with stage_timer('read_last_cycle', seq):
+        first_cycle_extracted = read_last_cycle(last_run_dir) > 0
+    if not first_cycle_extracted:
+        return handle_initializing_run(result)
+
+    # ... Check if the run is completed
+    with stage_timer('check_completion_files', seq):
+        status, completion_date = check_completion_files(seq, last_run_dir, status)
+
+    # ... Collect the ongoing run quality data
+    last_cycle = collect_run_metrics(seq, last_run_dir, result, is_live=status == 'Idle')
+
+    # ... Gather the run parameters
+    with stage_timer('run_parameters', seq):
+        run_parameters(last_run_dir, result, seq)
+
+    # Update the run status based on some metrics
+    if 'init' in result['status'].lower():
+        return handle_initializing_run(result)
+
+    if last_cycle['last_cycle'] != last_cycle['total_cycles'] and status == 'Idle':
+        status = 'Running'
+
+    if last_cycle['last_cycle'] == 0: status = 'Initializing'
+
+    # Set the global status and the completion date
+    result['status'] = status
+    result['completion_dt'] = completion_date
+    return result
+
+
+def get_run_status(seq, last_run_dir):
+    """Gets the status of a run, from the cache when the run files did not change since the last parsing.
+    A completed run is frozen in the archive, then served from there.
+    Otherwise the run is parsed, or its result shared by another worker, see parse_run_once().
+
+    Args:
+        seq (str): sequencer name
+        last_run_dir (str): path to the latest run directory for the current sequencer
+
+    Returns:
+        dict: real time quality metrics of the run
+    """
+    result = get_archived_status(last_run_dir)
+    if result is not None:
+        return result
+
+    fingerprint = run_fingerprint(last_run_dir)
+    result = run_cache.get(last_run_dir, fingerprint)
+    if result is None:
+        result, source = parse_run_once(seq, last_run_dir, fingerprint)
+        store_run_status(seq, last_run_dir, fingerprint, result, source)
+
+    return result
+
+
+def parse_run_once(seq, last_run_dir, fingerprint):
+    """Parses a run, a single worker process at a time when the shared cache is enabled (INTEROP_SHARED_CACHE).
+    The result already computed by another worker is reused. While another worker parses the run,
+    its previous result is served, or, for a run never parsed, its result is waited for.
+
+    Args:
+        seq (str): sequencer name
+        last_run_dir (str): path to the latest run directory for the current sequencer
+        fingerprint (tuple): fingerprint of the run folder, taken before the parsing
+
+    Returns:
+        tuple(dict, str): quality metrics of the run & their source:
+                          'parsed' (by this process), 'shared' (by another worker) or 'previous' (outdated)
+    """
+    if not shared_cache.enabled:
+        with stage_timer('parse_run_status', seq):
+            return parse_run_status(seq, last_run_dir), 'parsed'
+
+    while True:
+        result = shared_cache.get(last_run_dir, fingerprint)
+        if result is not None:
+            instrumentation.inc('interop_shared_cache_total', outcome='shared')
+            return result, 'shared'
+
+        if shared_cache.acquire(last_run_dir):
+            try:
+                # Parsed by another worker between the lookup & the lease
+                result = shared_cache.get(last_run_dir, fingerprint)
+                if result is not None:
+                    instrumentation.inc('interop_shared_cache_total', outcome='shared')
+                    return result, 'shared'
+
+                instrumentation.inc('interop_shared_cache_total', outcome='parsed')
+                with stage_timer('parse_run_status', seq):
+                    result = parse_run_status(seq, last_run_dir)
+                shared_cache.set(last_run_dir, fingerprint, result)
+                return result, 'parsed'
+            finally:
+                shared_cache.release(last_run_dir)
+
+        # Another worker is parsing the run
+        result = shared_cache.previous(last_run_dir)
+        if result is not None:
+            instrumentation.inc('interop_shared_cache_total', outcome='previous')
+            return result, 'previous'
+
+        instrumentation.inc('interop_shared_cache_total', outcome='waited')
+        with stage_timer('shared_cache_wait', seq):
+            result = shared_cache.wait(last_run_dir, fingerprint)
+        if result is not None:
+            return result, 'shared'
+        # The lease was released without a result (parsing error) or expired: parse the run here
+
+
+def get_archived_status(last_run_dir):
+    """Gets the frozen result of a completed run from the archive
+
+    Args:
+        last_run_dir (str): path to the latest run directory for the current sequencer
+
+    Returns:
+        dict: final quality metrics of the run, None if not archived (or no archive)
+    """
+    return run_archive.get(last_run_dir) if run_archive.enabled else None
+
+
+def store_run_status(seq, last_run_dir, fingerprint, result, source='parsed'):
+    """Stores a parsed run status in the cache, and in the archive once the run is completed.
+    A result shared by another worker is only cached, an outdated one is not stored.
+
+    Args:
+        seq (str): sequencer name
+        last_run_dir (str): path to the latest run directory for the current sequencer
+        fingerprint (tuple): fingerprint of the run folder, taken before the parsing
+        result (dict): quality metrics of the run
+        source (str, optional): source of the result, see parse_run_once(). Defaults to 'parsed'.
+    """
+    if source == 'previous':
+        return
+
+    run_cache.set(last_run_dir, fingerprint, result)
+    if source != 'parsed':
+        return
+
+    instrumentation.inc('interop_runs_parsed_total', sequencer=seq)
+    if run_archive.enabled and is_completed(result):
+        run_archive.add(seq, last_run_dir, result)
+
+
+def handle_timed_out_run(timeout):
+    """
+    Result of a sequencer whose run could not be parsed in time
+
+    Args:
+        timeout (float): per-sequencer timeout, in seconds
+
+    Returns:
+        [dict]: result holding the timeout status
+    """
+    return {'status': 'Timeout', 'error': 'No result within %ss' % timeout}
+
+
+def submit_run_status(executor, seq, last_run_dir, fingerprint):
+    """Submits the parsing of a run to a pool. The result is stored in the cache (and archive) once done.
+    A run already being parsed is not submitted again, its pending future is returned.
+
+    Args:
+        executor (concurrent.futures.Executor): pool running the parsing
+        seq (str): sequencer name
+        last_run_dir (str): path to the latest run directory for the current sequencer
+        fingerprint (tuple): fingerprint of the run folder at submission time
+
+    Returns:
+        concurrent.futures.Future: future of the run status & its source, see parse_run_once()
+    """
+    def store_result(future):
+        with _inflight_lock:
+            _inflight.pop(last_run_dir, None)
+        if not future.cancelled() and future.exception() is None:
+            store_run_status(seq, last_run_dir, fingerprint, *future.result())
+
+    with _inflight_lock:
+        future = _inflight.get(last_run_dir)
+        if future is not None:
+            return future
+
+        future = executor.submit(parse_run_once, seq, last_run_dir, fingerprint)
+        _inflight[last_run_dir] = future
+
+    future.add_done_callback(store_result)
+    return future
+
+
+def collect_run_status(latest_runs, workers, timeout=None, kind='thread'):
+    """Gets the status of the latest runs concurrently. Cached runs are served right away,
+    the others are parsed by a pool of -workers-.
+    Each sequencer has its own -timeout-, counted from the dispatch of the runs.
+
+    Args:
+        latest_runs (dict): latest run folder of each sequencer
+        workers (int): number of workers of the pool
+        timeout (float, optional): per-sequencer timeout, in seconds. Defaults to None, no timeout.
+        kind (str, optional): 'thread' or 'process' pool. Defaults to 'thread'.
+
+    Returns:
+        dict: per-sequencer real time quality metrics, in the -latest_runs- order
+    """
+    executor = get_executor(kind, workers)
+
+    # Dispatch the runs which are not cached
+    statuses = {}
+    pending = {}
+    for seq, last_run_dir in latest_runs.items():
+        statuses[seq] = get_archived_status(last_run_dir)
+        if statuses[seq] is not None:
+            continue
+
+        fingerprint = run_fingerprint(last_run_dir)
+        statuses[seq] = run_cache.get(last_run_dir, fingerprint)
+        if statuses[seq] is None:
+            pending[seq] = submit_run_status(executor, seq, last_run_dir, fingerprint)
+
+    # Wait for each run until its deadline
+    deadline = time.monotonic() + timeout if timeout else None
+    for seq, future in pending.items():
+        remaining = max(0, deadline - time.monotonic()) if deadline else None
+        try:
+            statuses[seq] = future.result(timeout=remaining)[0]
+        except futures.TimeoutError:
+            statuses[seq] = handle_timed_out_run(timeout)
+
+    # Merge the results in the sequencer order, whatever the completion order
+    return {seq: statuses[seq] for seq in latest_runs}
+
+
+def get_latest_run_status(store_root, seq_list, seq_nb, workers=None, timeout=None):
     """Core method to get the main quality metrics for the latest runs of each sequencer.
     Based on the real time copy of the sequenceur files to the acquisition server.
 
     Parse a -store_root- folder containing the sequencer directories.
-    Gets the latest run folder for each sequencer (in each seq directory).
+    Gets the latest run folder for each sequencer (in each seq directory), from the run index.
+    A run is only parsed again when its files changed since the previous call.
+    With more than 1 worker, the sequencers are parsed concurrently (see API/config.py).
 
     Args:
         store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+        workers (int, optional): number of concurrent workers. Defaults to config.WORKERS.
+        timeout (float, optional): per-sequencer timeout of the concurrent mode, in seconds. Defaults to config.SEQ_TIMEOUT.
 
     Returns:
         dict: Per-sequencer real time quality metrics
     """
-    # Find the root dir for each sequencer
-    rootdirs = get_sequencer_rootdir(store_root, seq_list, seq_nb)
+    workers = config.WORKERS if workers is None else workers
+    timeout = config.SEQ_TIMEOUT if timeout is None else timeout
 
-    # Get the latest runfolder for each sequencer
-    latest_runs = get_sequencer_latest_run(rootdirs)
+    # Get the latest runfolder for each sequencer, from the root dir of each sequencer
+    with stage_timer('run_index'):
+        latest_runs = run_index.latest_runs(store_root, seq_list, seq_nb)
 
     # Parse the latest runs
+    if workers > 1:
+        return collect_run_status(latest_runs, workers, timeout, config.EXECUTOR)
+
     result = {}
     for seq, last_run_dir in latest_runs.items():
-        # Collect the results & status
-        result[seq] = {}
-        result[seq]['status'] = 'Idle'
-        status = 'Idle'
-        completion_date = ''
-
-        # ... Handles the run initialization
-        if not os.path.isfile(last_run_dir + '/RunInfo.xml'):
-            result[seq] = handle_initializing_run(result[seq])
-            continue
+        result[seq] = get_run_status(seq, last_run_dir)
 
-        # ... Collect the ongoing run quality data
-        run_info(last_run_dir, result[seq])
-        last_cycle = metrics(last_run_dir, result[seq])
-        summary(last_run_dir, result[seq], seq) #is_nextseq=seq=='NextSeq'
+    return result
 
-        # ... Gather the run parameters & check if the run is completed
-        run_parameters(last_run_dir, result[seq], seq)
-        status, completion_date = check_completion_files(seq, last_run_dir, status)
 
-        # Update the run status based on some metrics
-        if 'init' in result[seq]['status'].lower():
-            result[seq] = handle_initializing_run(result[seq])
-            continue
-    
-        if last_cycle['last_cycle'] != last_cycle['total_cycles'] and status == 'Idle':
-            status = 'Running'
+def get_sequencer_status(store_root, seq_list, seq_nb, sequencer):
+    """Gets the main quality metrics of the latest run of a single sequencer.
+    Only the directories of that sequencer & its latest run are read.
 
-        if last_cycle['last_cycle'] == 0: status = 'Initializing'
-        
-        # Set the global status and the completion date
-        result[seq]['status'] = status
-        result[seq]['completion_dt'] = completion_date
+    Args:
+        store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+        sequencer (str): sequencer name, with the flowcell side for the NovaSeq (e.g NovaSeq1_A)
 
-    return result
+    Returns:
+        dict: real time quality metrics of the latest run, None if the sequencer has no run
+    """
+    last_run_dir = run_index.latest_run(store_root, seq_list, seq_nb, sequencer)
+    if last_run_dir is None:
+        return None
+    return get_run_status(sequencer, last_run_dir)
+
+
+def get_runfolder_status(store_root, seq_list, seq_nb, run_name):
+    """Gets the main quality metrics of a run folder, latest or not.
+    Only the root dirs of the sequencers & that run folder are read.
+
+    Args:
+        store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+        run_name (str): name of the run folder
+
+    Returns:
+        dict: quality metrics of the run, with its sequencer name. None if the run folder was neither found nor archived
+    """
+    found = run_index.find_run(store_root, seq_list, seq_nb, run_name)
+    if found is None:
+        # The run may have left the storage after its completion
+        archived = run_archive.find(run_name) if run_archive.enabled else None
+        return {'sequencer': archived[0], **archived[1]} if archived else None
+
+    seq, run_dir = found
+    return {'sequencer': seq, **get_run_status(seq, run_dir)}
+
+
+def get_run_history(sequencer=None, start=None, end=None, limit=100, offset=0):
+    """Lists the archived completed runs, without reading any run folder. See archive.RunArchive.history()
+
+    Args:
+        sequencer (str, optional): sequencer name, e.g NovaSeq1_A. Defaults to None (all sequencers).
+        start (str, optional): first completion day, YYYY-MM-DD. Defaults to None.
+        end (str, optional): last completion day (included), YYYY-MM-DD. Defaults to None.
+        limit (int, optional): maximum number of runs. Defaults to 100.
+        offset (int, optional): number of runs to skip. Defaults to 0.
+
+    Returns:
+        dict: total number of matching runs & the main metrics of the selected runs
+    """
+    total, runs = run_archive.history(sequencer, start, end, limit, offset)
+    return {'total': total, 'limit': limit, 'offset': offset, 'runs': runs}
+
+
+def get_runfolder_tiles(store_root, seq_list, seq_nb, run_name):
+    """Gets the per lane / tile / cycle data of a run folder, from the imaging table store.
+    The stored table is built on the first query, then again when the run files change.
+
+    Args:
+        store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+        run_name (str): name of the run folder
+
+    Returns:
+        StoredRun: memory-mapped imaging table of the run, see savstore.StoredRun.query().
+                   None if the run folder was not found
+    """
+    found = run_index.find_run(store_root, seq_list, seq_nb, run_name)
+    if found is None:
+        return None
+    return sav_store.get(found[1])
+
+
+def update_sav_store(store_root, seq_list, seq_nb):
+    """Builds the imaging table store of the latest runs, when they changed
+
+    Args:
+        store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+    """
+    if sav_store.enabled:
+        sav_store.update(run_index.latest_runs(store_root, seq_list, seq_nb).values())
+
+
+def render_metrics():
+    """Renders the instrumentation of the worker process (stage latencies, InterOP bytes read, run cache)
+    in the Prometheus text exposition format
+
+    Returns:
+        str: exposition text
+    """
+    cache = run_cache.stats()
+    return instrumentation.render([
+        ('interop_run_cache_hits_total', 'counter', 'Run cache lookups served from the cache', {}, cache['hits']),
+        ('interop_run_cache_misses_total', 'counter', 'Run cache lookups parsing the run again', {}, cache['misses']),
+        ('interop_run_cache_hit_ratio', 'gauge', 'Ratio of the run cache lookups served from the cache', {}, cache['hit_ratio']),
+        ('interop_run_cache_entries', 'gauge', 'Run folders held by the run cache', {}, cache['size']),
+    ])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Background refresher keeping a precomputed snapshot of the latest run status
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+
+from .main import get_latest_run_status, update_sav_store, sav_store
+from .events import EventLog
+from ..responses import dumps, compute_etag
+
+logger = logging.getLogger(__name__)
+
+# Latest computed status, shared by the requests of the worker process
+_snapshot = {'data': None, 'generated_at': None, 'etag': None, 'modified_at': None}
+_snapshot_lock = threading.Lock()
+# Background threads of the worker process per name, with the process id they were started by
+_threads = {}
+_refresher_lock = threading.Lock()
+
+# Per-sequencer status changes, pushed to the /interop/stream clients
+event_log = EventLog()
+
+
+def refresh_snapshot(store_root, seq_list, seq_nb):
+    """Computes the latest run status and stores it as the current snapshot.
+    Only the runs whose fingerprint changed are parsed again, thanks to the run cache.
+    The sequencers whose status changed are published to the event log.
+
+    Args:
+        store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+
+    Returns:
+        dict: the new snapshot
+    """
+    data = get_latest_run_status(store_root, seq_list, seq_nb)
+    etag = compute_etag(dumps(data))
+
+    with _snapshot_lock:
+        _snapshot['data'] = data
+        _snapshot['generated_at'] = time.time()
+        # The snapshot is only modified when its content changed
+        if etag != _snapshot['etag']:
+            _snapshot['etag'] = etag
+            _snapshot['modified_at'] = _snapshot['generated_at']
+        snapshot = dict(_snapshot)
+
+    event_log.publish(data)
+    return snapshot
+
+
+def _refresh_loop(store_root, seq_list, seq_nb, interval):
+    """Refreshes the snapshot every -interval- seconds, keeping the previous one on failure"""
+    while True:
+        start = time.monotonic()
+        try:
+            refresh_snapshot(store_root, seq_list, seq_nb)
+        except Exception:
+            logger.exception('Failed to refresh the run status snapshot')
+
+        time.sleep(max(0, interval - (time.monotonic() - start)))
+
+
+def _sav_store_loop(store_root, seq_list, seq_nb, interval):
+    """Keeps the imaging table store of the latest runs up to date (/interop/run/<run>/tiles), every -interval-
+    seconds. Run by a thread of its own, as a build (e.g a new cycle of a live run) would delay the snapshot."""
+    while True:
+        start = time.monotonic()
+        try:
+            update_sav_store(store_root, seq_list, seq_nb)
+        except Exception:
+            logger.exception('Failed to update the imaging table store')
+
+        time.sleep(max(0, interval - (time.monotonic() - start)))
+
+
+def _start_thread(name, target, args):
+    """Starts a background daemon thread, if not already running in the current process.
+    Must be called with _refresher_lock held.
+
+    Args:
+        name (str): thread name
+        target (function): loop run by the thread
+        args (tuple): arguments of the loop
+    """
+    thread, pid = _threads.get(name, (None, None))
+    if thread is not None and thread.is_alive() and pid == os.getpid():
+        return
+
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    thread.start()
+    _threads[name] = (thread, os.getpid())
+
+
+def start_refresher(store_root, seq_list, seq_nb, interval):
+    """Starts the background refresher of the current process, if not already running, and the updater of
+    the imaging table store when enabled. The process id is checked so that a forked worker starts its own threads.
+
+    Args:
+        store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+        interval (float): delay between 2 refreshes, in seconds
+    """
+    args = (store_root, seq_list, seq_nb, interval)
+    with _refresher_lock:
+        _start_thread('interop-refresher', _refresh_loop, args)
+        if sav_store.enabled:
+            _start_thread('interop-sav-store', _sav_store_loop, args)
+
+
+def get_snapshot(store_root, seq_list, seq_nb, interval):
+    """Gets the latest snapshot, starting the refresher if needed.
+    The very first call computes the snapshot synchronously.
+
+    Args:
+        store_root (str): path to the main storage. Should contain 1 dir per sequencer.
+        seq_list (list): the different sequencer names
+        seq_nb (int): number of sequencer root directories to retrieve
+        interval (float): delay between 2 refreshes, in seconds
+
+    Returns:
+        dict: per-sequencer data, with the generation timestamp & the age of the snapshot,
+              the entity tag & last modification timestamp of its content
+    """
+    with _snapshot_lock:
+        snapshot = dict(_snapshot)
+
+    if snapshot['data'] is None:
+        snapshot = refresh_snapshot(store_root, seq_list, seq_nb)
+
+    start_refresher(store_root, seq_list, seq_nb, interval)
+
+    snapshot['age'] = max(0.0, time.time() - snapshot['generated_at'])
+    snapshot['generated_at'] = datetime.fromtimestamp(snapshot['generated_at']).isoformat(timespec='seconds')
+    return snapshot
@@ -4,6 +4,8 @@ Resume:
 
 Description:
       Run the flask API.
+      The heavy modules are preloaded (see config.PRELOAD_MODULES): with gunicorn --preload, this module is imported
+      once by the master process, the forked workers sharing the imported modules instead of each importing them.
 
 Author(s):
     Steeve Fourneaux
@@ -13,7 +15,16 @@ Credits:
     Steeve Fourneaux
 """
 
+from . import config
 from .routes import app
+from .status.lib.lazy import preload
+
+# Modules imported lazily by the API, see status/lib/lazy.py. pandas is only used by the SAV exports.
+PRELOAD = ('numpy', 'interop.py_interop_run', 'interop.py_interop_run_metrics', 'interop.py_interop_summary',
+           'interop.py_interop_plot', 'interop.py_interop_table')
+
+if config.PRELOAD_MODULES:
+    preload(PRELOAD)
 
 if __name__ == "__main__":
-    app.run()
\ No newline at end of file
+    app.run()
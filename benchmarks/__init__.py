@@ -0,0 +1,15 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Offline benchmarks of the status & SAV paths, on synthetic run folders.
+      Run from the repository root, e.g python -m benchmarks.run_benchmarks
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
@@ -0,0 +1,457 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      End-to-end load test of the API, on localhost.
+      A live sequencer simulator grows synthetic runs under a fake storage root (see synthetic_run.py):
+      InterOP cycle records are appended, RTAComplete.txt / CopyComplete.txt written at the end of the runs,
+      then new runs started. Meanwhile gunicorn serves the real API.wsgi:app on that storage,
+      and an open-loop HTTP client polls /interop/ at a fixed request rate, as many dashboards do.
+      Reports the latency percentiles, the error rate and the CPU / RSS of the gunicorn workers.
+
+      e.g python -m benchmarks.load_test --rate 30 --duration 60 --workers 3 --threads 8
+          python -m benchmarks.load_test --url http://127.0.0.1:5000 --server-pid 1234  (server started separately)
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import collections
+import multiprocessing
+import urllib.parse
+import concurrent.futures
+import numpy as np
+
+from benchmarks.synthetic_run import INSTRUMENTS, SIZES, SyntheticRun, sized_tile_count
+
+# Latency percentiles of the report
+PERCENTILES = (50, 95, 99)
+# Ticks of the simulator between the copy of a run & the start of the next one
+IDLE_TICKS = 3
+
+
+class LiveSequencer:
+    """Sequencer of the simulator: runs 1 run at a time, growing by -cycles_per_tick- cycles per tick,
+    then finalizing (RTAComplete.txt), completed (CopyComplete.txt) & idle before the next run.
+    """
+
+    def __init__(self, seq_dir, instrument, tiles, cycles_per_tick, rng):
+        """
+        Args:
+            seq_dir (str): directory of the sequencer, holding its run folders
+            instrument (str): instrument family, see synthetic_run.INSTRUMENTS
+            tiles (int): number of tiles per lane of the runs
+            cycles_per_tick (int): number of cycles written per tick
+            rng (numpy.random.Generator): draws the progress of the first run
+        """
+        self.seq_dir = seq_dir
+        self.instrument = instrument
+        self.tiles = tiles
+        self.cycles_per_tick = cycles_per_tick
+        self.counts = collections.Counter()
+        self.run = None
+        self.idle = 0
+        self._start_run(1)
+        # The sequencers do not complete their runs at the same time
+        self.run.write_cycles(int(rng.integers(1, self.run.total_cycles)))
+
+    def _start_run(self, run_number):
+        """Creates the next run folder, with its first cycle"""
+        self.run = SyntheticRun(self.seq_dir, self.instrument, tiles=self.tiles, run_number=run_number, seed=run_number)
+        self.run.create()
+        self.run.write_cycles(1)
+        self.state = 'running'
+        self.counts['runs_started'] += 1
+
+    def tick(self):
+        """Moves the sequencer a step forward"""
+        if self.state == 'running':
+            written = self.run.last_cycle
+            self.run.write_cycles(written + self.cycles_per_tick)
+            self.counts['cycles_written'] += self.run.last_cycle - written
+            if self.run.last_cycle == self.run.total_cycles:
+                self.state = 'finalizing'
+        elif self.state == 'finalizing':
+            self.run.complete(copied=False)
+            self.state = 'copying'
+        elif self.state == 'copying':
+            self.run.complete()
+            self.state = 'idle'
+            self.idle = 0
+            self.counts['runs_completed'] += 1
+        else:
+            self.idle += 1
+            if self.idle >= IDLE_TICKS:
+                self._start_run(self.run.run_number + 1)
+
+
+def simulate(store_root, instruments, size, cycles_per_tick, interval, ready, stop, report, seed=0):
+    """Simulator process: grows the runs of 1 sequencer per instrument until -stop- is set
+
+    Args:
+        store_root (str): fake storage root, 1 directory per sequencer
+        instruments (list): instrument family of each sequencer
+        size (str): run size, see synthetic_run.SIZES
+        cycles_per_tick (int): number of cycles written per tick
+        interval (float): delay between 2 ticks, in seconds
+        ready (multiprocessing.Event): set once the first runs are written
+        stop (multiprocessing.Event): stops the simulation
+        report (multiprocessing.Queue): receives the counters of the simulation
+        seed (int, optional): seed of the runs progress. Defaults to 0.
+    """
+    rng = np.random.default_rng(seed)
+    names = collections.Counter()
+    sequencers = []
+    for instrument in instruments:
+        names[instrument] += 1
+        seq_dir = os.path.join(store_root, '%s%d' % (instrument, names[instrument]))
+        sequencers.append(LiveSequencer(seq_dir, instrument, sized_tile_count(instrument, size), cycles_per_tick, rng))
+    ready.set()
+
+    ticks = 0
+    while not stop.wait(interval):
+        for sequencer in sequencers:
+            sequencer.tick()
+        ticks += 1
+
+    counts = sum((sequencer.counts for sequencer in sequencers), collections.Counter())
+    report.put({'ticks': ticks, **counts})
+
+
+def _free_port():
+    """Gets a free TCP port of localhost"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(store_root, sequencers, port, workers, threads, log_file):
+    """Starts gunicorn serving API.wsgi:app on localhost, on the simulated storage.
+    The INTEROP_* variables of the environment are passed through, e.g INTEROP_REFRESH_INTERVAL.
+    As bin/gunicorn_start, the app is loaded by the master (--preload) then forked.
+
+    Returns:
+        subprocess.Popen: the gunicorn master process
+    """
+    env = dict(os.environ, INTEROP_STORE_ROOT=store_root, INTEROP_SEQ_LIST=','.join(sorted(set(sequencers))),
+               INTEROP_SEQ_NB=str(len(sequencers)))
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = repository + os.pathsep + env.get('PYTHONPATH', '')
+    command = [sys.executable, '-m', 'gunicorn', 'API.wsgi:app', '--bind', '127.0.0.1:%d' % port,
+               '--workers', str(workers), '--threads', str(threads), '--preload', '--log-level', 'warning', '--error-logfile', log_file]
+    return subprocess.Popen(command, cwd=repository, env=env)
+
+
+def wait_ready(url, server=None, timeout=60):
+    """Waits until the API answers on -url-
+
+    Args:
+        url (str): base url of the API
+        server (subprocess.Popen, optional): server process, checked for an early exit. Defaults to None.
+        timeout (float, optional): in seconds. Defaults to 60.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError('The server exited with code %d' % server.returncode)
+        try:
+            connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=5)
+            connection.request('GET', '/metrics')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('The API did not answer on %s within %ds' % (url, timeout))
+
+
+class ProcessSampler(threading.Thread):
+    """Samples the CPU time & RSS of the server worker processes (children of the master) from /proc"""
+
+    def __init__(self, master_pid, interval=0.5):
+        """
+        Args:
+            master_pid (int): pid of the server master process. Its own usage is sampled when it has no child.
+            interval (float, optional): delay between 2 samples, in seconds. Defaults to 0.5.
+        """
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.samples = {}
+        self._stop_event = threading.Event()
+        self._clock_ticks = os.sysconf('SC_CLK_TCK')
+
+    def _workers(self):
+        """Lists the pids of the master children"""
+        pids = []
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/%s/stat' % entry) as f:
+                    # The process name may hold spaces: the fields follow its closing parenthesis
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == self.master_pid:
+                pids.append(int(entry))
+        return pids or [self.master_pid]
+
+    def _sample(self, pid):
+        """Reads the CPU time (seconds) & RSS (MB) of a process, None if gone"""
+        try:
+            with open('/proc/%d/stat' % pid) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open('/proc/%d/status' % pid) as f:
+                rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        except (OSError, StopIteration):
+            return None
+        # utime & stime are the 14th & 15th fields of the stat line
+        return (int(fields[11]) + int(fields[12])) / self._clock_ticks, rss / 1024
+
+    def run(self):
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            for pid in self._workers():
+                sample = self._sample(pid)
+                if sample is None:
+                    continue
+                cpu, rss = sample
+                first = self.samples.setdefault(pid, {'start': now, 'cpu_start': cpu, 'rss_max': rss})
+                first.update({'end': now, 'cpu_end': cpu, 'rss': rss, 'rss_max': max(first['rss_max'], rss)})
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def report(self):
+        """Gets the usage of each worker over the sampling
+
+        Returns:
+            list: pid, mean CPU usage (%), last & max RSS (MB) of each worker
+        """
+        workers = []
+        for pid, sample in sorted(self.samples.items()):
+            elapsed = sample['end'] - sample['start']
+            cpu = 100 * (sample['cpu_end'] - sample['cpu_start']) / elapsed if elapsed > 0 else 0.0
+            workers.append({'pid': pid, 'cpu_percent': cpu, 'rss_mb': sample['rss'], 'rss_max_mb': sample['rss_max']})
+        return workers
+
+
+class LoadClient:
+    """Open-loop HTTP client: the requests are sent at a fixed rate, whatever the response times.
+    The latency of a request is counted from its scheduled time, so that a saturated server
+    is not hidden by the client waiting for it (coordinated omission).
+    """
+
+    def __init__(self, url, path='/interop/', concurrency=32, timeout=30):
+        """
+        Args:
+            url (str): base url of the API, e.g http://127.0.0.1:8000
+            path (str, optional): polled path. Defaults to '/interop/'.
+            concurrency (int, optional): maximum number of requests in flight. Defaults to 32.
+            timeout (float, optional): timeout of a request, in seconds. Defaults to 30.
+        """
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = path
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _request(self, scheduled):
+        """Sends a request on the keep-alive connection of the thread
+
+        Returns:
+            tuple: (latency from the scheduled time, service time, HTTP status or None, error message or None)
+        """
+        start = time.perf_counter()
+        try:
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            connection.request('GET', self.path, headers={'Accept-Encoding': 'gzip'})
+            response = connection.getresponse()
+            response.read()
+            status, error = response.status, None if response.status < 400 else 'HTTP %d' % response.status
+        except (OSError, http.client.HTTPException) as e:
+            self._local.connection = None
+            status, error = None, '%s: %s' % (type(e).__name__, e)
+        end = time.perf_counter()
+        return end - scheduled, end - start, status, error
+
+    def run(self, rate, duration):
+        """Polls the API at -rate- requests per second during -duration- seconds
+
+        Returns:
+            list: result of each request, see _request()
+        """
+        interval = 1.0 / rate
+        count = int(rate * duration)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            start = time.perf_counter()
+            pending = []
+            for i in range(count):
+                scheduled = start + i * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pending.append(executor.submit(self._request, scheduled))
+            return [future.result() for future in pending]
+
+
+def summarize(results, duration):
+    """Computes the latency percentiles & the error rate of the requests
+
+    Args:
+        results (list): result of each request, see LoadClient.run()
+        duration (float): duration of the test, in seconds
+
+    Returns:
+        dict: request counts, error rate, latency & service time percentiles (ms)
+    """
+    latencies = np.array([result[0] for result in results]) * 1000
+    service = np.array([result[1] for result in results]) * 1000
+    errors = collections.Counter(result[3] for result in results if result[3])
+    summary = {
+        'requests': len(results),
+        'throughput': len(results) / duration if duration else 0.0,
+        'errors': sum(errors.values()),
+        'error_rate': sum(errors.values()) / len(results) if results else 0.0,
+        'error_kinds': dict(errors.most_common(5)),
+    }
+    for name, values in (('latency_ms', latencies), ('service_ms', service)):
+        summary[name] = {'p%d' % p: float(np.percentile(values, p)) if len(values) else None for p in PERCENTILES}
+        summary[name]['max'] = float(values.max()) if len(values) else None
+    return summary
+
+
+def print_report(summary, workers, simulation):
+    """Prints the load test report"""
+    print('\n%d requests (%.1f req/s), %d errors (%.2f%%)' % (summary['requests'], summary['throughput'],
+                                                            summary['errors'], 100 * summary['error_rate']))
+    for kind, count in summary['error_kinds'].items():
+        print('    %6d  %s' % (count, kind))
+
+    for name, label in (('latency_ms', 'latency (from schedule)'), ('service_ms', 'service time')):
+        values = summary[name]
+        if values['max'] is None:
+            continue
+        print('%-24s %s  max %.1fms' % (label, '  '.join('p%d %.1fms' % (p, values['p%d' % p]) for p in PERCENTILES), values['max']))
+
+    if workers:
+        print('\n%-8s %8s %10s %10s' % ('worker', 'CPU', 'RSS', 'max RSS'))
+        for worker in workers:
+            print('%-8d %7.1f%% %8.1fMB %8.1fMB' % (worker['pid'], worker['cpu_percent'], worker['rss_mb'], worker['rss_max_mb']))
+
+    if simulation:
+        print('\nSimulator: %(ticks)d ticks, %(cycles_written)d cycles written, %(runs_completed)d runs completed, '
+              '%(runs_started)d runs started' % collections.defaultdict(int, simulation))
+
+
+def main():
+    """Runs the load test from the command line"""
+    parser = argparse.ArgumentParser(description='InterOP API - Load test with a live sequencer simulator')
+    parser.add_argument('-s', '--sequencers', help='Instrument family of each simulated sequencer. Defaults to 1 of each.',
+                        nargs='+', choices=list(INSTRUMENTS), default=list(INSTRUMENTS))
+    parser.add_argument('--size', help='Size of the simulated runs. Defaults to small.', choices=list(SIZES), default='small')
+    parser.add_argument('--cycles-per-tick', help='Cycles written per sequencer & tick. Defaults to 10.', type=int, default=10)
+    parser.add_argument('--tick', help='Delay between 2 ticks of the simulator, in seconds. Defaults to 1.', type=float, default=1.0)
+    parser.add_argument('--rate', help='Requests per second. Defaults to 20.', type=float, default=20.0)
+    parser.add_argument('--duration', help='Duration of the test, in seconds. Defaults to 30.', type=float, default=30.0)
+    parser.add_argument('--concurrency', help='Maximum number of requests in flight. Defaults to 32.', type=int, default=32)
+    parser.add_argument('--path', help='Polled path. Defaults to /interop/.', default='/interop/')
+    parser.add_argument('--timeout', help='Timeout of a request, in seconds. Defaults to 30.', type=float, default=30.0)
+    parser.add_argument('--workers', help='Gunicorn workers. Defaults to 3, as bin/gunicorn_start.', type=int, default=3)
+    parser.add_argument('--threads', help='Gunicorn threads per worker. Defaults to 8, as bin/gunicorn_start.', type=int, default=8)
+    parser.add_argument('--url', help='Base url of an API started separately, on the storage given by --workdir, instead of gunicorn')
+    parser.add_argument('--server-pid', help='With --url: pid of the server master process, to sample its workers', type=int)
+    parser.add_argument('-w', '--workdir', help='Simulated storage root, 2 levels deep (e.g /tmp/loadtest). Defaults to a temporary directory.')
+    parser.add_argument('--keep', help='Keep the simulated storage (always kept with --workdir)', action='store_true')
+    parser.add_argument('-o', '--output', help='Json file to save the report to')
+    parser.add_argument('--seed', help='Seed of the simulated runs. Defaults to 0.', type=int, default=0)
+    args = parser.parse_args()
+
+    store_root = args.workdir or tempfile.mkdtemp(prefix='interop-load-', dir='/tmp')
+    # The sequencer names are taken from the 3rd level of the path
+    if len(os.path.normpath(store_root).strip('/').split('/')) != 2:
+        parser.error('the workdir must be 2 levels deep, e.g /tmp/loadtest')
+    if args.url and not args.workdir:
+        parser.error('--url requires the --workdir the server reads')
+    os.makedirs(store_root, exist_ok=True)
+
+    ready, stop, report = multiprocessing.Event(), multiprocessing.Event(), multiprocessing.Queue()
+    simulator = multiprocessing.Process(target=simulate, args=(store_root, args.sequencers, args.size, args.cycles_per_tick,
+                                                               args.tick, ready, stop, report, args.seed))
+    server = sampler = None
+    simulation = {}
+    try:
+        simulator.start()
+        if not ready.wait(120):
+            raise RuntimeError('The simulator did not start')
+
+        url, master_pid = args.url, args.server_pid
+        if url is None:
+            url = 'http://127.0.0.1:%d' % _free_port()
+            server = start_server(store_root, args.sequencers, urllib.parse.urlsplit(url).port, args.workers, args.threads,
+                                  os.path.join(store_root, 'gunicorn.log'))
+            master_pid = server.pid
+        wait_ready(url, server)
+        print('Polling %s%s at %.1f req/s for %.0fs, %d simulated sequencer(s) under %s'
+              % (url, args.path, args.rate, args.duration, len(args.sequencers), store_root))
+
+        if master_pid and os.path.isdir('/proc/%d' % master_pid):
+            sampler = ProcessSampler(master_pid)
+            sampler.start()
+
+        start = time.perf_counter()
+        results = LoadClient(url, args.path, args.concurrency, args.timeout).run(args.rate, args.duration)
+        elapsed = time.perf_counter() - start
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        stop.set()
+        if simulator.pid is not None:
+            try:
+                simulation = report.get(timeout=30)
+            except Exception:
+                pass
+            simulator.join(10)
+        if server is not None:
+            server.terminate()
+            server.wait(30)
+        if not (args.keep or args.workdir):
+            shutil.rmtree(store_root, ignore_errors=True)
+
+    summary = summarize(results, elapsed)
+    workers = sampler.report() if sampler is not None else []
+    print_report(summary, workers, simulation)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'summary': summary, 'workers': workers, 'simulation': simulation}, f, indent=2)
+
+    if args.keep or args.workdir:
+        print('\nSimulated storage kept in %s' % store_root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Benchmark suite of the status & SAV paths, on synthetic run folders (see synthetic_run.py).
+      For each instrument family & run size, reports the time (min & median of the repeats) and the peak memory
+      (resident set increase & Python allocations) of each stage. Each stage is measured in its own process,
+      so that the peak memory of a stage is not hidden by a previous one.
+      The results can be saved as json, then compared with a later run of the suite.
+
+      e.g python -m benchmarks.run_benchmarks -s NextSeq NovaSeq --sizes small full -o bench.json
+          python -m benchmarks.run_benchmarks --compare bench.json
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import concurrent.futures
+
+from API.status import main as status_main
+from API.status.lib.interop import load_run_metrics, load_imaging_metrics, summary, get_qscore_data
+from API.status.lib.format import format_q30_plot_data
+from API.status.lib.runindex import RunIndex
+from API.SAV_data.generate_SAV_data import sav_metrics
+from benchmarks.synthetic_run import INSTRUMENTS, SIZES, generate_run, sized_tile_count
+
+
+def _status_stage(cached):
+    """Builds the get_latest_run_status() stage, on a store holding the run only.
+    Not cached, the run cache & index are dropped before each call, as for a run which just changed.
+    """
+    def setup(run_dir, seq, store_root):
+        def reset():
+            if not cached:
+                status_main.run_cache.clear()
+                status_main.run_index = RunIndex()
+
+        def call():
+            return status_main.get_latest_run_status(store_root, [seq], 1, workers=1)
+
+        if cached:
+            call()
+        return reset, call
+    return setup
+
+
+def _metrics_stage(stage):
+    """Builds a stage working on the run metrics, loaded once (not measured)"""
+    def setup(run_dir, seq, store_root):
+        run_metrics = load_run_metrics(run_dir)
+        plot_data = get_qscore_data(run_metrics, seq)
+        calls = {
+            'summary': lambda: summary(run_metrics, {}, seq),
+            'get_qscore_data': lambda: get_qscore_data(run_metrics, seq),
+            'format_q30_plot_data': lambda: format_q30_plot_data(plot_data, seq),
+        }
+        return lambda: None, calls[stage]
+    return setup
+
+
+def _sav_metrics_setup(run_dir, seq, store_root):
+    """Builds the sav_metrics() stage, the imaging metrics being loaded once (not measured)"""
+    imaging_metrics = load_imaging_metrics(run_dir)
+    return lambda: None, lambda: sav_metrics(imaging_metrics)
+
+
+# Stage name -> setup(run_dir, seq, store_root), returning the (reset, call) functions of the stage:
+# reset() runs before each measured call, without being measured
+STAGES = {
+    'get_latest_run_status': _status_stage(cached=False),
+    'get_latest_run_status_cached': _status_stage(cached=True),
+    'load_run_metrics': lambda run_dir, seq, store_root: (lambda: None, lambda: load_run_metrics(run_dir)),
+    'summary': _metrics_stage('summary'),
+    'get_qscore_data': _metrics_stage('get_qscore_data'),
+    'format_q30_plot_data': _metrics_stage('format_q30_plot_data'),
+    'load_imaging_metrics': lambda run_dir, seq, store_root: (lambda: None, lambda: load_imaging_metrics(run_dir)),
+    'sav_metrics': _sav_metrics_setup,
+}
+
+
+def _memory_kb(field):
+    """Gets a memory field of the current process (e.g VmRSS, VmHWM) in kB, None without /proc"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Resets the peak resident set size (VmHWM) of the current process, Linux only
+
+    Returns:
+        bool: whether the peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def measure_stage(stage, run_dir, seq, store_root, repeat=3):
+    """Measures a stage, in the current process: peak memory of a first call, then time of -repeat- calls
+
+    Args:
+        stage (str): stage name, see STAGES
+        run_dir (str): path of the run folder
+        seq (str): sequencer name
+        store_root (str): path of the storage holding the run
+        repeat (int, optional): number of measured calls. Defaults to 3.
+
+    Returns:
+        dict: min & median durations (seconds), peak RSS increase & peak Python allocations (MB)
+    """
+    reset, call = STAGES[stage](run_dir, seq, store_root)
+
+    # Peak memory: resident set increase (native allocations included), then the Python allocations
+    reset()
+    peak_rss = None
+    if _reset_peak_rss():
+        baseline = _memory_kb('VmRSS')
+        call()
+        peak_rss = max(0, _memory_kb('VmHWM') - baseline) / 1024
+    else:
+        call()
+
+    reset()
+    tracemalloc.start()
+    call()
+    py_peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    tracemalloc.stop()
+
+    durations = []
+    for i in range(repeat):
+        reset()
+        start = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - start)
+
+    return {'min': min(durations), 'median': statistics.median(durations), 'peak_rss_mb': peak_rss, 'py_peak_mb': py_peak}
+
+
+def _measure_job(stage, run_dir, seq, store_root, repeat):
+    """Process job: measures a stage, reporting the failure instead of raising it"""
+    try:
+        return measure_stage(stage, run_dir, seq, store_root, repeat)
+    except Exception as e:
+        return {'error': '%s: %s' % (type(e).__name__, e)}
+
+
+def run_benchmarks(workdir, instruments, sizes, stages, repeat=3, seed=0):
+    """Generates the synthetic runs & measures each stage on each of them, in a fresh process per stage
+
+    Args:
+        workdir (str): storage root of the synthetic runs, 2 levels deep (e.g /tmp/bench, see runfolders.sequencer_name())
+        instruments (list): instrument families, see synthetic_run.INSTRUMENTS
+        sizes (list): run sizes, see SIZES
+        stages (list): stage names, see STAGES
+        repeat (int, optional): number of measured calls per stage. Defaults to 3.
+        seed (int, optional): seed of the synthetic runs. Defaults to 0.
+
+    Returns:
+        list: 1 dict per instrument, size & stage
+    """
+    results = []
+    for instrument in instruments:
+        for number, size in enumerate(sizes, 1):
+            # 1 sequencer directory per size, e.g NovaSeq2
+            seq = '%s%d' % (instrument, number)
+            run = generate_run(os.path.join(workdir, seq), instrument, tiles=sized_tile_count(instrument, size), seed=seed)
+            run_info = {'instrument': instrument, 'size': size, 'lanes': run.lanes, 'tiles': len(run.tile_ids),
+                        'cycles': run.total_cycles}
+
+            for stage in stages:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                    measure = executor.submit(_measure_job, stage, run.run_dir, seq, workdir, repeat).result()
+                results.append({**run_info, 'stage': stage, **measure})
+                print_result(results[-1])
+    return results
+
+
+def _key(result):
+    """Identifies a measure across 2 runs of the suite"""
+    return result['instrument'], result['size'], result['stage']
+
+
+def print_result(result, baseline=None):
+    """Prints a measure, with its speedup over a -baseline- measure (median durations)
+
+    Args:
+        result (dict): measure, see run_benchmarks()
+        baseline (dict, optional): measure of a previous run of the suite. Defaults to None.
+    """
+    name = '%-8s %-6s %dx%-4d %4dcy  %-28s' % (result['instrument'], result['size'], result['lanes'], result['tiles'],
+                                               result['cycles'], result['stage'])
+    if 'error' in result:
+        print('%s FAILED %s' % (name, result['error']))
+        return
+
+    rss = '%8.1fMB' % result['peak_rss_mb'] if result['peak_rss_mb'] is not None else '%10s' % '-'
+    line = '%s %9.4fs %9.4fs %s %8.1fMB' % (name, result['min'], result['median'], rss, result['py_peak_mb'])
+    if baseline is not None and 'error' not in baseline and result['median']:
+        line += '   x%.2f' % (baseline['median'] / result['median'])
+    print(line)
+
+
+def print_header(compare=False):
+    """Prints the header of the results table"""
+    print('%-8s %-6s %-7s %6s  %-28s %10s %10s %10s %10s%s' % ('instr.', 'size', 'lxtiles', 'cycles', 'stage', 'min', 'median',
+                                                              'peak RSS', 'peak py', '   speedup' if compare else ''))
+
+
+def main():
+    """Runs the benchmark suite from the command line"""
+    parser = argparse.ArgumentParser(description='InterOP API - Benchmarks of the status & SAV paths')
+    parser.add_argument('-s', '--instruments', help='Instrument families. Defaults to all.', nargs='+', choices=list(INSTRUMENTS), default=list(INSTRUMENTS))
+    parser.add_argument('--sizes', help='Run sizes (share of the flowcell tiles). Defaults to small full.', nargs='+', choices=list(SIZES), default=['small', 'full'])
+    parser.add_argument('--stages', help='Measured stages. Defaults to all.', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('-r', '--repeat', help='Number of measured calls per stage. Defaults to 3.', type=int, default=3)
+    parser.add_argument('-w', '--workdir', help='Storage root of the synthetic runs, 2 levels deep (e.g /tmp/bench). Defaults to a temporary directory.')
+    parser.add_argument('--keep', help='Keep the synthetic runs', action='store_true')
+    parser.add_argument('-o', '--output', help='Json file to save the results to')
+    parser.add_argument('--compare', help='Json file of a previous run of the suite: prints the speedup of each stage')
+    parser.add_argument('--seed', help='Seed of the synthetic runs. Defaults to 0.', type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='interop-bench-', dir='/tmp')
+    # The sequencer names are taken from the 3rd level of the path
+    if len(os.path.normpath(workdir).strip('/').split('/')) != 2:
+        parser.error('the workdir must be 2 levels deep, e.g /tmp/bench')
+    if args.workdir and os.path.exists(workdir) and os.listdir(workdir):
+        parser.error('the workdir %s is not empty' % workdir)
+
+    baselines = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baselines = {_key(result): result for result in json.load(f)['results']}
+
+    print_header()
+    try:
+        results = run_benchmarks(workdir, args.instruments, args.sizes, args.stages, max(args.repeat, 1), args.seed)
+    finally:
+        if args.keep:
+            print('\nSynthetic runs kept in %s' % workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if baselines:
+        print('\nCompared with %s (median of the baseline / median):' % args.compare)
+        print_header(compare=True)
+        for result in results:
+            print_result(result, baselines.get(_key(result)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'repeat': args.repeat, 'seed': args.seed, 'results': results}, f, indent=2)
+
+    if any('error' in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
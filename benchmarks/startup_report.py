@@ -0,0 +1,208 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Startup report of the entry points (API app, status module, SAV export CLI): each one is started in a fresh
+      interpreter, reporting its wall time & peak resident set (median of the repeats), then the slowest imports
+      (python -X importtime). Finally, the memory of a forked worker, the app being preloaded or not by the master
+      (see config.PRELOAD_MODULES and gunicorn --preload): the private memory is what each worker adds.
+
+      e.g python -m benchmarks.startup_report -r 5 --top 10
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Entry point name -> (python arguments, extra environment)
+ENTRY_POINTS = {
+    'runfolders': (['-c', 'import API.status.lib.runfolders'], {}),
+    'status': (['-c', 'import API.status.main'], {}),
+    'wsgi (lazy)': (['-c', 'import API.wsgi'], {'INTEROP_PRELOAD': '0'}),
+    'wsgi (preload)': (['-c', 'import API.wsgi'], {'INTEROP_PRELOAD': '1'}),
+    'sav --help': (['-m', 'API.SAV_data.generate_SAV_data', '--help'], {}),
+}
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _environment(extra):
+    """Gets the environment of an entry point, the repository being importable"""
+    env = dict(os.environ, **extra)
+    env['PYTHONPATH'] = REPOSITORY + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def run_entry_point(args, extra_env):
+    """Runs an entry point in a fresh interpreter
+
+    Args:
+        args (list): python arguments, e.g ['-c', 'import API.wsgi']
+        extra_env (dict): variables added to the environment
+
+    Returns:
+        tuple: wall time (seconds), peak resident set (MB)
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable] + args, cwd=REPOSITORY, env=_environment(extra_env),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # wait4() gives the resource usage of the child, i.e its peak resident set (kB on Linux)
+    _, status, usage = os.wait4(process.pid, 0)
+    duration = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError('%s exited with %d' % (' '.join(args), process.returncode))
+    return duration, usage.ru_maxrss / 1024
+
+
+def slowest_imports(args, extra_env, top=10):
+    """Gets the slowest imports of an entry point, by their own time (python -X importtime)
+
+    Args:
+        args (list): python arguments
+        extra_env (dict): variables added to the environment
+        top (int, optional): number of imports. Defaults to 10.
+
+    Returns:
+        list: (module, self time, cumulative time) tuples (seconds), the slowest first
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=REPOSITORY, env=_environment(extra_env),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package, indented by its nesting level
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(own) / 1e6, int(cumulative) / 1e6))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def _memory_rollup():
+    """Gets the memory of the current process (kB) by kind, None without /proc/self/smaps_rollup (Linux >= 4.14)"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if line.endswith('kB\n'))
+    except OSError:
+        return None
+    fields = {key: int(value.split()[0]) for key, value in fields.items()}
+    return {'rss': fields['Rss'], 'pss': fields['Pss'],
+            'private': fields['Private_Clean'] + fields['Private_Dirty'],
+            'shared': fields['Shared_Clean'] + fields['Shared_Dirty']}
+
+
+def fork_probe():
+    """Loads the app as the gunicorn master, then forks a worker which imports the modules its requests need.
+    Prints the memory of the worker (json), run in a fresh interpreter by worker_memory().
+    """
+    from API.wsgi import PRELOAD
+    from API.status.lib.lazy import preload
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        # No-op when preloaded by the master, otherwise the imports of the first request
+        preload(PRELOAD)
+        with os.fdopen(write, 'w') as f:
+            json.dump(_memory_rollup(), f)
+        os._exit(0)
+
+    os.close(write)
+    with os.fdopen(read) as f:
+        worker = f.read()
+    os.waitpid(pid, 0)
+    print(worker)
+
+
+def worker_memory(preloaded):
+    """Measures the memory of a worker forked from a master which preloaded the app or not
+
+    Args:
+        preloaded (bool): whether the master preloads the heavy modules
+
+    Returns:
+        dict: rss, pss, private & shared memory of the worker (MB), None without /proc/self/smaps_rollup
+    """
+    process = subprocess.run([sys.executable, '-c', 'from benchmarks.startup_report import fork_probe; fork_probe()'],
+                             cwd=REPOSITORY, env=_environment({'INTEROP_PRELOAD': '1' if preloaded else '0'}),
+                             stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    memory = json.loads(process.stdout)
+    return {key: value / 1024 for key, value in memory.items()} if memory else None
+
+
+def startup_report(entry_points, repeat=3, top=10):
+    """Measures the startup of each entry point
+
+    Args:
+        entry_points (list): entry point names, see ENTRY_POINTS
+        repeat (int, optional): number of runs per entry point. Defaults to 3.
+        top (int, optional): number of slowest imports per entry point. Defaults to 10.
+
+    Returns:
+        dict: per entry point measures, and the worker memory with & without preloading
+    """
+    report = {'entry_points': {}, 'workers': {}}
+    for name in entry_points:
+        args, extra_env = ENTRY_POINTS[name]
+        runs = [run_entry_point(args, extra_env) for i in range(repeat)]
+        report['entry_points'][name] = {
+            'wall_s': statistics.median(run[0] for run in runs),
+            'peak_rss_mb': statistics.median(run[1] for run in runs),
+            'imports': slowest_imports(args, extra_env, top),
+        }
+    if hasattr(os, 'fork'):
+        report['workers'] = {'lazy': worker_memory(False), 'preload': worker_memory(True)}
+    return report
+
+
+def print_report(report):
+    """Prints a startup report, see startup_report()"""
+    print('%-16s %10s %10s' % ('entry point', 'wall', 'peak RSS'))
+    for name, measure in report['entry_points'].items():
+        print('%-16s %9.3fs %8.1fMB' % (name, measure['wall_s'], measure['peak_rss_mb']))
+
+    for name, measure in report['entry_points'].items():
+        print('\nSlowest imports of %s (self, cumulative):' % name)
+        for module, own, cumulative in measure['imports']:
+            print('  %8.1fms %8.1fms  %s' % (own * 1000, cumulative * 1000, module))
+
+    if report['workers']:
+        print('\nMemory of a forked worker, once its modules imported:')
+        print('%-16s %10s %10s %10s %10s' % ('master', 'RSS', 'PSS', 'private', 'shared'))
+        for name, memory in report['workers'].items():
+            if memory is None:
+                print('%-16s %10s' % (name, 'n/a (no /proc/self/smaps_rollup)'))
+            else:
+                print('%-16s %8.1fMB %8.1fMB %8.1fMB %8.1fMB' % (name, memory['rss'], memory['pss'], memory['private'], memory['shared']))
+
+
+def main():
+    """Prints the startup report from the command line"""
+    parser = argparse.ArgumentParser(description='InterOP API - Startup time & memory of the entry points')
+    parser.add_argument('-e', '--entry-points', help='Entry points. Defaults to all.', nargs='+', choices=list(ENTRY_POINTS), default=list(ENTRY_POINTS))
+    parser.add_argument('-r', '--repeat', help='Number of runs per entry point. Defaults to 3.', type=int, default=3)
+    parser.add_argument('--top', help='Number of slowest imports per entry point. Defaults to 10.', type=int, default=10)
+    parser.add_argument('-o', '--output', help='Json file to save the report to')
+    args = parser.parse_args()
+
+    report = startup_report(args.entry_points, max(args.repeat, 1), args.top)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(report, python=sys.version.split()[0]), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
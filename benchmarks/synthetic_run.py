@@ -0,0 +1,523 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Generator of synthetic (but realistic) Illumina run folders, to benchmark & load-test the API offline.
+      Writes the RunInfo.xml, an instrument specific RunParameters.xml, the InterOP binaries
+      (Q, Extraction, Error & Tile metrics) at a chosen lane / tile / cycle count and the completion files.
+      The cycles can be appended afterwards, as a sequencer does during a live run.
+
+      e.g python -m benchmarks.synthetic_run -o /tmp/store/NovaSeq1 -s NovaSeq --lanes 2 --tiles 100 --cycles 50
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import math
+import struct
+import argparse
+import numpy as np
+
+from interop import py_interop_run
+
+# Q score bins of the binned instruments: lower & upper bounds, value
+Q_BINS = ((2, 9, 2), (10, 19, 14), (20, 29, 21), (30, 39, 33), (40, 41, 40))
+# Number of Q scores of the unbinned instruments
+Q_UNBINNED = 50
+
+# Per instrument family: flowcell layout, reads, InterOP formats, RunParameters & completion files.
+# The tile count of a lane is surfaces x swaths x sections x tiles (per swath & section).
+INSTRUMENTS = {
+    'MiSeq': {
+        'instrument': 'M04321', 'run_info_version': 2, 'channels': ('A', 'C', 'G', 'T'),
+        'lanes': 1, 'surfaces': 2, 'swaths': 1, 'sections': 1, 'tiles': 14, 'naming': 'FourDigit',
+        'reads': '151,8i,8i,151', 'binned': False,
+        'clusters': 550000, 'tile_area': 0.55,
+        'parameters_file': 'runParameters.xml', 'completion_files': ('RTAComplete.txt',),
+    },
+    'NextSeq': {
+        'instrument': 'NB551234', 'run_info_version': 4, 'channels': ('Red', 'Green'),
+        'lanes': 4, 'surfaces': 2, 'swaths': 3, 'sections': 3, 'tiles': 12, 'naming': 'FiveDigit',
+        'reads': '76,8i,8i,76', 'binned': True,
+        'clusters': 480000, 'tile_area': 0.21,
+        'parameters_file': 'RunParameters.xml', 'completion_files': ('RTAComplete.txt', 'CopyComplete.txt'),
+    },
+    'NovaSeq': {
+        'instrument': 'A00123', 'run_info_version': 5, 'channels': ('Red', 'Green'),
+        'lanes': 2, 'surfaces': 2, 'swaths': 4, 'sections': 1, 'tiles': 88, 'naming': 'FourDigit',
+        'reads': '151,10i,10i,151', 'binned': True,
+        'clusters': 2900000, 'tile_area': 1.0,
+        'parameters_file': 'RunParameters.xml', 'completion_files': ('RTAComplete.txt', 'CopyComplete.txt'),
+    },
+}
+
+RUN_PARAMETERS = {
+    'MiSeq': """<?xml version="1.0"?>
+<RunParameters xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <ExperimentName>{exp_name}</ExperimentName>
+  <FlowcellRFIDTag>
+    <SerialNumber>{flowcell}</SerialNumber>
+    <PartNumber>15028382</PartNumber>
+    <ExpirationDate>2023-01-01T00:00:00</ExpirationDate>
+  </FlowcellRFIDTag>
+  <PR2BottleRFIDTag>
+    <SerialNumber>MS{serial}-00PR2</SerialNumber>
+    <PartNumber>15041807</PartNumber>
+    <ExpirationDate>2023-01-01T00:00:00</ExpirationDate>
+  </PR2BottleRFIDTag>
+  <ReagentKitRFIDTag>
+    <SerialNumber>MS{serial}-300V2</SerialNumber>
+    <PartNumber>15033572</PartNumber>
+    <ExpirationDate>2023-01-01T00:00:00</ExpirationDate>
+  </ReagentKitRFIDTag>
+</RunParameters>
+""",
+    'NextSeq': """<?xml version="1.0"?>
+<RunParameters xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <ExperimentName>{exp_name}</ExperimentName>
+  <FlowCellRfidTag>
+    <SerialNumber>{flowcell}</SerialNumber>
+    <PartNumber>20022409</PartNumber>
+    <ExpirationDate>2023-01-01T00:00:00</ExpirationDate>
+  </FlowCellRfidTag>
+  <PR2BottleRfidTag>
+    <SerialNumber>NS{serial}-BUFFR</SerialNumber>
+    <PartNumber>15057941</PartNumber>
+    <ExpirationDate>2023-01-01T00:00:00</ExpirationDate>
+  </PR2BottleRfidTag>
+  <ReagentKitRfidTag>
+    <SerialNumber>NS{serial}-REAGT</SerialNumber>
+    <PartNumber>15057934</PartNumber>
+    <ExpirationDate>2023-01-01T00:00:00</ExpirationDate>
+  </ReagentKitRfidTag>
+</RunParameters>
+""",
+    'NovaSeq': """<?xml version="1.0"?>
+<RunParameters xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <ExperimentName>{exp_name}</ExperimentName>
+  <Side>{side}</Side>
+  <RfidsInfo>
+    <FlowCellSerialBarcode>{flowcell}</FlowCellSerialBarcode>
+    <FlowCellPartNumber>20015845</FlowCellPartNumber>
+    <LibraryTubeSerialBarcode>NV{serial}-LIBTUBE</LibraryTubeSerialBarcode>
+    <LibraryTubePartNumber>20022875</LibraryTubePartNumber>
+    <SbsSerialBarcode>NV{serial}-RGSBS</SbsSerialBarcode>
+    <SbsPartNumber>20022829</SbsPartNumber>
+    <ClusterSerialBarcode>NV{serial}-RGCPE</ClusterSerialBarcode>
+    <ClusterPartNumber>20022830</ClusterPartNumber>
+    <BufferSerialBarcode>NV{serial}-BUFFR</BufferSerialBarcode>
+    <BufferPartNumber>20022831</BufferPartNumber>
+  </RfidsInfo>
+</RunParameters>
+""",
+}
+
+# Run sizes: share of the tiles of the instrument flowcell
+SIZES = {'small': 0.1, 'medium': 0.5, 'full': 1.0}
+
+# Tile metric codes of the InterOP format version 2
+TILE_CODES = {'density': 100, 'density_pf': 101, 'cluster_count': 102, 'cluster_count_pf': 103,
+              'phasing': 200, 'prephasing': 201, 'percent_aligned': 300}
+
+
+def parse_reads(reads):
+    """Parses a read structure, e.g '151,8i,8i,151': the cycle count of each read, 'i' marking an index read
+
+    Args:
+        reads (str): comma separated reads
+
+    Returns:
+        list: (cycle count, is index) of each read
+    """
+    parsed = []
+    for read in reads.split(','):
+        read = read.strip().lower()
+        parsed.append((int(read.rstrip('i')), read.endswith('i')))
+    return parsed
+
+
+def instrument_family(seq):
+    """Gets the instrument family of a sequencer name, e.g NovaSeq for NovaSeq1
+
+    Args:
+        seq (str): sequencer or instrument family name
+
+    Returns:
+        str: key of INSTRUMENTS
+    """
+    for family in INSTRUMENTS:
+        if family.lower() in seq.lower():
+            return family
+    raise ValueError('Unknown instrument family: %s (expected one of %s)' % (seq, ', '.join(INSTRUMENTS)))
+
+
+def sized_tile_count(instrument, size):
+    """Gets the number of tiles per lane of a run size
+
+    Args:
+        instrument (str): instrument family, see INSTRUMENTS
+        size (str): run size, see SIZES
+
+    Returns:
+        int: number of tiles per lane
+    """
+    profile = INSTRUMENTS[instrument]
+    tile_count = profile['surfaces'] * profile['swaths'] * profile['sections'] * profile['tiles']
+    return max(1, round(tile_count * SIZES[size]))
+
+
+class SyntheticRun:
+    """Synthetic run folder of an instrument family.
+    The layout (RunInfo, RunParameters, tile metrics & InterOP headers) is written by create(),
+    the cycle records appended by write_cycles(), the completion files by complete().
+    The values are drawn from a seeded generator: the same arguments give the same run.
+    """
+
+    def __init__(self, output_dir, instrument='NextSeq', lanes=None, tiles=None, reads=None,
+                 run_number=1, date='220101', side='A', seed=0):
+        """
+        Args:
+            output_dir (str): directory holding the run folder, e.g the directory of a sequencer
+            instrument (str, optional): instrument family, see INSTRUMENTS. Defaults to 'NextSeq'.
+            lanes (int, optional): number of lanes. Defaults to the instrument one.
+            tiles (int, optional): number of tiles per lane. Defaults to the instrument one.
+            reads (str, optional): read structure, see parse_reads(). Defaults to the instrument one.
+            run_number (int, optional): run number of the instrument. Defaults to 1.
+            date (str, optional): run date, YYMMDD. Defaults to '220101'.
+            side (str, optional): flowcell side of the NovaSeq runs. Defaults to 'A'.
+            seed (int, optional): seed of the values. Defaults to 0.
+        """
+        self.family = instrument_family(instrument)
+        self.profile = INSTRUMENTS[self.family]
+        self.is_nova = self.family == 'NovaSeq'
+        self.lanes = lanes or self.profile['lanes']
+        self.reads = parse_reads(reads or self.profile['reads'])
+        self.total_cycles = sum(cycles for cycles, is_index in self.reads)
+        self.rng = np.random.default_rng(seed)
+
+        self.flowcell = self._flowcell_id()
+        folder_flowcell = side + self.flowcell if self.is_nova else self.flowcell
+        self.name = '%s_%s_%04d_%s' % (date, self.profile['instrument'], run_number, folder_flowcell)
+        self.run_dir = os.path.join(output_dir, self.name)
+        self.date = date
+        self.run_number = run_number
+        self.side = side
+        self.last_cycle = 0
+
+        self.tile_ids, self.tiles_per_swath = self._tile_ids(tiles or self._profile_tile_count())
+        # Lane & tile of each tile record, in the file order
+        self.lane_of_tile = np.repeat(np.arange(1, self.lanes + 1), len(self.tile_ids))
+        self.tile_of_tile = np.tile(np.asarray(self.tile_ids), self.lanes)
+        # Per tile cluster counts & quality, fixed for the whole run
+        tile_count = len(self.lane_of_tile)
+        self.cluster_count = self.rng.normal(self.profile['clusters'], self.profile['clusters'] * 0.05, tile_count).clip(1)
+        self.pf_ratio = self.rng.normal(0.85, 0.03, tile_count).clip(0.5, 0.99)
+        self.q30_offset = self.rng.normal(0, 0.015, tile_count)
+
+    @property
+    def interop_dir(self):
+        """str: InterOP directory of the run folder"""
+        return os.path.join(self.run_dir, 'InterOp')
+
+    def _profile_tile_count(self):
+        """Gets the number of tiles per lane of the instrument"""
+        profile = self.profile
+        return profile['surfaces'] * profile['swaths'] * profile['sections'] * profile['tiles']
+
+    def _flowcell_id(self):
+        """Draws a flowcell barcode in the instrument format"""
+        letters = ''.join(self.rng.choice(list('ABCDEFGHJKLMNPQRSTUVWXYZ0123456789'), 5))
+        if self.family == 'MiSeq':
+            return '000000000-' + letters
+        if self.family == 'NextSeq':
+            return 'H' + letters + 'BGXC'
+        return 'H' + letters + 'DSX3'
+
+    def _tile_ids(self, tile_count):
+        """Names the tiles of a lane: surface, swath, (section for the 5 digits naming) & tile number.
+        The tiles per swath are the fewest holding -tile_count- tiles, the extra ones being dropped.
+
+        Returns:
+            tuple(list, int): tile numbers & number of tiles per swath
+        """
+        profile = self.profile
+        sections = profile['sections']
+        per_swath = max(1, math.ceil(tile_count / (profile['surfaces'] * profile['swaths'] * sections)))
+        if per_swath > 99:
+            raise ValueError('Too many tiles per lane: %d' % tile_count)
+
+        tile_ids = []
+        for surface in range(1, profile['surfaces'] + 1):
+            for swath in range(1, profile['swaths'] + 1):
+                for section in range(1, sections + 1):
+                    for tile in range(1, per_swath + 1):
+                        if profile['naming'] == 'FiveDigit':
+                            tile_ids.append(int('%d%d%d%02d' % (surface, swath, section, tile)))
+                        else:
+                            tile_ids.append(int('%d%d%02d' % (surface, swath, tile)))
+        return tile_ids[:tile_count], per_swath
+
+    def create(self, exp_name='benchmark'):
+        """Writes the run folder layout: RunInfo.xml, RunParameters.xml, the tile metrics & the
+        headers of the per cycle InterOP files, without any cycle
+
+        Args:
+            exp_name (str, optional): experiment name. Defaults to 'benchmark'.
+
+        Returns:
+            str: path of the run folder
+        """
+        os.makedirs(self.interop_dir, exist_ok=True)
+        self.write_run_info()
+        self.write_run_parameters(exp_name)
+        self.write_tile_metrics()
+
+        binned = self.profile['binned']
+        with open(os.path.join(self.interop_dir, 'QMetricsOut.bin'), 'wb') as f:
+            f.write(self._q_header(binned))
+        with open(os.path.join(self.interop_dir, 'ExtractionMetricsOut.bin'), 'wb') as f:
+            f.write(struct.pack('<BBB', 3, self._extraction_dtype().itemsize, len(self.profile['channels']))
+                    if self.is_nova else struct.pack('<BB', 2, self._extraction_dtype().itemsize))
+        with open(os.path.join(self.interop_dir, 'ErrorMetricsOut.bin'), 'wb') as f:
+            f.write(struct.pack('<BB', 4 if self.is_nova else 3, self._error_dtype().itemsize))
+        return self.run_dir
+
+    def write_run_info(self):
+        """Writes the RunInfo.xml, with the InterOP library"""
+        profile = self.profile
+        naming = getattr(py_interop_run, profile['naming'])
+        tile_names = ['%d_%d' % (lane, tile) for lane in range(1, self.lanes + 1) for tile in self.tile_ids]
+        layout = py_interop_run.flowcell_layout(self.lanes, profile['surfaces'], profile['swaths'], self.tiles_per_swath,
+                                                profile['sections'], 1, tile_names, naming, self.flowcell)
+
+        reads = py_interop_run.read_info_vector()
+        first_cycle = 1
+        for number, (cycles, is_index) in enumerate(self.reads, 1):
+            reads.push_back(py_interop_run.read_info(number, first_cycle, first_cycle + cycles - 1, is_index, False))
+            first_cycle += cycles
+
+        info = py_interop_run.info(self.name, self.date, profile['instrument'], self.run_number, profile['run_info_version'],
+                                   layout, list(profile['channels']), py_interop_run.image_dimensions(2048, 2592), reads)
+        info.write(os.path.join(self.run_dir, 'RunInfo.xml'))
+
+    def write_run_parameters(self, exp_name='benchmark'):
+        """Writes the RunParameters.xml of the instrument family, named as by the instrument"""
+        content = RUN_PARAMETERS[self.family].format(exp_name=exp_name, flowcell=self.flowcell, side=self.side,
+                                                     serial='%07d' % self.rng.integers(10 ** 7))
+        with open(os.path.join(self.run_dir, self.profile['parameters_file']), 'w') as f:
+            f.write(content)
+
+    def write_tile_metrics(self):
+        """Writes the TileMetricsOut.bin: cluster counts & densities, phasing & percent aligned per read"""
+        area = self.profile['tile_area']
+        count = self.cluster_count.astype(np.float32)
+        count_pf = (self.cluster_count * self.pf_ratio).astype(np.float32)
+        aligned = self.rng.normal(92, 2, len(count)).clip(0, 100).astype(np.float32)
+        data_reads = [number for number, (cycles, is_index) in enumerate(self.reads, 1) if not is_index]
+
+        tile_dtype = np.dtype([('lane', '<u2'), ('tile', '<u4' if self.is_nova else '<u2')])
+        if self.is_nova:
+            # Version 3: typed records, the densities being computed from the tile area of the header
+            count_dtype = np.dtype(tile_dtype.descr + [('code', 'S1'), ('count', '<f4'), ('count_pf', '<f4')])
+            read_dtype = np.dtype(tile_dtype.descr + [('code', 'S1'), ('read', '<u4'), ('percent_aligned', '<f4')])
+            chunks = [struct.pack('<BBf', 3, count_dtype.itemsize, area),
+                      self._records(count_dtype, code=b't', count=count, count_pf=count_pf)]
+            for read in data_reads:
+                chunks.append(self._records(read_dtype, code=b'r', read=read, percent_aligned=aligned))
+        else:
+            # Version 2: (code, value) records
+            value_dtype = np.dtype(tile_dtype.descr + [('code', '<u2'), ('value', '<f4')])
+            values = {'density': count / area, 'density_pf': count_pf / area,
+                      'cluster_count': count, 'cluster_count_pf': count_pf}
+            chunks = [struct.pack('<BB', 2, value_dtype.itemsize)]
+            chunks += [self._records(value_dtype, code=TILE_CODES[name], value=value) for name, value in values.items()]
+            for index, read in enumerate(data_reads):
+                chunks.append(self._records(value_dtype, code=TILE_CODES['phasing'] + 2 * (read - 1), value=0.1))
+                chunks.append(self._records(value_dtype, code=TILE_CODES['prephasing'] + 2 * (read - 1), value=0.08))
+                chunks.append(self._records(value_dtype, code=TILE_CODES['percent_aligned'] + read - 1, value=aligned))
+
+        with open(os.path.join(self.interop_dir, 'TileMetricsOut.bin'), 'wb') as f:
+            f.write(b''.join(chunks))
+
+    def _records(self, dtype, **values):
+        """Builds 1 record per tile of the flowcell"""
+        records = np.zeros(len(self.lane_of_tile), dtype=dtype)
+        records['lane'] = self.lane_of_tile
+        records['tile'] = self.tile_of_tile
+        for name, value in values.items():
+            records[name] = value
+        return records.tobytes()
+
+    def _q_header(self, binned):
+        """Builds the header of the QMetricsOut.bin: version, record size & Q score bins"""
+        header = struct.pack('<BBB', 7 if self.is_nova else 6, self._q_dtype().itemsize, int(binned))
+        if binned:
+            header += struct.pack('<B', len(Q_BINS))
+            if self.is_nova:
+                header += bytes(value for q_bin in Q_BINS for value in q_bin)
+            else:
+                header += bytes(bytearray(q_bin[i] for i in range(3) for q_bin in Q_BINS))
+        return header
+
+    def _q_dtype(self):
+        """Record of the Q metrics: 1 count per Q score (bin)"""
+        bins = len(Q_BINS) if self.profile['binned'] else Q_UNBINNED
+        return np.dtype([('lane', '<u2'), ('tile', '<u4' if self.is_nova else '<u2'), ('cycle', '<u2'),
+                         ('histogram', '<u4', (bins,))])
+
+    def _extraction_dtype(self):
+        """Record of the extraction metrics: focus & max intensity per channel (version 2: 4 channels & a date)"""
+        if self.is_nova:
+            channels = len(self.profile['channels'])
+            return np.dtype([('lane', '<u2'), ('tile', '<u4'), ('cycle', '<u2'),
+                             ('focus', '<f4', (channels,)), ('max_intensity', '<u2', (channels,))])
+        return np.dtype([('lane', '<u2'), ('tile', '<u2'), ('cycle', '<u2'),
+                         ('focus', '<f4', (4,)), ('max_intensity', '<u2', (4,)), ('date_time', '<u8')])
+
+    def _error_dtype(self):
+        """Record of the error metrics (version 3: with the mismatch counts)"""
+        if self.is_nova:
+            return np.dtype([('lane', '<u2'), ('tile', '<u4'), ('cycle', '<u2'), ('error_rate', '<f4')])
+        return np.dtype([('lane', '<u2'), ('tile', '<u2'), ('cycle', '<u2'), ('error_rate', '<f4'), ('mismatch', '<u4', (5,))])
+
+    def _q_histograms(self, cycles):
+        """Draws the Q score histograms of the PF clusters: the % >= Q30 decreasing along the cycles
+
+        Args:
+            cycles (numpy.ndarray): cycle of each record
+
+        Returns:
+            numpy.ndarray: 1 histogram per record
+        """
+        tile_count = len(self.lane_of_tile)
+        progress = (cycles / self.total_cycles).reshape(-1, tile_count)
+        q30 = (0.95 - 0.2 * progress ** 2 + self.q30_offset).clip(0.3, 0.99).ravel()
+        clusters = np.tile(self.cluster_count * self.pf_ratio, len(progress))
+        above, below = clusters * q30, clusters * (1 - q30)
+
+        if self.profile['binned']:
+            shares = ((below, 0.05), (below, 0.25), (below, 0.7), (above, 0.35), (above, 0.65))
+            columns = [count * share for count, share in shares]
+            return np.rint(np.column_stack(columns)).astype(np.uint32)
+
+        # Spread over every Q score: InterOP takes a histogram of a few Q scores for binned legacy data
+        q_scores = np.arange(1, Q_UNBINNED + 1)
+        low_shares = np.where(q_scores < 30, q_scores, 0) / np.sum(np.arange(1, 30))
+        high_shares = np.where((q_scores >= 30) & (q_scores <= 41), np.exp(-0.5 * ((q_scores - 37) / 2.5) ** 2), 0)
+        high_shares /= high_shares.sum()
+        return np.rint(np.outer(below, low_shares) + np.outer(above, high_shares)).astype(np.uint32)
+
+    def write_cycles(self, last_cycle):
+        """Appends the records of the cycles following the last written one, up to -last_cycle-
+        (Q, extraction & error metrics), as the sequencer does at the end of each cycle.
+
+        Args:
+            last_cycle (int): last extracted cycle, at most the total number of cycles
+
+        Returns:
+            int: the last written cycle
+        """
+        last_cycle = min(last_cycle, self.total_cycles)
+        if last_cycle <= self.last_cycle:
+            return self.last_cycle
+
+        cycle_range = np.arange(self.last_cycle + 1, last_cycle + 1)
+        record_count = len(cycle_range) * len(self.lane_of_tile)
+        cycles = np.repeat(cycle_range, len(self.lane_of_tile))
+        lanes = np.tile(self.lane_of_tile, len(cycle_range))
+        tiles = np.tile(self.tile_of_tile, len(cycle_range))
+
+        def records(dtype):
+            array = np.zeros(record_count, dtype=dtype)
+            array['lane'], array['tile'], array['cycle'] = lanes, tiles, cycles
+            return array
+
+        q = records(self._q_dtype())
+        q['histogram'] = self._q_histograms(cycles)
+
+        extraction = records(self._extraction_dtype())
+        channels = extraction['focus'].shape[1]
+        decay = np.exp(-cycles / (self.total_cycles * 1.5))[:, None]
+        extraction['focus'] = self.rng.normal(2.6, 0.1, (record_count, channels))
+        extraction['max_intensity'] = (self.rng.normal(3000, 300, (record_count, channels)) * decay).clip(100, 65535)
+
+        # Error rates of the data reads only (aligned on the PhiX)
+        index_cycles = np.concatenate([[is_index] * count for count, is_index in self.reads])
+        aligned = ~index_cycles[cycles - 1]
+        error = records(self._error_dtype())[aligned]
+        error['error_rate'] = (0.15 + 0.6 * (error['cycle'] / self.total_cycles) ** 2 +
+                               self.rng.normal(0, 0.03, len(error))).clip(0)
+
+        for name, array in (('QMetricsOut.bin', q), ('ExtractionMetricsOut.bin', extraction), ('ErrorMetricsOut.bin', error)):
+            with open(os.path.join(self.interop_dir, name), 'ab') as f:
+                f.write(array.tobytes())
+
+        self.last_cycle = last_cycle
+        return last_cycle
+
+    def complete(self, copied=True):
+        """Writes the completion files of the instrument
+
+        Args:
+            copied (bool, optional): whether the run copy is over (CopyComplete.txt), otherwise the run is finalizing
+                                     (RTAComplete.txt only). Defaults to True.
+        """
+        for name in self.profile['completion_files']:
+            if name == 'CopyComplete.txt' and not copied:
+                continue
+            with open(os.path.join(self.run_dir, name), 'w') as f:
+                f.write('')
+
+
+def generate_run(output_dir, instrument='NextSeq', lanes=None, tiles=None, reads=None, cycles=None,
+                 completed=None, run_number=1, date='220101', seed=0):
+    """Writes a synthetic run folder
+
+    Args:
+        output_dir (str): directory holding the run folder, e.g the directory of a sequencer
+        instrument (str, optional): instrument family, see INSTRUMENTS. Defaults to 'NextSeq'.
+        lanes (int, optional): number of lanes. Defaults to the instrument one.
+        tiles (int, optional): number of tiles per lane. Defaults to the instrument one.
+        reads (str, optional): read structure, e.g '151,8i,8i,151'. Defaults to the instrument one.
+        cycles (int, optional): last extracted cycle. Defaults to None (all the cycles).
+        completed (bool, optional): whether to write the completion files. Defaults to None (when all the cycles are written).
+        run_number (int, optional): run number of the instrument. Defaults to 1.
+        date (str, optional): run date, YYMMDD. Defaults to '220101'.
+        seed (int, optional): seed of the values. Defaults to 0.
+
+    Returns:
+        SyntheticRun: the written run
+    """
+    run = SyntheticRun(output_dir, instrument, lanes, tiles, reads, run_number, date, seed=seed)
+    run.create()
+    run.write_cycles(run.total_cycles if cycles is None else cycles)
+    if completed or (completed is None and run.last_cycle == run.total_cycles):
+        run.complete()
+    return run
+
+
+def main():
+    """Writes a synthetic run folder from the command line"""
+    parser = argparse.ArgumentParser(description='InterOP API - Synthetic run folder')
+    parser.add_argument('-o', '--output', help='Directory holding the run folder, e.g /tmp/store/NovaSeq1', required=True)
+    parser.add_argument('-s', '--instrument', help='Instrument family. Defaults to NextSeq.', choices=list(INSTRUMENTS), default='NextSeq')
+    parser.add_argument('--lanes', help='Number of lanes. Defaults to the instrument one.', type=int)
+    parser.add_argument('--tiles', help='Number of tiles per lane. Defaults to the instrument one.', type=int)
+    parser.add_argument('--reads', help="Read structure, 'i' marking the index reads, e.g 151,8i,8i,151")
+    parser.add_argument('--cycles', help='Last extracted cycle, for a live run. Defaults to all the cycles.', type=int)
+    parser.add_argument('--run-number', help='Run number of the instrument. Defaults to 1.', type=int, default=1)
+    parser.add_argument('--seed', help='Seed of the values. Defaults to 0.', type=int, default=0)
+    args = parser.parse_args()
+
+    run = generate_run(args.output, args.instrument, args.lanes, args.tiles, args.reads, args.cycles,
+                       run_number=args.run_number, seed=args.seed)
+    print('%s: %d lane(s) x %d tiles, %d/%d cycles' % (run.run_dir, run.lanes, len(run.tile_ids), run.last_cycle, run.total_cycles))
+
+
+if __name__ == "__main__":
+    main()
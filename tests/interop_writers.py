@@ -0,0 +1,93 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Writers of small InterOP binary files for the tests, one per metric & format version.
+      Built with struct, independently of the numpy layouts of API/status/lib/binfiles.py.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import struct
+
+# (lower, upper, value) of the 7 Q bins of the NextSeq / NovaSeq RTA
+Q_BINS = [(2, 9, 7), (10, 19, 14), (20, 24, 21), (25, 29, 27), (30, 34, 32), (35, 39, 36), (40, 41, 40)]
+
+# Record size & tile format per metric & version
+RECORD_SIZES = {
+    ('Q', 4): 206, ('Q', 6): 6 + 4 * len(Q_BINS), ('Q', 7): 8 + 4 * len(Q_BINS),
+    ('Extraction', 2): 38, ('Extraction', 3): 20,
+    ('Error', 3): 30, ('Error', 4): 12,
+    ('Tile', 2): 10, ('Tile', 3): 15,
+}
+
+
+def q_header(version, binned=True):
+    """Header of a QMetricsOut.bin file"""
+    header = bytes([version, RECORD_SIZES[('Q', version)] if binned else 6 + (version == 7) * 2 + 200])
+    if version == 4:
+        return header
+    if not binned:
+        return header + b'\x00'
+
+    if version == 6:
+        values = [b[0] for b in Q_BINS] + [b[1] for b in Q_BINS] + [b[2] for b in Q_BINS]
+    else:
+        values = [value for b in Q_BINS for value in b]
+    return header + bytes([1, len(Q_BINS)] + values)
+
+
+def q_record(version, lane, tile, cycle, hist):
+    """Record of a QMetricsOut.bin file: lane, tile, cycle & the cluster count of each Q bin (or score)"""
+    tile_format = 'I' if version == 7 else 'H'
+    return struct.pack('<H%sH%dI' % (tile_format, len(hist)), lane, tile, cycle, *hist)
+
+
+def extraction_header(version, channels=2):
+    """Header of an ExtractionMetricsOut.bin file"""
+    if version == 2:
+        return bytes([2, RECORD_SIZES[('Extraction', 2)]])
+    return bytes([3, 8 + 6 * channels, channels])
+
+
+def extraction_record(version, lane, tile, cycle, channels=2):
+    """Record of an ExtractionMetricsOut.bin file, with arbitrary FWHM & intensities"""
+    if version == 2:
+        return struct.pack('<HHH4f4HQ', lane, tile, cycle, *[2.5] * 4, *[1000] * 4, 0)
+    return struct.pack('<HIH%df%dH' % (channels, channels), lane, tile, cycle, *[2.5] * channels, *[1000] * channels)
+
+
+def error_header(version):
+    """Header of an ErrorMetricsOut.bin file"""
+    return bytes([version, RECORD_SIZES[('Error', version)]])
+
+
+def error_record(version, lane, tile, cycle, error_rate):
+    """Record of an ErrorMetricsOut.bin file"""
+    if version == 3:
+        return struct.pack('<HHHf5I', lane, tile, cycle, error_rate, *[0] * 5)
+    return struct.pack('<HIHf', lane, tile, cycle, error_rate)
+
+
+def tile_header(version, area=0.0):
+    """Header of a TileMetricsOut.bin file, v3 holding the tile area"""
+    header = bytes([version, RECORD_SIZES[('Tile', version)]])
+    return header + struct.pack('<f', area) if version == 3 else header
+
+
+def tile_record(version, lane, tile, code, value1, value2=0.0):
+    """Record of a TileMetricsOut.bin file. v2: a metric code & its value, v3: a record kind (e.g 't') & 2 values"""
+    if version == 2:
+        return struct.pack('<HHHf', lane, tile, code, value1)
+    return struct.pack('<HIcff', lane, tile, code, value1, value2)
+
+
+def write(path, *chunks, mode='wb'):
+    """Writes (or appends) the binary chunks to a file"""
+    with open(path, mode) as f:
+        f.write(b''.join(chunks))
@@ -0,0 +1,140 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Tests of the lightweight InterOP readers: record layouts of each supported format version & last extracted cycle.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import io
+
+import numpy as np
+import pytest
+
+from API.status.lib.binfiles import read_layout, read_extraction_max_cycle
+from interop_writers import Q_BINS, q_header, q_record, extraction_header, extraction_record, error_header, \
+    error_record, tile_header, tile_record, write
+
+
+def parse(data, metric):
+    """Reads the layout of the -data- file & its records"""
+    f = io.BytesIO(data)
+    layout = read_layout(f, metric)
+    assert layout is not None
+    return layout, np.frombuffer(data[layout['header_size']:], dtype=layout['dtype'])
+
+
+@pytest.mark.parametrize('version', [6, 7])
+def test_q_binned(version):
+    hist = [1, 2, 3, 4, 5, 6, 7]
+    # v7 (NovaSeq) tiles do not fit in a uint16
+    tile = 1101 if version == 6 else 12345678
+    layout, records = parse(q_header(version) + q_record(version, 1, tile, 3, hist) + q_record(version, 2, 2204, 4, hist[::-1]),
+                            'Q')
+    assert layout['bins'] == Q_BINS
+    assert layout['header_size'] == 4 + 3 * len(Q_BINS)
+    assert records['lane'].tolist() == [1, 2]
+    assert records['tile'].tolist() == [tile, 2204]
+    assert records['cycle'].tolist() == [3, 4]
+    assert records['hist'].tolist() == [hist, hist[::-1]]
+
+
+def test_q_unbinned_v4():
+    hist = list(range(50))
+    layout, records = parse(q_header(4) + q_record(4, 1, 1101, 1, hist), 'Q')
+    assert layout['bins'] == []
+    assert layout['header_size'] == 2
+    assert records['hist'].tolist() == [hist]
+
+
+def test_q_unbinned_v6():
+    hist = list(range(50))
+    layout, records = parse(q_header(6, binned=False) + q_record(6, 1, 1101, 2, hist), 'Q')
+    assert layout['bins'] == []
+    assert layout['header_size'] == 3
+    assert records['cycle'].tolist() == [2]
+    assert records['hist'].tolist() == [hist]
+
+
+@pytest.mark.parametrize('version', [2, 3])
+def test_extraction(version):
+    data = extraction_header(version) + b''.join(extraction_record(version, 1, 11101, cycle) for cycle in (1, 2, 3))
+    layout, records = parse(data, 'Extraction')
+    assert layout['header_size'] == (2 if version == 2 else 3)
+    assert records['cycle'].tolist() == [1, 2, 3]
+
+
+@pytest.mark.parametrize('version', [3, 4])
+def test_error(version):
+    layout, records = parse(error_header(version) + error_record(version, 2, 1102, 25, 0.5), 'Error')
+    assert records['lane'].tolist() == [2]
+    assert records['tile'].tolist() == [1102]
+    assert records['cycle'].tolist() == [25]
+    assert records['error_rate'].tolist() == [0.5]
+
+
+def test_tile_v2():
+    layout, records = parse(tile_header(2) + tile_record(2, 1, 1101, 100, 1.5e6) + tile_record(2, 1, 1101, 102, 1.2e6), 'Tile')
+    assert records['code'].tolist() == [100, 102]
+    assert records['value'].tolist() == [1.5e6, 1.2e6]
+
+
+def test_tile_v3():
+    data = tile_header(3, area=2.5) + tile_record(3, 1, 11101, b't', 3e5, 2.5e5) + tile_record(3, 1, 11101, b'r', 0)
+    layout, records = parse(data, 'Tile')
+    assert layout['header_size'] == 6
+    assert layout['area'] == 2.5
+    assert records['tile'].tolist() == [11101, 11101]
+    assert records['code'].tolist() == [ord('t'), ord('r')]
+    assert records['value1'][0] == 3e5
+    assert records['value2'][0] == 2.5e5
+
+
+@pytest.mark.parametrize('data, metric', [
+    (b'', 'Q'),
+    (b'\x06', 'Q'),                                     # header being written
+    (bytes([6, 34, 1, 7]) + bytes(5), 'Q'),             # incomplete bins
+    (bytes([5, 206]), 'Q'),                             # unknown version
+    (bytes([7, 99]) + q_header(7)[2:], 'Q'),            # record size not matching the version
+    (bytes([1, 10]), 'Error'),
+    (bytes([4, 38]), 'Extraction'),
+    (bytes([3, 15, 0]), 'Tile'),                        # area being written
+])
+def test_unsupported_layout(data, metric):
+    assert read_layout(io.BytesIO(data), metric) is None
+
+
+@pytest.mark.parametrize('version', [2, 3])
+def test_extraction_max_cycle(tmp_path, version):
+    path = str(tmp_path / 'ExtractionMetricsOut.bin')
+    write(path, extraction_header(version))
+    assert read_extraction_max_cycle(path) == 0
+
+    # Tiles of the previous cycle still being extracted after the last cycle
+    write(path, *(extraction_record(version, 1, tile, cycle) for cycle in (1, 2, 3) for tile in (1101, 1102)),
+          extraction_record(version, 1, 1103, 2), mode='ab')
+    assert read_extraction_max_cycle(path) == 3
+
+    # A record being written is ignored
+    write(path, extraction_record(version, 1, 1101, 4)[:-1], mode='ab')
+    assert read_extraction_max_cycle(path) == 3
+
+
+def test_extraction_max_cycle_tail(tmp_path):
+    path = str(tmp_path / 'ExtractionMetricsOut.bin')
+    write(path, extraction_header(3), *(extraction_record(3, 1, 1101, cycle) for cycle in range(1, 101)))
+    assert read_extraction_max_cycle(path, tail_records=10) == 100
+
+
+def test_extraction_max_cycle_unreadable(tmp_path):
+    assert read_extraction_max_cycle(str(tmp_path / 'missing.bin')) is None
+
+    path = str(tmp_path / 'ExtractionMetricsOut.bin')
+    write(path, bytes([9, 20]))
+    assert read_extraction_max_cycle(path) is None
@@ -0,0 +1,55 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Tests of the event log of the status changes: resume tokens, and a log created before a fork
+      (gunicorn --preload) starting over in the worker process.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+
+import pytest
+
+from API.status.events import EventLog
+
+
+def test_resume_token():
+    log = EventLog()
+    log.publish({'MiSeq1': {'status': 'running', 'last_cycle': 1}})
+    log.publish({'MiSeq1': {'status': 'running', 'last_cycle': 1}})
+    log.publish({'MiSeq1': {'status': 'running', 'last_cycle': 2}})
+
+    last_id, events = log.current()
+    assert last_id == 2
+    assert log.parse_token(events[0][0]) == 2
+    assert log.parse_token('%s-1' % log.epoch) == 1
+    assert log.parse_token('%s-3' % log.epoch) is None
+    assert log.parse_token('0-1') is None
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork() not available')
+def test_new_epoch_after_fork():
+    log = EventLog()
+    log.publish({'MiSeq1': {'status': 'running', 'last_cycle': 1}})
+    token = log.current()[1][0][0]
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Worker: a token of the master (or of another worker) leads to a resync
+        ok = log.epoch != token.rpartition('-')[0] and log.parse_token(token) is None and log.current() == (0, [])
+        os.write(write_fd, b'1' if ok else b'0')
+        os._exit(0)
+
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 1) == b'1'
+    os.close(read_fd)
+    assert log.parse_token(token) == 1
@@ -0,0 +1,204 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Tests of the incremental reading of the live runs: records appended between 2 reads, records being written,
+      rewritten files, and the aggregates of the accumulator against a full parsing by the InterOP library.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+
+import numpy as np
+import pytest
+
+from API.status.lib.incremental import MetricFile, RunAccumulator
+from interop_writers import Q_BINS, q_header, q_record, extraction_header, extraction_record, write
+
+
+@pytest.fixture
+def run_dir(tmp_path):
+    """Empty run folder, with its InterOp directory"""
+    os.makedirs(str(tmp_path / 'InterOp'))
+    return str(tmp_path)
+
+
+def q_path(run_dir):
+    return os.path.join(run_dir, 'InterOp', 'QMetricsOut.bin')
+
+
+def extraction_path(run_dir):
+    return os.path.join(run_dir, 'InterOp', 'ExtractionMetricsOut.bin')
+
+
+@pytest.mark.parametrize('version', [6, 7])
+def test_append_then_reread(run_dir, version):
+    path = q_path(run_dir)
+    metric_file = MetricFile(path, 'Q')
+    write(path, q_header(version), q_record(version, 1, 1101, 1, [1] * 7), q_record(version, 1, 1102, 1, [2] * 7))
+
+    records, reset = metric_file.read_new_records()
+    assert not reset
+    assert records['cycle'].tolist() == [1, 1]
+    assert records['tile'].tolist() == [1101, 1102]
+
+    # Only the appended records are read
+    write(path, q_record(version, 1, 1101, 2, [3] * 7), mode='ab')
+    records, reset = metric_file.read_new_records()
+    assert not reset
+    assert records['cycle'].tolist() == [2]
+    assert records['hist'].tolist() == [[3] * 7]
+
+    # Nothing appended
+    records, reset = metric_file.read_new_records()
+    assert not reset
+    assert records.size == 0
+
+
+def test_record_being_written(run_dir):
+    path = extraction_path(run_dir)
+    metric_file = MetricFile(path, 'Extraction')
+    record = extraction_record(3, 1, 1101, 2)
+    write(path, extraction_header(3), extraction_record(3, 1, 1101, 1), record[:5])
+
+    records, _ = metric_file.read_new_records()
+    assert records['cycle'].tolist() == [1]
+
+    # The end of the record is read with the next one
+    write(path, record[5:], extraction_record(3, 1, 1101, 3), mode='ab')
+    records, _ = metric_file.read_new_records()
+    assert records['cycle'].tolist() == [2, 3]
+
+
+def test_rewritten_file(run_dir):
+    path = extraction_path(run_dir)
+    metric_file = MetricFile(path, 'Extraction')
+    write(path, extraction_header(3), *(extraction_record(3, 1, 1101, cycle) for cycle in (1, 2, 3)))
+    metric_file.read_new_records()
+
+    # Shorter file: read again from its start
+    write(path, extraction_header(3), extraction_record(3, 1, 1101, 1))
+    records, reset = metric_file.read_new_records()
+    assert reset
+    assert records['cycle'].tolist() == [1]
+
+    # Rewritten with another format version, longer than the consumed offset
+    write(path, extraction_header(2), extraction_record(2, 1, 1101, 5), extraction_record(2, 1, 1101, 6)[:14])
+    records, reset = metric_file.read_new_records()
+    assert reset
+    assert records['cycle'].tolist() == [5]
+
+
+def test_missing_and_unknown_files(run_dir):
+    path = q_path(run_dir)
+    metric_file = MetricFile(path, 'Q')
+    assert metric_file.read_new_records() == (None, False)
+
+    # Header being written
+    write(path, bytes([7]))
+    assert metric_file.read_new_records() == (None, False)
+    assert metric_file.supported
+
+    write(path, bytes([5, 206]) + bytes(206))
+    assert metric_file.read_new_records() == (None, False)
+    assert not metric_file.supported
+
+    # Removed after being read
+    os.remove(path)
+    write(path, q_header(7), q_record(7, 1, 1101, 1, [1] * 7))
+    metric_file.read_new_records()
+    os.remove(path)
+    assert metric_file.read_new_records() == (None, True)
+
+
+def test_accumulator(run_dir):
+    accumulator = RunAccumulator(run_dir)
+    hist = [0, 0, 10, 10, 40, 30, 10]
+    write(q_path(run_dir), q_header(7), q_record(7, 1, 1101, 1, hist), q_record(7, 1, 1102, 1, hist))
+    write(extraction_path(run_dir), extraction_header(3), extraction_record(3, 1, 1101, 1), extraction_record(3, 1, 1102, 1))
+
+    assert accumulator.update()
+    assert accumulator.last_cycle == 1
+    assert accumulator.bins == Q_BINS
+    assert accumulator.percent_gt_q30() == pytest.approx(80)
+    assert accumulator.yield_g() == pytest.approx(200 / 1e9)
+
+    # 2nd cycle appended, lower quality
+    write(q_path(run_dir), q_record(7, 1, 1101, 2, [0, 0, 50, 50, 0, 0, 0]), mode='ab')
+    write(extraction_path(run_dir), extraction_record(3, 1, 1101, 2), mode='ab')
+    assert accumulator.update()
+    assert accumulator.last_cycle == 2
+    assert accumulator.q_hist.shape == (3, len(Q_BINS))
+    assert accumulator.percent_gt_q30() == pytest.approx(160 / 300 * 100)
+    assert accumulator.percent_gt_q30(excluded_cycles=[2]) == pytest.approx(80)
+    assert accumulator.yield_g(excluded_cycles=[2, 99]) == pytest.approx(200 / 1e9)
+
+    # One bar per non-empty bin, from the lower bound of the bin
+    x, y, width = accumulator.qscore_bars()
+    assert x == [20, 25, 30, 35, 40]
+    assert y == pytest.approx([70 / 1e6, 70 / 1e6, 80 / 1e6, 60 / 1e6, 20 / 1e6])
+    assert width == [5, 5, 5, 5, 2]
+
+    # Same aggregates as a new accumulator reading the whole files
+    reread = RunAccumulator(run_dir)
+    assert reread.update()
+    np.testing.assert_array_equal(reread.q_hist, accumulator.q_hist)
+    assert reread.last_cycle == accumulator.last_cycle
+
+
+def test_accumulator_rewritten_q_file(run_dir):
+    accumulator = RunAccumulator(run_dir)
+    write(q_path(run_dir), q_header(6), *(q_record(6, 1, 1101, cycle, [1] * 7) for cycle in (1, 2, 3)))
+    write(extraction_path(run_dir), extraction_header(2), extraction_record(2, 1, 1101, 3))
+    accumulator.update()
+
+    write(q_path(run_dir), q_header(6), q_record(6, 1, 1101, 1, [2] * 7))
+    accumulator.update()
+    assert accumulator.q_hist.sum() == 14
+
+
+def test_accumulator_unbinned(run_dir):
+    accumulator = RunAccumulator(run_dir)
+    write(q_path(run_dir), q_header(6, binned=False), q_record(6, 1, 1101, 1, [1] * 50))
+    write(extraction_path(run_dir), extraction_header(3), extraction_record(3, 1, 1101, 1))
+    # InterOP is used for the unbinned Q scores
+    assert not accumulator.update()
+
+
+@pytest.mark.parametrize('instrument', ['NextSeq', 'NovaSeq'])
+def test_live_run_matches_interop(tmp_path, instrument):
+    """The live aggregates of a growing run match a full parsing by the InterOP library, after each append"""
+    pytest.importorskip('interop')
+    from API.status.main import collect_run_metrics
+    from API.status.lib.incremental import get_accumulator, drop_accumulator
+    from benchmarks.synthetic_run import SyntheticRun
+
+    run = SyntheticRun(str(tmp_path), instrument, tiles=4, seed=1)
+    run.create()
+    try:
+        for last_cycle in (5, 12, 40):
+            run.write_cycles(last_cycle)
+            live, full = {}, {}
+            assert collect_run_metrics(instrument, run.run_dir, live, is_live=True)['last_cycle'] == last_cycle
+            # Served by the accumulator, not by its fallback on InterOP
+            accumulator = get_accumulator(run.run_dir)
+            assert accumulator.q_file.supported and accumulator.extraction_file.supported and accumulator.bins
+            collect_run_metrics(instrument, run.run_dir, full, is_live=False)
+
+            for key in ('p_gt_q30', 'total_yield', 'last_cycle'):
+                assert live[key] == full[key]
+            live_series = live['q30_plot']['data']['charts']['series']['data']
+            full_series = full['q30_plot']['data']['charts']['series']['data']
+            assert len(live_series) == len(full_series)
+            for live_bar, full_bar in zip(live_series, full_series):
+                assert [value is None for value in live_bar['data']] == [value is None for value in full_bar['data']]
+                assert [v for v in live_bar['data'] if v is not None] == \
+                    pytest.approx([v for v in full_bar['data'] if v is not None], rel=1e-6)
+    finally:
+        drop_accumulator(run.run_dir)
@@ -0,0 +1,82 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Tests of the lane-chunked SAV export (--chunked): same outputs as the default export, in each format.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('interop')
+pytest.importorskip('pandas')
+
+from API.SAV_data.generate_SAV_data import export_run
+from benchmarks.synthetic_run import SyntheticRun
+
+
+@pytest.fixture(scope='module')
+def run(tmp_path_factory):
+    """Live NextSeq run of 4 lanes, at cycle 6"""
+    run = SyntheticRun(str(tmp_path_factory.mktemp('NextSeq1')), 'NextSeq', tiles=2, seed=1)
+    run.create()
+    run.write_cycles(6)
+    return run
+
+
+def export(run, directory, output_format, chunked):
+    """Exports the run to a new output directory, returning its path (ending with a '/')"""
+    output_dir = str(directory / ('chunked' if chunked else 'full')) + '/'
+    os.makedirs(output_dir)
+    export_run(run.run_dir, output_dir, output_format, chunked)
+    return output_dir
+
+
+def load_columns(output_dir):
+    """Loads the header & the columns of a binary SAV export"""
+    with open(output_dir + 'SAV_data.json') as f:
+        header = json.load(f)
+
+    keys = [column['key'] for column in header['columns']]
+    if header['format'] == 'npy':
+        columns = {key: np.load(os.path.join(output_dir + header['path'], key + '.npy')) for key in keys}
+    else:
+        with np.load(output_dir + header['path']) as archive:
+            columns = {key: archive[key] for key in keys}
+    return header, columns
+
+
+def test_chunked_csv(run, tmp_path):
+    full = export(run, tmp_path, 'csv', chunked=False)
+    chunked = export(run, tmp_path, 'csv', chunked=True)
+
+    with open(full + 'SAV_data.csv') as f:
+        expected = f.read()
+    with open(chunked + 'SAV_data.csv') as f:
+        assert f.read() == expected
+    # Every lane exported
+    assert len(expected.splitlines()) > run.lanes
+    with open(full + 'Run_summary.json') as f, open(chunked + 'Run_summary.json') as g:
+        assert json.load(f) == json.load(g)
+
+
+@pytest.mark.parametrize('output_format', ['npy', 'npz'])
+def test_chunked_columns(run, tmp_path, output_format):
+    full_header, full_columns = load_columns(export(run, tmp_path, output_format, chunked=False))
+    chunked_header, chunked_columns = load_columns(export(run, tmp_path, output_format, chunked=True))
+
+    assert chunked_header == full_header
+    assert set(np.unique(full_columns['000'])) == set(range(1, run.lanes + 1))
+    for key, values in full_columns.items():
+        assert chunked_columns[key].dtype == np.float32
+        np.testing.assert_array_equal(chunked_columns[key], values)
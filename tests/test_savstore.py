@@ -0,0 +1,119 @@
+"""
+Resume:
+    InterOP API - Parsing & serving the InterOP data
+
+Description:
+      Tests of the imaging table store shared by the workers: versions published by a symlink swap,
+      a single build per run across the processes, and the readers of a version being replaced.
+
+Author(s):
+    Steeve Fourneaux
+Date(s):
+    2022
+Credits:
+    Steeve Fourneaux
+"""
+import os
+import shutil
+import concurrent.futures
+
+import pytest
+
+pytest.importorskip('interop')
+
+from API.status.lib.savstore import SavStore
+from benchmarks.synthetic_run import SyntheticRun
+
+
+class CountingStore(SavStore):
+    """Store counting its builds"""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.builds = 0
+
+    def build(self, run_dir, fingerprint=None):
+        self.builds += 1
+        return super().build(run_dir, fingerprint)
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Live NextSeq run, at cycle 5"""
+    run = SyntheticRun(str(tmp_path / 'NextSeq1'), 'NextSeq', tiles=2, seed=1)
+    run.create()
+    run.write_cycles(5)
+    return run
+
+
+def _get_builds(root, run_dir):
+    """Process job: gets a run from a new store, returning the number of builds"""
+    store = CountingStore(root)
+    assert store.get(run_dir).header['rows']
+    return store.builds
+
+
+def test_single_build_across_processes(tmp_path, run):
+    root = str(tmp_path / 'store')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        builds = list(executor.map(_get_builds, [root] * 4, [run.run_dir] * 4))
+    assert sum(builds) == 1
+
+
+def test_versions(tmp_path, run):
+    root = str(tmp_path / 'store')
+    store = CountingStore(root)
+    first = store.get(run.run_dir)
+    path = store._run_path(run.run_dir)
+    assert os.path.islink(path)
+    first_version = os.path.realpath(path)
+
+    # Unchanged run: not built again, even by another process
+    assert CountingStore(root).get(run.run_dir).header == first.header
+
+    run.write_cycles(8)
+    second = store.get(run.run_dir)
+    assert store.builds == 2
+    assert second.header['rows'] > first.header['rows']
+    # The previous version is removed, its opened memory maps staying readable
+    assert not os.path.exists(first_version)
+    assert first.query(lane=1)['Cycle'].max() == 5
+
+
+def test_replaced_version_is_a_miss(tmp_path, run):
+    root = str(tmp_path / 'store')
+    SavStore(root).get(run.run_dir)
+    store = CountingStore(root)
+
+    # Columns removed between the header & the memory maps, e.g by the build of another worker
+    version = os.path.realpath(store._run_path(run.run_dir))
+    os.remove(os.path.join(version, '000.npy'))
+    assert store.get(run.run_dir).header['rows']
+    assert store.builds == 1
+
+
+def test_plain_directory_replaced(tmp_path, run):
+    root = str(tmp_path / 'store')
+    store = CountingStore(root)
+    store.get(run.run_dir)
+
+    # Run stored as a directory, before the versions
+    path = store._run_path(run.run_dir)
+    version = os.path.realpath(path)
+    os.remove(path)
+    shutil.copytree(version, path)
+    shutil.rmtree(version)
+
+    run.write_cycles(6)
+    assert store.get(run.run_dir).query(lane=1)['Cycle'].max() == 6
+    assert os.path.islink(path)
+
+
+def test_update_skips_a_run_being_built(tmp_path, run):
+    root = str(tmp_path / 'store')
+    store = CountingStore(root)
+    with store._lock_file(run.run_dir):
+        store.update([run.run_dir])
+        assert store.builds == 0
+    store.update([run.run_dir])
+    assert store.builds == 1